@@ -0,0 +1,95 @@
+#################################
+### DOMAIN TABLE PARSER TIMES ###
+#################################
+
+
+# Dependencies
+import os
+import sys
+import time
+import random
+import argparse
+import numpy as np
+import pandas as pd
+# Local dependencies (run as script from repository root)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from modules import hmm
+
+
+# Generate a synthetic domain table, laid out as hmmsearch --domtblout does
+def table(num_rows, seed=0):
+    # Initialize random generator
+    generator = random.Random(seed)
+    # Define comment rows
+    rows = ['# target name        accession   tlen query name           accession   qlen   E-value  score  bias'
+            '   #  of  c-Evalue  i-Evalue  score  bias  from    to  from    to  from    to  acc description of target',
+            '#------------------- ---------- ----- -------------------- ---------- ----- --------- ------ -----'
+            ' --- --- --------- --------- ------ ----- ----- ----- ----- ----- ----- ----- ---- ---------------------']
+    # Define one row for each domain, with padded columns and UniProt-like description
+    for i in range(num_rows):
+        rows.append('%-20s %-10s %5d %-20s %-10s %5d %9.2g %6.1f %5.1f %3d %3d %9.2g %9.2g %6.1f %5.1f %5d %5d %5d %5d %5d %5d %4.2f %s' % (
+            'sp|P%05d|G%d_HUMAN' % (i, i), '-', 300 + i % 500, 'WW', 'PF00397.27', 31,
+            generator.random() * 1e-3, 75.1, 6.9, 1 + i % 2, 2, generator.random() * 1e-5, generator.random(),
+            36.3, 0.1, 1, 31, 171, 201, 170, 202, 0.97,
+            'Transcriptional coactivator G%d OS=Homo sapiens OX=9606 GN=G%d PE=1 SV=2' % (i, i)))
+    # Return domain table
+    return '\n'.join(rows) + '\n'
+
+
+# Parse domain table as the original row by row parser did (reference)
+def parse_rows(result, raw=False):
+    # Turn result from string to list (rows) of lists (columns)
+    result = [row.split() for row in result.split('\n') if row != '' and row[0] != '#']
+    # Define number of columns
+    columns, num_cols = list(hmm.COLUMNS), len(hmm.COLUMNS)
+    # Split target name, group description together
+    for i in range(len(result)):
+        result[i] = result[i][0].split('|') + result[i][1:]
+        result[i][num_cols - 1] = ' '.join(result[i][num_cols - 1:])
+        result[i] = result[i][:num_cols]
+    # Turn result table into DataFrame Object
+    result = pd.DataFrame(result, columns=columns)
+    # Case formatted output: take sequence accession, start, end, e-value
+    if not raw:
+        result = result[['target_name', 'align_from', 'align_to', 'dom_i_evalue']]
+        result.columns = ['entry_ac', 'seq_start', 'seq_end', 'e_value']
+    # Return parsed domain table
+    return result
+
+
+# Time the best of some runs of a function
+def best(function, num_runs):
+    # Loop through each run
+    times = list()
+    for _ in range(num_runs):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    # Return fastest run
+    return min(times)
+
+
+if __name__ == '__main__':
+
+    # 1. Define arguments
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num_rows',   type=int,   default=200000)
+    parser.add_argument('--num_runs',   type=int,   default=3)
+    parser.add_argument('--e_value',    type=float, default=0.001)
+
+    # 2. Define dictionary of args
+    args = parser.parse_args()
+
+    # 3. Generate domain table
+    result = table(args.num_rows)
+
+    # 4. Time formatted output, filtered on e-value as the CLI does (row parser needs a cast)
+    before = best(lambda: (lambda out: out[out.e_value.astype(np.float64) <= args.e_value])(
+        parse_rows(result)), args.num_runs)
+    after = best(lambda: (lambda out: out[out.e_value <= args.e_value])(hmm.parse(result)), args.num_runs)
+    print('formatted: %.3fs -> %.3fs (%.1fx)' % (before, after, before / after))
+
+    # 5. Time raw output (row parser leaves every column as string)
+    before = best(lambda: parse_rows(result, raw=True), args.num_runs)
+    after = best(lambda: hmm.parse(result, raw=True), args.num_runs)
+    print('raw:       %.3fs -> %.3fs (%.1fx)' % (before, after, before / after))
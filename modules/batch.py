@@ -0,0 +1,273 @@
+#######################################################
+### BATCH MODELS BUILDING AND SEARCH (FAMILY SCALE) ###
+#######################################################
+
+
+# Dependencies
+import os
+import sys
+import shutil
+import subprocess
+import pandas as pd
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+# Local dependencies (either run as script or imported as package)
+try:
+    from modules import cache, fasta, hmm, pssm, store
+except ImportError:
+    import cache, fasta, hmm, pssm, store
+
+
+# Available kinds of models
+PSSM = 'pssm'
+HMM = 'hmm'
+
+# Available scan algorithm (HMMSEARCH is defined in hmm module)
+HMMSCAN = 'hmmscan'
+
+# Constants
+MSA_EXTENSIONS = ('.fasta', '.fa', '.afa', '.sto', '.aln')  # Extensions of MSA files in a directory
+PRESS_CACHE_DIR = os.path.join(cache.CACHE_DIR, 'hmmdb')  # Managed pressed HMM databases
+PRESS_MAX_ENTRIES = 8  # Maximum number of pressed HMM databases kept in cache
+SCAN_RATIO = 1.0  # Models to sequences ratio above which hmmscan is preferred over hmmsearch
+COLUMNS = ['entry_ac', 'seq_start', 'seq_end', 'e_value', 'model']  # Columns of batch results
+
+
+# Retrieve multiple sequence alignments in a directory
+def read_dir(msa_dir, extensions=MSA_EXTENSIONS):
+    """
+    Input:
+        1. msa_dir:     directory containing one MSA for each family
+        2. extensions:  extensions of MSA files
+    Output:
+        1. dictionary mapping family names (file name without extension) to MSA paths
+    """
+    return {os.path.splitext(name)[0]: os.path.join(msa_dir, name)
+            for name in sorted(os.listdir(msa_dir)) if name.endswith(extensions)}
+
+
+# Build a model for each MSA (or retrieve it from models store), concurrently
+def build(msas, kind=HMM, blast_path=None, num_workers=None, store_dir=store.STORE_DIR):
+    """
+    Builders (hmmbuild, psiblast) are run as concurrent processes, dispatched by
+    a pool of threads. Models whose MSA did not change are retrieved from store.
+    Input:
+        1. msas:        dictionary mapping family names to MSA paths
+        2. kind:        kind of models to build (either PSSM or HMM)
+        3. blast_path:  path to input blast file (PSSM only)
+        4. num_workers: number of concurrent builders (default number of cores)
+        5. store_dir:   directory where models are stored
+    Output:
+        1. dictionary mapping family names to models paths
+    """
+    # Define function building a single model
+    def fit(item):
+        # Unpack family name and MSA path
+        name, msa_path = item
+        # Case PSSM model
+        if kind == PSSM:
+            return name, pssm.fit_stored(blast_path, msa_path, name=name, store_dir=store_dir)
+        # Case HMM model: name is set in model itself, as it is reported in search results
+        elif kind == HMM:
+            return name, hmm.fit_stored(msa_path, name=name, options=['-n', name], store_dir=store_dir)
+        # Error: no valid kind of model
+        raise ValueError('Error: no valid kind of model has been chosen')
+    # Build models concurrently
+    with ThreadPoolExecutor(max_workers=num_workers or os.cpu_count()) as pool:
+        return dict(pool.map(fit, msas.items()))
+
+
+# Concatenate HMM models into a single pressed database (or retrieve it from cache)
+def press(models, cache_dir=PRESS_CACHE_DIR, max_entries=PRESS_MAX_ENTRIES):
+    """
+    Input:
+        1. models:      dictionary mapping family names to HMM models paths
+        2. cache_dir:   directory where pressed databases are stored
+        3. max_entries: maximum number of pressed databases kept in cache
+    Output:
+        1. path to HMM database (concatenated models, pressed for hmmscan)
+    """
+    # Define key of the database: content of each model
+    key = cache.hash_key(sorted((name, cache.hash_file(path)) for name, path in models.items()))
+    # Define path to database
+    db_path = os.path.join(cache.entry_path(cache_dir, key), 'models.hmm')
+    # Case database has not been already built
+    if cache.lookup(cache_dir, key) is None:
+        # Concatenate models into a single file
+        with open(os.path.join(cache.create(cache_dir, key), 'models.hmm'), 'wb') as db_file:
+            for name in sorted(models.keys()):
+                with open(models[name], 'rb') as model_file:
+                    shutil.copyfileobj(model_file, db_file)
+        # Press database (binary files used by hmmscan)
+        subprocess.run(['hmmpress', '-f', db_path], stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
+        # Mark database as complete
+        cache.commit(cache_dir, key, {'names': sorted(models.keys())})
+    # Remove least recently used databases
+    cache.evict(cache_dir, max_entries=max_entries)
+    # Return path to database
+    return db_path
+
+
+# Choose scan algorithm, according to the number of models and sequences
+def choose(num_models, num_seqs, ratio=SCAN_RATIO):
+    """
+    HMMSEARCH streams the test set once for each model, while HMMSCAN streams
+    the models database once for each sequence: the former is preferred when
+    sequences outnumber models (e.g. families against a proteome)
+    Input:
+        1. num_models:  number of models
+        2. num_seqs:    number of sequences in test set
+        3. ratio:       models to sequences ratio above which HMMSCAN is chosen
+    Output:
+        1. either HMMSEARCH or HMMSCAN
+    """
+    return HMMSCAN if num_models > ratio * num_seqs else hmm.HMMSEARCH
+
+
+# Scan sequences against an HMM database, return domain table as HMMSEARCH would
+def scan(db_path, test_path, options=()):
+    """
+    HMMSCAN domain table reports models as targets and sequences as queries:
+    target and query columns (name, accession, length) are swapped, so that
+    the domain table is parse() compatible. Alignment coordinates already refer
+    to sequences, while HMM coordinates refer to models. Note that sequence and
+    independent domain e-values are comparable to HMMSEARCH ones only if the
+    number of sequences is set as database size (-Z)
+    Input:
+        1. db_path:     path to pressed HMM database
+        2. test_path:   path to test set (.fasta formatted)
+        3. options:     further hmmscan options
+    Output:
+        1. domain table, as string
+    """
+    # Run hmmscan
+    out = subprocess.run([HMMSCAN, '-o', os.devnull, '--domtblout', '/dev/stdout', *options, db_path, test_path],
+                         stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
+    # Split rows into 22 fields plus description, skip comments
+    rows = [row.split(maxsplit=22) for row in out.stdout.decode('utf-8').split('\n')
+            if row.strip() and row[0] != '#']
+    # Swap target and query columns
+    return ''.join(' '.join(row[3:6] + row[0:3] + row[6:]) + '\n' for row in rows)
+
+
+# Search every HMM model against a test set, in a single pass
+def search_hmm(models, test_path, algorithm=None, cpu=1, cache_dir=PRESS_CACHE_DIR):
+    """
+    Models are concatenated (and pressed) into a single database, which is either
+    searched (HMMSEARCH) or scanned (HMMSCAN) by a single process. Test set size is
+    used as database size (-Z), hence e-values do not depend on algorithm.
+    Input:
+        1. models:      dictionary mapping family names to HMM models paths
+        2. test_path:   path to test set (.fasta formatted)
+        3. algorithm:   either HMMSEARCH or HMMSCAN (chosen automatically if not set)
+        4. cpu:         number of worker threads (--cpu)
+        5. cache_dir:   directory where pressed databases are stored
+    Output:
+        1. DataFrame of hits (entry_ac, seq_start, seq_end, e_value, model)
+    """
+    # Build models database
+    db_path = press(models, cache_dir=cache_dir)
+    # Define number of sequences in test set, choose algorithm accordingly
+    num_seqs = fasta.count(test_path)
+    algorithm = algorithm or choose(len(models), num_seqs)
+    # Define options shared by both algorithms
+    options = ['--cpu', str(cpu), '-Z', str(num_seqs)]
+    # Run either HMMSEARCH or HMMSCAN
+    if algorithm == HMMSCAN:
+        out = scan(db_path, test_path, options=options)
+    else:
+        out = hmm.test_hmmsearch(db_path, test_path, options=options).stdout.decode('utf-8')
+    # Parse domain table, model name is the query one
+    out = hmm.parse(out, raw=True)
+    out = out[['target_name', 'align_from', 'align_to', 'dom_i_evalue', 'query_name']]
+    out.columns = COLUMNS
+    # Return hits
+    return out.reset_index(drop=True)
+
+
+# Search every PSSM model against a test set, concurrently
+def search_pssm(models, test_path, num_iterations=3, e_value=0.05, num_workers=None, cache_dir=pssm.DB_CACHE_DIR):
+    """
+    Psiblast does not accept more than one PSSM, hence a process is run for each
+    model: processes are dispatched concurrently by a pool of threads, while
+    test set database is built only once.
+    Input:
+        1. models:          dictionary mapping family names to PSSM models paths
+        2. test_path:       path to test set (FASTA format)
+        3. num_iterations:  number of psi-blast iterations
+        4. e_value:         e-value threshold
+        5. num_workers:     number of concurrent psiblast processes (default number of cores)
+        6. cache_dir:       directory where BLAST databases are stored
+    Output:
+        1. DataFrame of hits (entry_ac, seq_start, seq_end, e_value, model)
+    """
+    # Build database once, before searches retrieve it from cache
+    pssm.make_db(test_path, cache_dir=cache_dir)
+    # Define function searching a single model
+    def search(item):
+        # Unpack family name and model path
+        name, model_path = item
+        # Search model, add model name to hits
+        return pssm.concat(pssm.search(model_path, test_path, num_iterations=num_iterations,
+                                       e_value=e_value, cache_dir=cache_dir)).assign(model=name)
+    # Run searches concurrently
+    with ThreadPoolExecutor(max_workers=num_workers or os.cpu_count()) as pool:
+        hits = list(pool.map(search, sorted(models.items())))
+    # Stack hits of every model
+    return pd.concat(hits, ignore_index=True) if hits else pd.DataFrame(columns=COLUMNS)
+
+
+### MAIN
+if __name__ == '__main__':
+
+    # 1. Define arguments
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--kind',           type=str,   default=HMM)
+    parser.add_argument('--msa_dir',        type=str,   default='data/msa')
+    parser.add_argument('--blast_path',     type=str,   default='data/blast.fasta')
+    parser.add_argument('--test_path',      type=str,   default='data/human.fasta')
+    parser.add_argument('--out_path',       type=str)
+    parser.add_argument('--algorithm',      type=str)
+    parser.add_argument('--num_iterations', type=int,   default=3)
+    parser.add_argument('--e_value',        type=float, default=0.001)
+    parser.add_argument('--num_workers',    type=int)
+    parser.add_argument('--cpu',            type=int,   default=1)
+    parser.add_argument('--store_dir',      type=str,   default=store.STORE_DIR)
+
+    # 2. Define dictionary of args
+    args = parser.parse_args()
+
+    # 3. Build and search models
+    try:
+
+        # Retrieve MSAs
+        msas = read_dir(args.msa_dir)
+        # Build models (skipped for unchanged MSAs)
+        models = build(msas, kind=args.kind, blast_path=args.blast_path,
+                       num_workers=args.num_workers, store_dir=args.store_dir)
+
+        # Case PSSM models: search each model concurrently
+        if args.kind == PSSM:
+            out = search_pssm(models, args.test_path, num_iterations=args.num_iterations,
+                              e_value=args.e_value, num_workers=args.num_workers)
+        # Case HMM models: search every model in a single pass
+        elif args.kind == HMM:
+            out = search_hmm(models, args.test_path, algorithm=args.algorithm, cpu=args.cpu)
+        # Error: no valid kind of model has been chosen
+        else:
+            sys.exit('Error: no valid kind of model has been chosen')
+
+        # Filter on e-value (hits whose e-value equals threshold are kept)
+        out = out[out.e_value <= args.e_value]
+
+        # Case out path has been set: write to file
+        if args.out_path:
+            out.to_csv(args.out_path, index=False, sep='\t')
+        # Case out path has not been set: write to console
+        else:
+            print(out.to_string())
+
+    # Catch eventual errors
+    except subprocess.CalledProcessError as e:
+        # Exit with error
+        sys.exit(e.stderr.decode('utf-8').strip())
@@ -0,0 +1,182 @@
+#####################################
+### CONTENT ADDRESSED LOCAL CACHE ###
+#####################################
+
+
+# Dependencies
+import os
+import time
+import json
+import fcntl
+import shutil
+import hashlib
+import contextlib
+
+
+# Constants
+CACHE_DIR = 'cache'  # Default root directory for cached entries
+META_FILE = 'meta.json'  # Metadata file, written last: marks an entry as complete
+LOCK_EXT = '.lock'  # Extension of lock files, stored next to (not within) entry directories
+CHUNK_SIZE = 1 << 20  # Size of chunks read while hashing files (1MB)
+
+
+# Compute hash of a file content
+def hash_file(path, chunk_size=CHUNK_SIZE):
+    """
+    Input:
+        1. path:        path to file whose content must be hashed
+        2. chunk_size:  number of bytes read at once
+    Output:
+        1. hexadecimal sha256 digest of file content
+    """
+    # Initialize hash
+    digest = hashlib.sha256()
+    # Read file in chunks, without loading it in memory
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            digest.update(chunk)
+    # Return digest
+    return digest.hexdigest()
+
+
+# Compute hash of a string or bytes
+def hash_bytes(content):
+    # Encode string content
+    content = content.encode('utf-8') if isinstance(content, str) else content
+    # Return digest
+    return hashlib.sha256(content).hexdigest()
+
+
+# Compute a cache key from an arbitrary set of (JSON serializable) parts
+def hash_key(*parts):
+    """
+    Input:
+        1. *parts:  file hashes, options, ... (must be JSON serializable)
+    Output:
+        1. hexadecimal sha256 digest identifying the given parts
+    """
+    return hash_bytes(json.dumps(parts, sort_keys=True, default=str))
+
+
+# Define path to a cache entry
+def entry_path(cache_dir, key):
+    return os.path.join(cache_dir, key)
+
+
+# Retrieve metadata of a complete cache entry
+def lookup(cache_dir, key):
+    """
+    Input:
+        1. cache_dir:   root directory of the cache
+        2. key:         key of the entry
+    Output:
+        1. entry metadata (dict) if entry is complete, None otherwise
+    """
+    # Define path to metadata file
+    meta_path = os.path.join(entry_path(cache_dir, key), META_FILE)
+    # Case entry is missing or incomplete
+    if not os.path.isfile(meta_path):
+        return None
+    # Update entry access time (used for eviction)
+    os.utime(meta_path)
+    # Load metadata
+    with open(meta_path, 'r') as meta_file:
+        return json.load(meta_file)
+
+
+# Hold an exclusive lock on an entry, so that concurrent processes do not build it twice
+@contextlib.contextmanager
+def lock(cache_dir, key):
+    """
+    Lock file lives outside the entry directory, hence it survives create(...)
+    Input:
+        1. cache_dir:   root directory of the cache
+        2. key:         key of the entry
+    Output:
+        1. context manager, blocking until the lock is acquired
+    """
+    # Make cache directory, if missing
+    os.makedirs(cache_dir, exist_ok=True)
+    # Open lock file, then wait for exclusive lock
+    with open(entry_path(cache_dir, key) + LOCK_EXT, 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        # Release lock once done, even on failure
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+# Create (or clean up) an entry directory, before filling it
+def create(cache_dir, key):
+    # Define entry path
+    path = entry_path(cache_dir, key)
+    # Remove leftovers of previously interrupted builds
+    shutil.rmtree(path, ignore_errors=True)
+    # Make entry directory
+    os.makedirs(path)
+    # Return path to entry directory
+    return path
+
+
+# Mark an entry as complete, by writing its metadata
+def commit(cache_dir, key, meta):
+    # Define metadata path
+    meta_path = os.path.join(entry_path(cache_dir, key), META_FILE)
+    # Write metadata to temporary file first, then move it (atomic)
+    with open(meta_path + '.tmp', 'w') as meta_file:
+        json.dump({**meta, 'key': key, 'created': time.time()}, meta_file)
+    os.replace(meta_path + '.tmp', meta_path)
+    # Return metadata
+    return meta
+
+
+# List all complete entries in cache
+def entries(cache_dir):
+    """
+    Input:
+        1. cache_dir:   root directory of the cache
+    Output:
+        1. list of (key, metadata, last access time) tuples, most recently used first
+    """
+    # Define output container
+    found = list()
+    # Check that cache directory exists
+    if not os.path.isdir(cache_dir):
+        return found
+    # Loop through each entry
+    for key in os.listdir(cache_dir):
+        # Define path to metadata file
+        meta_path = os.path.join(cache_dir, key, META_FILE)
+        # Skip incomplete entries
+        if not os.path.isfile(meta_path): continue
+        # Load metadata
+        with open(meta_path, 'r') as meta_file:
+            found.append((key, json.load(meta_file), os.path.getmtime(meta_path)))
+    # Return entries sorted by last access
+    return sorted(found, key=lambda entry: entry[2], reverse=True)
+
+
+# Remove stale and least recently used entries
+def evict(cache_dir, max_entries=None, is_stale=lambda meta: False):
+    """
+    Input:
+        1. cache_dir:   root directory of the cache
+        2. max_entries: maximum number of entries to keep (None means no limit)
+        3. is_stale:    function returning True if an entry (given its metadata) must be removed
+    Output:
+        1. list of evicted keys
+    """
+    # Define evicted keys container and number of kept entries
+    evicted, kept = list(), 0
+    # Loop through complete entries, most recently used first
+    for key, meta, _ in entries(cache_dir):
+        # Check if current entry must be kept
+        if not is_stale(meta) and (max_entries is None or kept < max_entries):
+            kept += 1
+            continue
+        # Remove entry
+        shutil.rmtree(entry_path(cache_dir, key), ignore_errors=True)
+        evicted.append(key)
+    # Return evicted keys
+    return evicted
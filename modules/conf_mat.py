@@ -5,10 +5,16 @@
 
 # Dependencies
 import numpy as np
+import pandas as pd
 import matplotlib.pyplot as plt
 import seaborn as sns
 
 
+# Evaluation levels
+PROTEIN = 'protein'
+RESIDUE = 'residue'
+
+
 # Generate confusion matrix
 def compute(positive, negative, pred_positive, pred_negative):
 # def get_conf_matrix(ensemble_df, positve_path, negative_path):
@@ -31,8 +37,14 @@ def compute(positive, negative, pred_positive, pred_negative):
     fp = len(negative & pred_positive)
     tn = len(negative & pred_negative)
     fn = len(positive & pred_negative)
+    # Return either the matrix and the statistics
+    return _statistics(tp, fp, tn, fn)
+
+
+# Fill confusion matrix and compute statistics from its entries
+def _statistics(tp, fp, tn, fn):
     # Fill confusion matrix entries
-    conf_mat = np.empty(shape=(2,2), dtype=np.int)
+    conf_mat = np.empty(shape=(2,2), dtype=np.int64)
     conf_mat[1, 0], conf_mat[1, 1] = tp, fp
     conf_mat[0, 0], conf_mat[0, 1] = fn, tn
 
@@ -46,6 +58,192 @@ def compute(positive, negative, pred_positive, pred_negative):
     return conf_mat, precision, recall, accuracy, weighted_accuracy
 
 
+# Turn matching ranges (e.g. 291..320,337..366) into domain intervals
+def matches(protein_matching):
+    """
+    Input:
+        1. protein_matching:    dataframe (entry_ac, matches), where matches is a comma separated
+                                list of start..end ranges (as in data/protein_matching.tsv),
+                                or of single residues (covering that residue only)
+    Output:
+        1. dataframe (entry_ac, seq_start, seq_end), one row for each range, where
+           seq_end is excluded (as positions sets built from ranges in models notebook)
+    """
+    # Split ranges, one for each row
+    ranges = protein_matching[['entry_ac', 'matches']].dropna()
+    ranges = ranges.assign(matches=ranges['matches'].astype(str).str.split(',')).explode('matches')
+    ranges = ranges[ranges['matches'].str.len() > 0]
+    # Split start and end of each range (single residues, without separator, end right after start)
+    bounds = ranges['matches'].astype(str).str.partition('..').reindex(columns=[0, 1, 2])
+    starts = bounds[0].values.astype(np.int64)
+    ends = np.where(bounds[1].values == '..', bounds[2].values, starts + 1).astype(np.int64)
+    # Return intervals
+    return pd.DataFrame({'entry_ac': ranges['entry_ac'].values, 'seq_start': starts, 'seq_end': ends},
+                        columns=['entry_ac', 'seq_start', 'seq_end'])
+
+
+# Locate intervals within the concatenated residues of every protein
+def _locate(proteins, intervals):
+    # Define offsets of each protein
+    lengths = proteins['len'].values.astype(np.int64)
+    offsets = np.concatenate([[0], np.cumsum(lengths)])
+    # Retrieve protein of each interval, skip unknown ones
+    index = pd.Index(proteins['entry_ac']).get_indexer(intervals['entry_ac'])
+    known = index >= 0
+    index = index[known]
+    # Clip intervals within their own protein (positions start from 1)
+    starts = np.clip(intervals['seq_start'].values[known].astype(np.int64), 1, lengths[index] + 1)
+    ends = np.clip(intervals['seq_end'].values[known].astype(np.int64), 1, lengths[index] + 1)
+    ends = np.maximum(starts, ends)
+    # Return offsets, protein and known intervals mask, then intervals bounds within concatenated residues
+    return offsets, index, known, offsets[index] + starts - 1, offsets[index] + ends - 1
+
+
+# Lay out positions covered by intervals over the whole proteome
+def coverage(proteins, intervals):
+    """
+    Residues of every protein are concatenated into a single boolean array:
+    residues of the i-th protein (positions from 1 to its length) lie
+    between offsets[i] and offsets[i + 1]
+    Input:
+        1. proteins:    dataframe (entry_ac, len), one row for each protein
+        2. intervals:   dataframe (entry_ac, seq_start, seq_end), where seq_end is excluded
+                        (intervals of proteins not in <proteins> are ignored)
+    Output:
+        1. boolean array, true for each residue covered by at least one interval
+        2. array of offsets, one for each protein plus the total number of residues
+        3. boolean array, true for each protein having at least one residue covered
+           (empty intervals do not match their protein)
+    """
+    # Locate intervals within the concatenated residues
+    offsets, index, _, begins, ends = _locate(proteins, intervals)
+    # Mark coverage changes (+1 on start, -1 on end), then sum them up
+    changes = np.bincount(begins, minlength=offsets[-1] + 1) - np.bincount(ends, minlength=offsets[-1] + 1)
+    covered = np.cumsum(changes)[:-1] > 0
+    # Mark proteins having at least one non-empty interval
+    matched = np.bincount(index[begins < ends], minlength=offsets.shape[0] - 1) > 0
+    # Return coverage, offsets and matched proteins
+    return covered, offsets, matched
+
+
+# Sum boolean values of each protein
+def _count(values, offsets):
+    # Compute cumulative sum, then take difference between protein boundaries
+    cumsum = np.concatenate([[0], np.cumsum(values)])
+    return cumsum[offsets[1:]] - cumsum[offsets[:-1]]
+
+
+# Evaluate predicted intervals against true ones, at residue and protein level
+def evaluate(proteins, true_intervals, pred_intervals):
+    """
+    True and predicted intervals are laid out as boolean coverage arrays over
+    the whole proteome (see coverage(...)), so that confusion matrix entries
+    are computed in a few vectorized passes instead of set operations.
+    A protein is positive if it has at least one residue covered.
+    Input:
+        1. proteins:        dataframe (entry_ac, len), one row for each protein
+        2. true_intervals:  dataframe (entry_ac, seq_start, seq_end) of true domains
+        3. pred_intervals:  dataframe (entry_ac, seq_start, seq_end) of predicted domains
+    Output:
+        1. residue level (conf_mat, precision, recall, accuracy, weighted_accuracy), as compute(...)
+        2. protein level (conf_mat, precision, recall, accuracy, weighted_accuracy), as compute(...)
+        3. dataframe (entry_ac, tp, fp, tn, fn) of residue level entries for each protein
+    """
+    # Compute true and predicted coverage
+    true_covered, offsets, true_matched = coverage(proteins, true_intervals)
+    pred_covered, _, pred_matched = coverage(proteins, pred_intervals)
+    # Compute residue level entries for each protein
+    residues = pd.DataFrame({
+        'entry_ac': proteins['entry_ac'].values,
+        'tp': _count(true_covered & pred_covered, offsets),
+        'fp': _count(~true_covered & pred_covered, offsets),
+        'tn': _count(~true_covered & ~pred_covered, offsets),
+        'fn': _count(true_covered & ~pred_covered, offsets)
+    })
+    # Compute residue level statistics
+    residue_level = _statistics(*[int(residues[entry].sum()) for entry in ('tp', 'fp', 'tn', 'fn')])
+    # Compute protein level statistics
+    protein_level = _statistics(int(np.sum(true_matched & pred_matched)), int(np.sum(~true_matched & pred_matched)),
+                                int(np.sum(~true_matched & ~pred_matched)), int(np.sum(true_matched & ~pred_matched)))
+    # Return statistics
+    return residue_level, protein_level, residues
+
+
+# Compute area under a curve (trapezoidal rule)
+def _area(x, y):
+    return float(np.sum(np.diff(x) * (y[1:] + y[:-1]) / 2))
+
+
+# Compute evaluation curves over every e-value threshold, in a single pass
+def curves(proteins, true_intervals, hits, level=PROTEIN):
+    """
+    Each item (either protein or residue) is scored with the lowest e-value of
+    the hits covering it, then items are sorted once by score: confusion matrix
+    entries at every distinct threshold (items scoring less or equal are
+    predicted positive) are cumulative sums over sorted items.
+    Input:
+        1. proteins:        dataframe (entry_ac, len), one row for each protein
+        2. true_intervals:  dataframe (entry_ac, seq_start, seq_end) of true domains
+        3. hits:            dataframe (entry_ac, seq_start, seq_end, e_value) of predicted domains,
+                            retrieved at the loosest e-value threshold
+        4. level:           either PROTEIN or RESIDUE
+    Output:
+        1. dataframe (threshold, tp, fp, tn, fn, precision, recall, accuracy, weighted_accuracy, fpr),
+           one row for each distinct e-value threshold (undefined statistics are NaN)
+        2. area under ROC curve (recall against false positive rate)
+        3. area under precision-recall curve (average precision)
+    """
+    # Compute true coverage
+    true_covered, offsets, true_matched = coverage(proteins, true_intervals)
+    # Locate hits, retrieve their e-values
+    _, index, known, begins, ends = _locate(proteins, hits)
+    e_values = hits['e_value'].values[known].astype(np.float64)
+    # Case protein level: score each protein with its best hit
+    if level == PROTEIN:
+        labels = true_matched
+        scores = np.full(labels.shape, np.inf)
+        np.minimum.at(scores, index[begins < ends], e_values[begins < ends])
+    # Case residue level: score each residue with the best hit covering it
+    elif level == RESIDUE:
+        labels = true_covered
+        scores = np.full(labels.shape, np.inf)
+        # Expand hits into covered residues
+        lengths = ends - begins
+        residues = np.arange(lengths.sum()) + np.repeat(begins - (np.cumsum(lengths) - lengths), lengths)
+        np.minimum.at(scores, residues, np.repeat(e_values, lengths))
+    # Error: no valid level has been chosen
+    else:
+        raise ValueError('Error: no valid evaluation level has been chosen')
+    # Define number of actually positive and negative items
+    positives = int(labels.sum())
+    negatives = labels.shape[0] - positives
+    # Sort items by score, keep only scored ones
+    order = np.argsort(scores, kind='mergesort')
+    scores, labels = scores[order], labels[order]
+    scores, labels = scores[np.isfinite(scores)], labels[np.isfinite(scores)]
+    # Compute true and false positives at each item, keep last item for each threshold
+    last = np.append(scores[1:] != scores[:-1], True) if scores.shape[0] else np.zeros(0, dtype=bool)
+    tp, fp = np.cumsum(labels)[last], np.cumsum(~labels)[last]
+    tn, fn = negatives - fp, positives - tp
+    # Compute statistics (undefined ones are NaN)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        precision = tp / (tp + fp)
+        recall = tp / np.float64(positives)
+        fpr = fp / np.float64(negatives)
+        accuracy = (tp + tn) / np.float64(positives + negatives)
+        weighted_accuracy = (recall + tn / np.float64(negatives)) / 2
+    # Define curves
+    curve = pd.DataFrame({'threshold': scores[last], 'tp': tp, 'fp': fp, 'tn': tn, 'fn': fn,
+                          'precision': precision, 'recall': recall, 'accuracy': accuracy,
+                          'weighted_accuracy': weighted_accuracy, 'fpr': fpr})
+    # Compute area under ROC curve, from no item to every item predicted positive
+    roc_auc = _area(np.concatenate([[0], fpr, [1]]), np.concatenate([[0], recall, [1]]))
+    # Compute area under precision-recall curve (step-wise, as average precision)
+    pr_auc = float(np.sum(np.diff(np.concatenate([[0], recall])) * precision))
+    # Return curves and areas
+    return curve, roc_auc, pr_auc
+
+
 # Show confusion matrix
 def plot(positive, negative, pred_positive, pred_negative, ax=None):
 
@@ -55,7 +253,7 @@ def plot(positive, negative, pred_positive, pred_negative, ax=None):
     )
 
     # Format output text
-    out_mat = conf_mat.astype(np.unicode_)
+    out_mat = conf_mat.astype(np.str_)
     for i in range(out_mat.shape[0]):
         for j in range(out_mat.shape[1]):
             out_mat[i, j] = format(conf_mat[i, j], 'd')
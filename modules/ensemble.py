@@ -4,75 +4,357 @@
 
 
 # Dependencies
+import os
+import sys
+import heapq
 import argparse
+import itertools
 import pandas as pd
 import numpy as np
-from sklearn.cluster import DBSCAN
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from operator import itemgetter
+from concurrent.futures import ProcessPoolExecutor
+
+
+# Constants
+EPS = 0.4  # Maximum distance (1 - Jaccard index) between two domains in the same cluster
+CHUNK_SIZE = 100000  # Approximate number of domains in each chunk processed by a worker
+BLOCK_SIZE = 10000000  # Maximum number of values held at once while computing distances between intervals
+COLUMNS = ['entry_ac', 'label', 'seq_start', 'seq_end']  # Columns of ensemble output
+
+
+# Turn models output into domain intervals
+def intervals(model_out):
+    """
+    Sets of matching positions are split into runs of consecutive positions,
+    each one becoming an interval on its own (empty sets are dropped).
+    Input:
+        1. model_out:   model output, either with domain boundaries (entry_ac, seq_start, seq_end)
+                        or with matching positions (entry_ac, positive), as sets of positions
+    Output:
+        1. dataframe (entry_ac, seq_start, seq_end), where intervals are half-open (end excluded)
+    """
+    # Case domain boundaries are available
+    if {'seq_start', 'seq_end'} <= set(model_out.columns):
+        return pd.DataFrame({'entry_ac': model_out['entry_ac'].values,
+                             'seq_start': model_out['seq_start'].values.astype(np.int64),
+                             'seq_end': model_out['seq_end'].values.astype(np.int64)})
+    # Otherwise, flatten sorted matching positions, along with the row they come from
+    lengths = np.array([len(positive) for positive in model_out['positive']], dtype=np.int64)
+    positions = np.fromiter(itertools.chain.from_iterable(sorted(positive) for positive in model_out['positive']),
+                            dtype=np.int64, count=lengths.sum())
+    rows = np.repeat(np.arange(lengths.shape[0]), lengths)
+    # Define first and last position of each run (a run breaks on either a new row or a gap)
+    breaks = (rows[1:] != rows[:-1]) | (positions[1:] - positions[:-1] != 1)
+    first, last = np.insert(breaks, 0, True)[:positions.shape[0]], np.append(breaks, True)[:positions.shape[0]]
+    # Return runs as intervals
+    return pd.DataFrame({'entry_ac': model_out['entry_ac'].values[rows[first]],
+                         'seq_start': positions[first], 'seq_end': positions[last] + 1},
+                        columns=['entry_ac', 'seq_start', 'seq_end'])
+
+
+# Compute distances between pairs of intervals (1 - Jaccard index of their positions)
+def distances(starts, ends, rows, cols):
+    """
+    Input:
+        1. starts:  array of intervals starts
+        2. ends:    array of intervals ends (excluded)
+        3. rows:    array of indices of the first interval in each pair
+        4. cols:    array of indices of the second interval in each pair
+    Output:
+        1. array of distances, one for each pair (empty intervals have distance 1 from any other one)
+    """
+    # Compute intersection length for each pair of intervals
+    intersection = np.clip(np.minimum(ends[rows], ends[cols]) - np.maximum(starts[rows], starts[cols]), 0, None)
+    # Compute union length for each pair of intervals
+    lengths = np.clip(ends - starts, 0, None)
+    union = lengths[rows] + lengths[cols] - intersection
+    # Compute distances (avoid division by zero)
+    return 1 - np.divide(intersection, union, out=np.zeros(union.shape, dtype=np.float64), where=union > 0)
+
+
+# Cluster intervals of each accession at once
+def clusters(accessions, starts, ends, eps=EPS, direct=False):
+    """
+    Clusters are the same as the ones of the former DBSCAN call with a single
+    minimum sample, which did not use the distance matrix of each accession as
+    precomputed: intervals are linked when the Euclidean distance between their
+    rows of the distance matrix is within <eps>, and clusters are the connected
+    components of the resulting graph. Only pairs of intervals of the same
+    accession are compared, batching accessions with the same number of intervals,
+    and clusters are labelled from 0 within each accession, in order of first
+    occurrence (as DBSCAN does).
+    Direct clustering rather links intervals whose own distance is within <eps>.
+    Input:
+        1. accessions:  array of accessions, sorted (intervals of the same accession are contiguous)
+        2. starts:      array of intervals starts
+        3. ends:        array of intervals ends (excluded)
+        4. eps:         maximum distance between two linked intervals
+        5. direct:      whether intervals must be linked on their own distance (faster, not DBSCAN compatible)
+    Output:
+        1. array of cluster labels, within each accession
+    """
+    # Define number of intervals
+    n = accessions.shape[0]
+    # Define first interval and number of intervals of each accession
+    _, first, sizes = np.unique(accessions, return_index=True, return_counts=True)
+    # Define pairs of linked intervals in the same accession
+    rows, cols = [np.zeros(0, dtype=np.int64)], [np.zeros(0, dtype=np.int64)]
+    # Loop through each number of intervals, batching accessions with the same one
+    for size in np.unique(sizes[sizes > 1]):
+        # Define pairs within a single accession (upper triangular matrix)
+        i, j = np.triu_indices(size, k=1)
+        # Define first interval of each accession having current number of intervals
+        offsets = first[sizes == size]
+        # Loop through blocks of accessions, bounding memory of distances between rows
+        step = max(1, BLOCK_SIZE // (i.shape[0] * (1 if direct else size)))
+        for k in range(0, offsets.shape[0], step):
+            # Shift pairs to each accession in current block
+            block_rows, block_cols = offsets[k:k + step, None] + i, offsets[k:k + step, None] + j
+            # Compute distances between pairs of intervals (one row for each accession)
+            pairs = distances(starts, ends, block_rows.ravel(), block_cols.ravel()).reshape(block_rows.shape)
+            # Case clustering is not direct: compute distances between rows of each (square) distance matrix
+            if not direct:
+                matrix = np.zeros((pairs.shape[0], size, size), dtype=np.float64)
+                matrix[:, i, j], matrix[:, j, i] = pairs, pairs
+                pairs = np.sqrt(np.sum((matrix[:, i, :] - matrix[:, j, :]) ** 2, axis=2))
+            # Keep pairs of close intervals
+            linked = pairs <= eps
+            rows.append(block_rows[linked])
+            cols.append(block_cols[linked])
+    rows, cols = np.concatenate(rows), np.concatenate(cols)
+    # Define graph of linked intervals
+    graph = coo_matrix((np.ones(rows.shape[0], dtype=np.int8), (rows, cols)), shape=(n, n))
+    # Compute connected components
+    _, components = connected_components(graph, directed=False)
+    # Define first interval of each component
+    first_interval = np.full(components.max() + 1 if n else 0, n, dtype=np.int64)
+    np.minimum.at(first_interval, components, np.arange(n))
+    # Count components, in order of first occurrence
+    counts = np.cumsum(first_interval[components] == np.arange(n))
+    # Label components within each accession, starting from 0
+    return counts[first_interval[components]] - counts[np.repeat(first, sizes)]
+
+
+# Compute positions covered by enough intervals, for every cluster at once (sweep line)
+def vote(groups, starts, ends, required):
+    """
+    Boundaries are sorted by cluster, then by position: coverage is the cumulative
+    sum of +1 (start) and -1 (end) changes, which is reset at the end of each
+    cluster since each interval both starts and ends within its own cluster.
+    Input:
+        1. groups:      array of cluster indices (from 0 to number of clusters), one for each interval
+        2. starts:      array of intervals starts
+        3. ends:        array of intervals ends (excluded)
+        4. required:    array of minimum number of intervals covering a position, one for each cluster
+    Output:
+        1. array of cluster indices, one for each consensus interval
+        2. array of consensus intervals starts
+        3. array of consensus intervals ends (excluded)
+    """
+    # Skip empty intervals
+    keep = starts < ends
+    groups, starts, ends = groups[keep], starts[keep], ends[keep]
+    # Case there is no interval: there is no consensus interval either
+    if not groups.shape[0]:
+        return groups, starts, ends
+    # Define boundaries, along with coverage change (+1 on start, -1 on end)
+    groups = np.concatenate([groups, groups])
+    bounds = np.concatenate([starts, ends])
+    change = np.repeat([1, -1], starts.shape[0])
+    # Sort boundaries by cluster, then by position
+    order = np.lexsort((bounds, groups))
+    groups, bounds, coverage = groups[order], bounds[order], np.cumsum(change[order])
+    # Keep only the last change at each position: coverage from there to the next boundary
+    last = np.append((groups[1:] != groups[:-1]) | (bounds[1:] != bounds[:-1]), True)
+    groups, bounds, coverage = groups[last], bounds[last], coverage[last]
+    # Keep segments (from boundary to next one, in the same cluster) covered by enough intervals
+    kept = np.append(groups[1:] == groups[:-1], False) & (coverage >= required[groups])
+    # Merge adjacent segments: define first and last segment of each consensus interval
+    index = np.flatnonzero(kept)
+    first = index[~np.insert(kept[:-1], 0, False)[index]]
+    last = index[~np.append(kept[1:], False)[index]]
+    # Return consensus intervals
+    return groups[first], bounds[first], bounds[last + 1]
+
+
+# Cluster and vote domains of a chunk of accessions
+def ensemble(accessions, starts, ends, threshold=None, direct=False):
+    """
+    Input:
+        1. accessions:  array of accessions, sorted (intervals of the same accession are contiguous)
+        2. starts:      array of intervals starts
+        3. ends:        array of intervals ends (excluded)
+        4. threshold:   minimum number of votes for a position to be kept
+                        (default half of the domains in cluster)
+        5. direct:      whether domains must be linked on their own distance (not DBSCAN compatible)
+    Output:
+        1. dataframe of consensus domains (entry_ac, label, seq_start, seq_end)
+    """
+    # Compute cluster labels within each accession
+    labels = clusters(accessions, starts, ends, direct=direct)
+    # Define cluster index across accessions (clusters are sorted by accession, then by label)
+    _, accession_index = np.unique(accessions, return_inverse=True)
+    _, first, groups, sizes = np.unique(accession_index * (labels.max(initial=0) + 1) + labels,
+                                        return_index=True, return_inverse=True, return_counts=True)
+    # Define number of votes required by each cluster (at least half of cluster domains)
+    required = (sizes / 2) if threshold is None else np.full(sizes.shape, threshold)
+    # Compute consensus intervals
+    groups, seq_start, seq_end = vote(groups.ravel(), starts, ends, required)
+    # Return consensus domains
+    return pd.DataFrame({'entry_ac': accessions[first[groups]], 'label': labels[first[groups]],
+                         'seq_start': seq_start, 'seq_end': seq_end}, columns=COLUMNS)
 
 
 # Define a method for majority voting
-def majority_voting(models_out):
+def majority_voting(models_out, threshold=None, num_workers=1, chunk_size=CHUNK_SIZE, direct=False):
     """
+    Predicted domains are clustered for each protein (domains whose positions
+    overlap enough are in the same cluster), then positions predicted by at least
+    half of the domains in each cluster are kept. Voting runs on sorted interval
+    boundaries, hence memory is proportional to the number of domains, not of residues.
+    Domains are sorted by accession once, then split into chunks of whole accessions,
+    which are processed concurrently.
     Input:
-        1. models_out:      models output, iterable containing dataframe (entry_ac, positive matching)
+        1. models_out:      models output, iterable containing dataframe (entry_ac, seq_start, seq_end),
+                            or (entry_ac, positive) where positive is the set of matching positions
+        2. threshold:       minimum number of votes for a position to be kept
+                            (default half of the domains in cluster)
+        3. num_workers:     number of worker processes (default 1, no worker process)
+        4. chunk_size:      approximate number of domains in each chunk
+        5. direct:          whether domains must be linked on their own distance (not DBSCAN compatible)
     Output:
-        1. ensemble_out:    set of values passing threshold (predicted positive)
-    """
-    # # Set default threshold
-    # threshold = len(models_out) if threshold is None else threshold
-
-    # Concatenate models output
-    models_out = pd.concat(models_out, ignore_index=True)  # Stack all models output together
-    # Loop thorugh each accession
-    for accession in set(models_out.entry_ac.unique().tolist()):
-        # Get models with respect to current accession
-        models_curr = models_out[models_out.entry_ac == accession]
-        # Get indices of currently sliced models
-        index_curr = models_curr.index
-        # Compute distance matrix as accuracy matrix (symmetric)
-        # NOTE: only upper triangular matrix is computed
-        nrows = ncols = models_curr.shape[0]  # Define number of rows and columns
-        # Define clusters container
-        labels = 0
-        # Handle case single cell matrix
-        if nrows > 1:
-            # Initialize distance matrix
-            distance_matrix = np.zeros(shape=(nrows, ncols), dtype=np.float)
-            # Fill distance matrix
-            for i in range(nrows):
-                for j in range(i + 1, ncols):
-                    # Define "truncated accuracy" for i-th row and j-th column
-                    tp = len(models_curr.loc[index_curr[i], 'positive'] & models_curr.loc[index_curr[j], 'positive'])  # Intersection
-                    f = len(models_curr.loc[index_curr[i], 'positive'] | models_curr.loc[index_curr[j], 'positive'])  # Union
-                    # Fill distance matrix
-                    distance_matrix[i, j] = distance_matrix[j, i] = 1 - (tp / f)
-            # Compute cluster labels through DBScan
-            labels = DBSCAN(eps=0.4, min_samples=1).fit_predict(distance_matrix)
-        # Assign model output to clusters
-        models_out.loc[index_curr, 'label'] = labels
-
-    # For each label in each accession, compute majority voting
-    # Group each cluster and merge together positive values
-    ensemble_out = models_out.groupby(by=['entry_ac', 'label']).agg({
-        'positive': {
-            'positive': lambda matches: [pos for match in list(matches) for pos in match],
-            'count': 'count'
-        }
-    }).reset_index()
-    # Reset column names
-    ensemble_out.columns = ['entry_ac', 'label', 'positive', 'count']
-    # Compute majority voting
-    ensemble_out['positive'] = ensemble_out.apply(
-        lambda x: set(p for p in set(x['positive']) if x['positive'].count(p) >= (x['count'] / 2)),
-        axis=1
+        1. ensemble_out:    dataframe of consensus domains (entry_ac, label, seq_start, seq_end),
+                            where seq_end is excluded (a cluster may have disjoint consensus domains)
+    """
+    # Concatenate models output, as intervals (sorted by accession, input order is kept otherwise)
+    models_out = pd.concat([intervals(model_out) for model_out in models_out], ignore_index=True)
+    models_out = models_out.sort_values(by='entry_ac', kind='mergesort').reset_index(drop=True)
+    accessions = models_out['entry_ac'].values
+    starts, ends = models_out['seq_start'].values, models_out['seq_end'].values
+    # Split domains into chunks, each one made of whole accessions
+    _, first = np.unique(accessions, return_index=True)
+    cuts = np.unique(first[np.searchsorted(first, np.arange(chunk_size, accessions.shape[0], chunk_size))])
+    chunks = [(accessions[i:j], starts[i:j], ends[i:j], threshold, direct)
+              for i, j in zip(np.insert(cuts, 0, 0), np.append(cuts, accessions.shape[0]))]
+    # Case no worker process is required: process chunks sequentially
+    if num_workers is not None and num_workers <= 1:
+        ensemble_out = [ensemble(*chunk) for chunk in chunks]
+    # Otherwise, process chunks concurrently
+    else:
+        with ProcessPoolExecutor(max_workers=num_workers or os.cpu_count()) as pool:
+            ensemble_out = list(pool.map(ensemble, *zip(*chunks)))
+    # Return consensus domains, in a single concatenation
+    return pd.concat(ensemble_out, ignore_index=True)
+
+
+# Read domains from a model output sorted by accession, one row at a time
+def read_sorted(path, chunk_size=CHUNK_SIZE):
+    """
+    Input:
+        1. path:        path to model output (.tsv formatted), with entry_ac, seq_start and
+                        seq_end columns, sorted by entry_ac (e.g. LC_ALL=C sort -k1,1)
+        2. chunk_size:  number of rows read from file at once
+    Output:
+        1. generator of (entry_ac, seq_start, seq_end) tuples, where seq_end is excluded
+    """
+    # Define last accession read
+    last = None
+    # Read file in chunks
+    for chunk in pd.read_csv(path, sep='\t', usecols=['entry_ac', 'seq_start', 'seq_end'],
+                             dtype={'entry_ac': str}, chunksize=chunk_size):
+        # Loop through each row in current chunk
+        for row in zip(chunk['entry_ac'].values, chunk['seq_start'].values, chunk['seq_end'].values):
+            # Check that rows are sorted by accession
+            if last is not None and row[0] < last:
+                raise ValueError('Error: {:s} is not sorted by entry_ac'.format(path))
+            # Return current row
+            last = row[0]
+            yield row
+
+
+# Define a method for majority voting over model outputs too large to fit in memory
+def stream_voting(paths, threshold=None, chunk_size=CHUNK_SIZE, direct=False):
+    """
+    Model outputs, each one sorted by accession, are merged on the fly (k-way
+    merge): domains of each protein are grouped together as they arrive, and
+    voted in batches of whole proteins. Memory is bounded by the batch size
+    plus the largest set of domains of a single protein. Clusters are the same
+    as the ones computed by majority_voting(...) on the same model outputs.
+    Input:
+        1. paths:       paths to model outputs (.tsv formatted), each one sorted by entry_ac
+        2. threshold:   minimum number of votes for a position to be kept
+                        (default half of the domains in cluster)
+        3. chunk_size:  approximate number of domains voted at once
+        4. direct:      whether domains must be linked on their own distance (not DBSCAN compatible)
+    Output:
+        1. generator of dataframes of consensus domains (entry_ac, label, seq_start, seq_end),
+           where seq_end is excluded, each one containing whole proteins
+    """
+    # Merge model outputs by accession (ties keep model outputs order)
+    merged = heapq.merge(*[read_sorted(path, chunk_size=chunk_size) for path in paths], key=itemgetter(0))
+    # Define current batch of domains
+    batch = list()
+    # Loop through domains of each protein
+    for _, rows in itertools.groupby(merged, key=itemgetter(0)):
+        # Add domains of current protein to batch
+        batch.extend(rows)
+        # Case batch is not full yet: read next protein
+        if len(batch) < chunk_size:
+            continue
+        # Otherwise, vote current batch
+        accessions, starts, ends = zip(*batch)
+        yield ensemble(np.array(accessions, dtype=object), np.array(starts, dtype=np.int64),
+                       np.array(ends, dtype=np.int64), threshold, direct)
+        # Empty batch
+        batch = list()
+    # Vote last batch
+    if batch:
+        accessions, starts, ends = zip(*batch)
+        yield ensemble(np.array(accessions, dtype=object), np.array(starts, dtype=np.int64),
+                       np.array(ends, dtype=np.int64), threshold, direct)
+
+
+# Define a single domain range for each cluster
+def ranges(ensemble_out):
+    """
+    Input:
+        1. ensemble_out:    dataframe of consensus domains (entry_ac, label, seq_start, seq_end)
+    Output:
+        1. dataframe (entry_ac, seq_start, seq_end), where last position is included
+    """
+    # Take first and last position of each cluster
+    ensemble_out = ensemble_out.groupby(by=['entry_ac', 'label'], as_index=False).agg(
+        seq_start=('seq_start', 'min'),
+        seq_end=('seq_end', 'max')
     )
+    # Include last position
+    ensemble_out['seq_end'] = ensemble_out['seq_end'] - 1
+    # Return ranges
+    return ensemble_out[['entry_ac', 'seq_start', 'seq_end']]
 
-    # Get only rows with at least matching position in domain
-    ensemble_out = ensemble_out[ensemble_out['positive'].apply(len) > 0]
-    # Slice columns
-    ensemble_out = ensemble_out[['entry_ac', 'positive']]
-    # return result
-    return ensemble_out
+
+# Turn consensus domains into the legacy output of majority voting (matching positions)
+def positives(ensemble_out):
+    """
+    Input:
+        1. ensemble_out:    dataframe of consensus domains (entry_ac, label, seq_start, seq_end)
+    Output:
+        1. dataframe (entry_ac, positive), where positive is the set of positions kept
+           in each cluster, as returned by majority voting before consensus intervals
+    """
+    # Define set of positions of each consensus domain
+    positive = [set(range(start, end)) for start, end in zip(ensemble_out['seq_start'].values,
+                                                             ensemble_out['seq_end'].values)]
+    # Merge positions of each cluster
+    ensemble_out = pd.DataFrame({'entry_ac': ensemble_out['entry_ac'].values, 'label': ensemble_out['label'].values,
+                                 'positive': pd.Series(positive, dtype=object)})
+    ensemble_out = ensemble_out.groupby(by=['entry_ac', 'label'], as_index=False, sort=False).agg(
+        positive=('positive', lambda matches: set().union(*matches))
+    )
+    # Return non-empty clusters only
+    return ensemble_out.loc[ensemble_out['positive'].apply(len) > 0, ['entry_ac', 'positive']].reset_index(drop=True)
 
 
 # Get ensemble output from multiple predictions
@@ -82,31 +364,35 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('--models_out', type=str, nargs='+', required=True)
     parser.add_argument('--out_path', type=str)
+    parser.add_argument('--num_workers', type=int, default=1)
+    parser.add_argument('--stream', action='store_true')
+    parser.add_argument('--direct', action='store_true')
     args = parser.parse_args()
 
-    # 2. Load models from csv
-    models_out = [pd.read_csv(model_out, sep='\t') for model_out in args.models_out]
-
-    # 3. For each model, turn domain range into domain sequence (set of positions)
-    for i in range(len(models_out)):
-        # Get set of positions matching the domain
-        models_out[i]['positive'] = models_out[i].apply(
-            lambda x: set(range(int(x.seq_start), int(x.seq_end))),
-            axis=1
-        )
-
-    # 4. Run majority voting
-    ensemble_out = majority_voting(models_out)
+    # 2. Case streaming is required: model outputs are merged and voted on the fly
+    if args.stream:
+        # Open either output file or standard output
+        out_file = open(args.out_path, 'w') if args.out_path else sys.stdout
+        # Write header
+        out_file.write('entry_ac\tseq_start\tseq_end\n')
+        # Write ranges of each batch of proteins, as soon as they have been voted
+        for ensemble_out in stream_voting(args.models_out, direct=args.direct):
+            ranges(ensemble_out).to_csv(out_file, header=False, index=False, sep='\t')
+        # Close output file
+        if args.out_path:
+            out_file.close()
 
-    # 5. Turn domain sequence into domain range, again
-    ensemble_out['seq_start'] = ensemble_out.apply(lambda x: min(x['positive']), axis=1)
-    ensemble_out['seq_end'] = ensemble_out.apply(lambda x: max(x['positive']), axis=1)
-    ensemble_out = ensemble_out[['entry_ac', 'seq_start', 'seq_end']]
-
-    # 6. Handle result
-    if args.out_path:
-        # Case output path has been defined: store to file
-        ensemble_out.to_csv(args.out_path, index=False, sep='\t')
+    # 3. Otherwise, load models in memory
     else:
+        # Load models from csv
+        models_out = [pd.read_csv(model_out, sep='\t') for model_out in args.models_out]
+        # Run majority voting
+        ensemble_out = majority_voting(models_out, num_workers=args.num_workers, direct=args.direct)
+        # Define a single domain range for each cluster (last position is included)
+        ensemble_out = ranges(ensemble_out)
+        # Case output path has been defined: store to file
+        if args.out_path:
+            ensemble_out.to_csv(args.out_path, index=False, sep='\t')
         # Case no output path defined: print out
-        print(ensemble_out.to_string())
+        else:
+            print(ensemble_out.to_string())
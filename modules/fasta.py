@@ -0,0 +1,308 @@
+#########################
+### FASTA FILES UTILS ###
+#########################
+
+
+# Dependencies
+import os
+import mmap
+from collections import namedtuple
+
+
+# Constants
+INDEX_EXT = '.fai'  # Extension of index files, stored next to FASTA files
+CHUNK_SIZE = 1 << 20  # Size of chunks read while counting records (1MB)
+
+# Index entry, as in samtools faidx (offset is the one of the first residue)
+Record = namedtuple('Record', ['name', 'length', 'offset', 'line_bases', 'line_width'])
+
+
+# Read FASTA file, one record at a time
+def read(path):
+    """
+    Input:
+        1. path:    path to FASTA file
+    Output:
+        1. generator of (header, sequence) tuples, header without leading '>'
+    """
+    # Initialize current record
+    header, sequence = None, list()
+    # Loop through each line in file
+    with open(path, 'r') as file:
+        for line in file:
+            # Remove trailing newline
+            line = line.rstrip()
+            # Case header line: yield previous record
+            if line.startswith('>'):
+                if header is not None:
+                    yield header, ''.join(sequence)
+                header, sequence = line[1:], list()
+            # Case sequence line
+            elif line:
+                sequence.append(line)
+    # Yield last record
+    if header is not None:
+        yield header, ''.join(sequence)
+
+
+# Count records in FASTA file, without parsing them
+def count(path, chunk_size=CHUNK_SIZE):
+    """
+    Input:
+        1. path:        path to FASTA file
+        2. chunk_size:  number of bytes read at once
+    Output:
+        1. number of records in file
+    """
+    # Case index is up to date: number of records is number of index entries
+    if is_fresh(path):
+        return len(load_index(path))
+    # Initialize number of records and previous character (start of file counts as newline)
+    num_records, prev = 0, b'\n'
+    # Read file in chunks, count headers (i.e. '>' at the beginning of a line)
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            num_records += (prev + chunk).count(b'\n>')
+            prev = chunk[-1:]
+    # Return number of records
+    return num_records
+
+
+# Define path to index of a FASTA file
+def index_path(path):
+    return path + INDEX_EXT
+
+
+# Check whether index of a FASTA file exists and is not older than the file itself
+def is_fresh(path):
+    return os.path.isfile(index_path(path)) and os.path.getmtime(index_path(path)) >= os.path.getmtime(path)
+
+
+# Build index of a FASTA file
+def make_index(path):
+    """
+    Scans the memory mapped file once, from header to header. Line bases and
+    width are the ones of the first sequence line: random access to residues
+    (see Fasta.fetch(...)) requires every other line but the last one to have
+    the same width, as in samtools faidx.
+    Input:
+        1. path:    path to FASTA file
+    Output:
+        1. list of index records, in file order
+    """
+    # Define output container
+    records = list()
+    # Case file is empty: mmap does not allow empty files
+    if os.path.getsize(path) == 0:
+        return records
+    # Map file in memory
+    with open(path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        # Find first header (-1 if there is none)
+        start = 0 if mm[:1] == b'>' else (mm.find(b'\n>') + 1 or -1)
+        # Loop through each header
+        while start >= 0:
+            # Define end of header line, which is also the start of sequence lines
+            offset = mm.find(b'\n', start)
+            offset = len(mm) if offset < 0 else offset + 1
+            # Define end of record (i.e. start of next header)
+            end = mm.find(b'\n>', offset - 1)
+            end = len(mm) if end < 0 else end + 1
+            # Define sequence name (first word in header)
+            name = mm[start + 1:offset].split(maxsplit=1)
+            name = name[0].decode('utf-8') if name else ''
+            # Define sequence length, removing line terminators
+            sequence = mm[offset:end]
+            length = len(sequence) - sequence.count(b'\n') - sequence.count(b'\r')
+            # Define line width (with terminators) and bases (without terminators) of first line
+            line_width = sequence.find(b'\n') + 1 or len(sequence)
+            line_bases = len(sequence[:line_width].rstrip(b'\r\n'))
+            # Store record
+            records.append(Record(name, length, offset, line_bases, line_width))
+            # Move to next header
+            start = end if end < len(mm) else -1
+    # Return records
+    return records
+
+
+# Load index of a FASTA file (built and stored if missing or outdated)
+def load_index(path):
+    """
+    Input:
+        1. path:    path to FASTA file
+    Output:
+        1. list of index records, in file order
+    """
+    # Case index is outdated: build it and store it (atomic)
+    if not is_fresh(path):
+        # Build index
+        records = make_index(path)
+        # Write index to temporary file first, then move it
+        with open(index_path(path) + '.tmp', 'w') as index_file:
+            for record in records:
+                index_file.write('\t'.join(str(field) for field in record) + '\n')
+        os.replace(index_path(path) + '.tmp', index_path(path))
+        # Return built index
+        return records
+    # Otherwise, load stored index
+    with open(index_path(path), 'r') as index_file:
+        return [Record(name, *map(int, fields))
+                for name, *fields in (row.rstrip('\n').split('\t') for row in index_file if row.strip())]
+
+
+# Memory mapped, indexed FASTA file
+class Fasta(object):
+    """
+    Records are accessed through the index, without parsing the whole file:
+    either by position, by name (first word in header) or by accession (e.g.
+    P46937 in sp|P46937|YAP1_HUMAN). Sequences are read from the memory mapped
+    file only when required.
+    Usage:
+        with Fasta('data/human.fasta') as human:
+            sequence = human['P46937']
+            domain = human.fetch('P46937', 165, 200)
+    """
+
+    def __init__(self, path):
+        # Store path to FASTA file
+        self.path = path
+        # Load index (built if missing or outdated)
+        self.records = load_index(path)
+        # Map names to positions (first record wins)
+        self.positions = dict()
+        for i, record in enumerate(self.records):
+            self.positions.setdefault(record.name, i)
+        # Map accessions to positions, if they do not clash with names
+        for i, record in enumerate(self.records):
+            parts = record.name.split('|')
+            if len(parts) > 2:
+                self.positions.setdefault(parts[1], i)
+        # Map file in memory (empty files cannot be mapped)
+        self.file = open(path, 'rb')
+        self.mm = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if self.records else b''
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return len(self.records)
+
+    def __contains__(self, key):
+        return key in self.positions
+
+    def __iter__(self):
+        return iter(record.name for record in self.records)
+
+    def __getitem__(self, key):
+        return self.fetch(key)
+
+    # Close memory map and file
+    def close(self):
+        if isinstance(self.mm, mmap.mmap):
+            self.mm.close()
+        self.file.close()
+
+    # Retrieve index record, either by position, name or accession
+    def record(self, key):
+        return self.records[key if isinstance(key, int) else self.positions[key]]
+
+    # Retrieve header line (without leading '>')
+    def header(self, key):
+        # Retrieve record
+        record = self.record(key)
+        # Header line ends right before sequence lines
+        start = self.mm.rfind(b'\n>', 0, record.offset - 1) + 1
+        return self.mm[start + 1:record.offset].rstrip(b'\r\n').decode('utf-8')
+
+    # Retrieve sequence, or a slice of it
+    def fetch(self, key, start=None, end=None):
+        """
+        Input:
+            1. key:     position, name or accession of the record
+            2. start:   first residue (0-based, included), default first one
+            3. end:     last residue (0-based, excluded), default last one
+        Output:
+            1. sequence (or slice of it), as string
+        """
+        # Retrieve record
+        record = self.record(key)
+        # Define residues boundaries
+        start, end, _ = slice(start, end).indices(record.length)
+        # Case empty slice
+        if start >= end:
+            return ''
+        # Map residue positions to byte offsets, skipping line terminators
+        first = record.offset + (start // record.line_bases) * record.line_width + start % record.line_bases
+        last = record.offset + ((end - 1) // record.line_bases) * record.line_width + (end - 1) % record.line_bases
+        # Retrieve bytes, remove line terminators
+        return self.mm[first:last + 1].replace(b'\n', b'').replace(b'\r', b'').decode('utf-8')
+
+    # Retrieve whole record (header and sequence lines), as stored in file
+    def raw(self, key):
+        # Retrieve record
+        record = self.record(key)
+        # Record starts at header and ends right before next header
+        start = self.mm.rfind(b'\n>', 0, record.offset - 1) + 1
+        end = self.mm.find(b'\n>', record.offset - 1) + 1 or len(self.mm)
+        # Return bytes, with trailing newline
+        raw = self.mm[start:end]
+        return raw if raw.endswith(b'\n') else raw + b'\n'
+
+    # Write a subset of records to another FASTA file
+    def write(self, keys, out_path):
+        """
+        Input:
+            1. keys:        positions, names or accessions of records
+            2. out_path:    path to output FASTA file
+        Output:
+            1. number of written records
+        """
+        # Initialize number of written records
+        num_records = 0
+        # Copy each record as it is
+        with open(out_path, 'wb') as out_file:
+            for key in keys:
+                out_file.write(self.raw(key))
+                num_records += 1
+        # Return number of written records
+        return num_records
+
+
+# Split FASTA file into shards with (almost) the same number of residues
+def split(path, num_shards, out_dir):
+    """
+    Records are assigned greedily to the shard having the least residues, from the
+    longest to the shortest one, then each shard is written to its own FASTA file.
+    Lengths are retrieved from index, hence sequences are never parsed. There are
+    never more shards than records, so that no shard is empty (unless the input is).
+    Input:
+        1. path:        path to input FASTA file
+        2. num_shards:  maximum number of shards to create
+        3. out_dir:     directory where shards will be stored
+    Output:
+        1. list of paths to shards
+        2. total number of sequences
+        3. total number of residues
+    """
+    # Open indexed FASTA file
+    with Fasta(path) as records:
+        # Define number of shards (at most one for each record, at least one)
+        num_shards = max(1, min(num_shards, len(records)))
+        # Define shards containers
+        shards = [list() for _ in range(num_shards)]
+        sizes = [0] * num_shards
+        # Assign records to shards, longest first
+        for i, record in sorted(enumerate(records.records), key=lambda item: item[1].length, reverse=True):
+            # Get shard having the least residues
+            j = sizes.index(min(sizes))
+            shards[j].append(i)
+            sizes[j] += record.length
+        # Define shards paths
+        paths = [os.path.join(out_dir, 'shard-{:d}.fasta'.format(j)) for j in range(num_shards)]
+        # Write shards to file, keeping records in input order
+        for shard_path, shard in zip(paths, shards):
+            records.write(sorted(shard), shard_path)
+        # Return paths to shards, number of sequences and residues
+        return paths, len(records), sum(sizes)
@@ -4,67 +4,165 @@
 
 
 # Dependencies
+import io
+import os
+import csv
 import sys
+import shutil
 import subprocess
 import tempfile
 import pandas as pd
 import numpy as np
 import argparse
+from concurrent.futures import ThreadPoolExecutor
+# Local dependencies (either run as script or imported as package)
+try:
+    from modules import cache, fasta, incremental, store, sweep
+except ImportError:
+    import cache, fasta, incremental, store, sweep
 
 
 # Available algorithms
 JACKHMMER = 'jackhmmer'
 HMMSEARCH = 'hmmsearch'
 
+# Constants
+SHARD_CACHE_DIR = os.path.join(cache.CACHE_DIR, 'hmm_shards')  # Managed sharded test sets
+SHARD_MAX_ENTRIES = 8  # Maximum number of sharded test sets kept in cache
+CHECKPOINT_CACHE_DIR = os.path.join(cache.CACHE_DIR, 'jackhmmer')  # Managed jackhmmer checkpoints
+CHECKPOINT_MAX_ENTRIES = 32  # Maximum number of jackhmmer searches kept in cache
+CHECKPOINT_PREFIX = 'iter'  # Prefix of checkpoint files (e.g. iter-1.hmm, iter-1.sto, iter-1.domtbl)
+
+# Domain table (--domtblout) columns, along with their types
+COLUMNS = {'target_db': object, 'target_name': object, 'target_gene': object,
+           'target_accession': object, 'target_len': np.int32,
+           'query_name': object, 'query_accession': object, 'query_len': np.int32,
+           'full_seq_evalue': np.float64, 'full_seq_score': np.float64, 'full_seq_bias': np.float64,
+           'dom_nr': np.int32, 'dom_of': np.int32, 'dom_c_evalue': np.float64, 'dom_i_evalue': np.float64,
+           'dom_score': np.float64, 'dom_bias': np.float64,
+           'hmm_from': np.int32, 'hmm_to': np.int32, 'align_from': np.int32, 'align_to': np.int32,
+           'env_from': np.int32, 'env_to': np.int32, 'acc': np.float64, 'description': object}
+NUM_FIELDS = 23  # Number of whitespace separated fields in domain table (last one is description)
+
+
+# Read domain table from any source
+def read(result):
+    """
+    Input:
+    1. domain table: either a string, bytes, a path to a file or a file-like object (e.g. a pipe)
+    Output:
+    1. domain table, as string
+    """
+    # Case file-like object: read its whole content
+    if hasattr(result, 'read'):
+        result = result.read()
+    # Case bytes: decode them
+    if isinstance(result, bytes):
+        result = result.decode('utf-8')
+    # Case path to file: read its content
+    if '\n' not in result and os.path.isfile(result):
+        with open(result, 'r') as file:
+            result = file.read()
+    # Return domain table
+    return result
+
+
+# Split target names into database, name and gene (e.g. sp|P46937|YAP1_HUMAN)
+def _split_target(targets):
+    # Split each target name on its first two pipes
+    parts = [target.split('|', 2) for target in targets]
+    # Keep whole target name if it cannot be split (no pipe, or empty name)
+    parts = [part if len(part) > 1 and part[1] else ['', target, ''] for target, part in zip(targets, parts)]
+    # Return database, name and gene (empty if missing) of each target
+    return ([part[0] for part in parts], [part[1] for part in parts],
+            [part[2] if len(part) > 2 else '' for part in parts])
+
 
 # Parse HMM string result to Pandas DataFrame
 def parse(result, raw=False):
     """
+    Domain table fields are separated by whitespaces, except the last one
+    (description) which may contain whitespaces itself. Formatted output does
+    not need the description, hence the required fields are parsed and typed
+    directly by pandas C engine. Raw output splits each row on its first 22
+    whitespace runs only (bounded split), then the whole table is parsed and
+    typed at once.
     Input:
-    1. PSSM result (string)
+    1. HMM result (string, bytes, path to file or file-like object)
     Output:
-    1. PSSM result (Pandas DataFrame)
-    """
-    # Turn result from string to list (rows) of lists (columns)
-    result = [row.split() for row in result.split('\n')
-              if row != '' and row[0] != '#']
-    # Define column names
-    columns = ['target_db', 'target_name', 'target_gene', 'target_accession', 'target_len',
-               'query_name', 'query_accession', 'query_len',
-               'full_seq_evalue', 'full_seq_score', 'full_seq_bias',
-               'dom_nr', 'dom_of', 'dom_c_evalue', 'dom_i_evalue', 'dom_score', 'dom_bias',
-               'hmm_from', 'hmm_to', 'align_from', 'align_to', 'env_from', 'env_to',
-               'acc', 'description']
-    # Define number of columns and number of rows
-    num_rows, num_cols = len(result), len(columns)
-    # Update each row
-    for i in range(num_rows):
-        # First column must be splitted
-        result[i] = result[i][0].split('|') + result[i][1:]
-        # Last column must be grouped together: it is the description
-        result[i][num_cols] = ' '.join(result[i][num_cols:])
-        result[i] = result[i][:num_cols]
-    # Turn result table into DataFrame Object
-    result = pd.DataFrame(result, columns=columns)
+    1. HMM result (Pandas DataFrame)
+    """
+    # Define columns in domain table (target name is not split yet)
+    columns = [column for column in COLUMNS if column not in {'target_db', 'target_gene'}]
+    # Read domain table
+    result = read(result)
+    # Define required columns: either all of them or formatted ones only
+    usecols = columns if raw else ['target_name', 'align_from', 'align_to', 'dom_i_evalue']
+    # Case formatted output: parse required whitespace separated fields only (description is ignored)
+    if not raw:
+        data, options = result, dict(sep=r'\s+', comment='#', usecols=[columns.index(column) for column in usecols])
+    # Otherwise, skip comments and separate fields by tabs (bounded split, keeps whitespaces in description)
+    else:
+        data = '\n'.join('\t'.join(row.split(None, NUM_FIELDS - 1)) for row in result.split('\n')
+                         if row.strip() and row.lstrip()[0] != '#')
+        options = dict(sep='\t', names=range(len(columns)))
+    # Parse and type required columns at once (fields are returned in file order)
+    try:
+        result = pd.read_csv(io.StringIO(data), header=None,
+                             dtype={columns.index(column): COLUMNS[column] for column in usecols},
+                             quoting=csv.QUOTE_NONE, na_filter=False, engine='c', **options)
+        result.columns = sorted(usecols, key=columns.index)
+    # Case there is no row: return empty typed columns
+    except pd.errors.EmptyDataError:
+        result = pd.DataFrame({column: pd.Series(dtype=COLUMNS[column]) for column in usecols})
+    # Split target name into database, name and gene
+    db, name, gene = _split_target(result['target_name'].tolist())
+    result['target_name'] = pd.Series(name, index=result.index, dtype=object)
     # Format dataframe: return predicted sequence accession, start, end, 'evalue'
     if not raw:
         # Return subset of dataset columns
-        result = result[['target_name', 'align_from', 'align_to', 'dom_i_evalue']]
+        result = result[usecols]
         # Map columns
         result.columns = ['entry_ac', 'seq_start', 'seq_end', 'e_value']
-    # Slice the returned dataset in order to retrieve only
+    # Otherwise, add target database and gene
+    else:
+        result.insert(0, 'target_db', pd.Series(db, index=result.index, dtype=object))
+        result.insert(2, 'target_gene', pd.Series(gene, index=result.index, dtype=object))
+    # Return parsed domain table
     return result
 
 
 # Fit HMM model (use hmmbuild)
-def fit(msa_path, model_path):
+def fit(msa_path, model_path, options=()):
     # Build the model
-    out = subprocess.run(['hmmbuild', model_path, msa_path],
+    out = subprocess.run(['hmmbuild', *options, model_path, msa_path],
                          stdout=subprocess.PIPE, stderr=subprocess.PIPE,
                          check=True)
     return out.stdout.decode('utf-8')
 
 
+# Fit HMM model (or retrieve it from models store, if alignment did not change)
+def fit_stored(msa_path, model_path=None, name=None, options=(), store_dir=store.STORE_DIR):
+    """
+    Input:
+        1. msa_path:    path to multiple sequence alignment
+        2. model_path:  if set, stored model is copied there
+        3. name:        name of the model (e.g. Pfam family), if any
+        4. options:     further hmmbuild options
+        5. store_dir:   directory where models are stored
+    Output:
+        1. path to stored model
+    """
+    # Fit the model, if not already stored
+    stored_path = store.fit(lambda path: fit(msa_path, path, options=options), [msa_path],
+                            kind='hmm', options=options, name=name, store_dir=store_dir)
+    # Copy stored model, if required
+    if model_path is not None:
+        shutil.copyfile(stored_path, model_path)
+    # Return path to stored model
+    return stored_path
+
+
 # Evaluate HMM model, return result
 def test(algorithm=HMMSEARCH, *args, **kwargs):
     """
@@ -85,11 +183,12 @@ def test(algorithm=HMMSEARCH, *args, **kwargs):
 
 
 # Evaluate HMM model using hmmsearch (requires fit)
-def test_hmmsearch(model_path, test_path):
+def test_hmmsearch(model_path, test_path, options=()):
     """
     Input:
         1. model_path:  path to fitted HMM model
         2. test_path:   path to test set (.fasta formatted)
+        3. options:     further hmmsearch options
     Output:
         1. text output retrieved from psiblast
     """
@@ -97,36 +196,415 @@ def test_hmmsearch(model_path, test_path):
     return subprocess.run([HMMSEARCH,
                           '-o', '/dev/null',  # Output is silenced
                           '--domtblout', '/dev/stdout',  # Domtblout redirected to stdout
-                          model_path, test_path],
+                          *options, model_path, test_path],
                           stdout=subprocess.PIPE, stderr=subprocess.PIPE,
                           check=True)
 
 # Evaluate HMM model using jackhmmes (does not require fit)
-def test_jackhmmer(seq_path, test_path):
+def test_jackhmmer(seq_path, test_path, num_iterations=None, options=(), checkpoint_dir=None, reuse_converged=False):
     """
     Input:
-        1. seq_in:      input sequence
-        2. test_path:   path to test set (.fasta formatted)
+        1. seq_in:          input sequence
+        2. test_path:       path to test set (.fasta formatted)
+        3. num_iterations:  maximum number of iterations (jackhmmer default if not set)
+        4. options:         further jackhmmer options
+        5. checkpoint_dir:  directory where checkpoints are stored (not stored if not set)
+        6. reuse_converged: whether a converged model can be searched against a new test set
     Output:
         1. text output retrieved from psiblast
     """
+    # Case checkpoints are enabled: search from cached checkpoints, if any
+    if checkpoint_dir is not None:
+        # Retrieve domain table of the last iteration
+        out = test_checkpoint(seq_path, test_path, num_iterations=num_iterations or 5, options=options,
+                              cache_dir=checkpoint_dir, reuse_converged=reuse_converged)
+        # Return domain table as a completed process, as the other tests do
+        return subprocess.CompletedProcess(args=[JACKHMMER, seq_path, test_path], returncode=0,
+                                           stdout=out.encode('utf-8'), stderr=b'')
+    # Define number of iterations option
+    options = [*options] + (['-N', str(num_iterations)] if num_iterations is not None else [])
     # Test the given model
-    return subprocess.run([JACKHMMER, '-o', '/dev/null', '--domtblout', '/dev/stdout', seq_path, test_path],
+    return subprocess.run([JACKHMMER, '-o', '/dev/null', '--domtblout', '/dev/stdout', *options, seq_path, test_path],
                           stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
 
 
+# Retrieve names of sequences in a (Stockholm formatted) checkpoint alignment
+def included(ali_path, exclude=()):
+    """
+    Input:
+        1. ali_path:    path to alignment (.sto formatted)
+        2. exclude:     names of sequences which must be ignored (e.g. query)
+    Output:
+        1. set of sequence names, without aligned region (e.g. name/start-end)
+    """
+    # Case alignment has not been written (no sequence included)
+    if not os.path.isfile(ali_path):
+        return set()
+    # Retrieve names from each alignment row (skip markup, separators and empty lines)
+    with open(ali_path, 'r') as ali_file:
+        names = {row.split()[0].rsplit('/', 1)[0] for row in ali_file
+                 if row.strip() and row[0] != '#' and not row.startswith('//')}
+    # Return included names
+    return names - set(exclude)
+
+
+# Retrieve the converged model of a query sequence, from any cached jackhmmer search
+def converged(seq_path, options=(), cache_dir=CHECKPOINT_CACHE_DIR):
+    """
+    Input:
+        1. seq_path:    path to query sequence (.fasta formatted)
+        2. options:     jackhmmer options the model has been built with
+        3. cache_dir:   directory where checkpoints are stored
+    Output:
+        1. path to converged model (.hmm formatted), None if query never converged
+    """
+    # Define query hash
+    query = cache.hash_file(seq_path)
+    # Loop through each cached search, most recently used first
+    for key, meta, _ in cache.entries(cache_dir):
+        # Return last model of the first converged search of the same query
+        if meta['query'] == query and meta['options'] == list(options) and meta['converged']:
+            return os.path.join(cache.entry_path(cache_dir, key),
+                                '{:s}-{:d}.hmm'.format(CHECKPOINT_PREFIX, meta['num_iterations']))
+    # No converged model
+    return None
+
+
+# Evaluate jackhmmer over cached checkpoints, resuming the search if more iterations are required
+def test_checkpoint(seq_path, test_path, num_iterations=5, options=(), cache_dir=CHECKPOINT_CACHE_DIR,
+                    max_entries=CHECKPOINT_MAX_ENTRIES, reuse_converged=False):
+    """
+    Checkpoint models and alignments (--chkhmm, --chkali) are stored for each
+    iteration, along with domain tables, in a cache entry keyed on query sequence,
+    test set and options. As in jackhmmer, the model of iteration i is built
+    at its start, while the alignment of included hits is written at its end.
+    Further iterations resume from the last checkpoint: a new model is built
+    (hmmbuild) from the last alignment, then it is searched (hmmsearch), until
+    either the required number of iterations is reached or included sequences
+    do not change (converged).
+    Note that resumed iterations approximate jackhmmer, since the query sequence
+    is not forced into the alignment and sequence weighting is hmmbuild default.
+    Input:
+        1. seq_path:        path to query sequence (.fasta formatted)
+        2. test_path:       path to test set (.fasta formatted)
+        3. num_iterations:  maximum number of iterations
+        4. options:         further jackhmmer options (shared with hmmsearch)
+        5. cache_dir:       directory where checkpoints are stored
+        6. max_entries:     maximum number of searches kept in cache
+        7. reuse_converged: whether a converged model of the same query can be
+                            searched (hmmsearch) against a test set never seen before
+    Output:
+        1. domain table of the last iteration, as string
+    """
+    # Define key of the search (number of iterations is not part of it)
+    query = cache.hash_file(seq_path)
+    key = cache.hash_key(query, cache.hash_file(test_path), list(options))
+    # Define path to checkpoint files
+    prefix = os.path.join(cache.entry_path(cache_dir, key), CHECKPOINT_PREFIX)
+    chk_path = lambda i, ext: '{:s}-{:d}.{:s}'.format(prefix, i, ext)
+    # Retrieve search from cache
+    meta = cache.lookup(cache_dir, key)
+    # Case search is new, but query already converged on another test set: search converged model
+    if meta is None and reuse_converged:
+        model_path = converged(seq_path, options=options, cache_dir=cache_dir)
+        if model_path is not None:
+            return test_hmmsearch(model_path, test_path, options=options).stdout.decode('utf-8')
+    # Case search is new: run jackhmmer, storing checkpoints
+    if meta is None:
+        # Make entry directory
+        cache.create(cache_dir, key)
+        # Run jackhmmer, domain table of the last iteration is written to temporary file
+        subprocess.run([JACKHMMER, '-o', os.devnull, '--domtblout', prefix + '.domtbl',
+                        '--chkhmm', prefix, '--chkali', prefix, '-N', str(num_iterations),
+                        *options, seq_path, test_path],
+                       stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
+        # Define number of iterations actually run (jackhmmer stops early if converged)
+        done = len([name for name in os.listdir(os.path.dirname(prefix)) if name.endswith('.hmm')])
+        # Move domain table to its own iteration
+        os.replace(prefix + '.domtbl', chk_path(done, 'domtbl'))
+        # Mark search as complete
+        meta = cache.commit(cache_dir, key, {'query': query, 'source': os.path.abspath(test_path),
+                                             'options': list(options), 'num_iterations': done,
+                                             'converged': done < num_iterations})
+    # Define names of query sequences, which are not taken into account for convergence
+    queries = [header.split()[0] for header, _ in fasta.read(seq_path) if header]
+    # Resume search, until either required iterations are reached or it converges
+    while meta['num_iterations'] < num_iterations and not meta['converged']:
+        # Define current iteration
+        i = meta['num_iterations'] + 1
+        # Case previous iteration included no sequence: there is nothing to build the model from
+        if not os.path.isfile(chk_path(i - 1, 'sto')):
+            meta = cache.commit(cache_dir, key, {**meta, 'converged': True})
+            break
+        # Build model of current iteration from alignment of the previous one (as jackhmmer --chkhmm does)
+        fit(msa_path=chk_path(i - 1, 'sto'), model_path=chk_path(i, 'hmm'))
+        # Search current model, storing domain table and alignment of included hits
+        subprocess.run([HMMSEARCH, '-o', os.devnull, '--domtblout', chk_path(i, 'domtbl'), '-A', chk_path(i, 'sto'),
+                        *options, chk_path(i, 'hmm'), test_path],
+                       stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
+        # Check whether included sequences changed since last iteration
+        curr = included(chk_path(i, 'sto'), exclude=queries)
+        is_converged = not curr or curr == included(chk_path(i - 1, 'sto'), exclude=queries)
+        # Mark iteration as complete
+        meta = cache.commit(cache_dir, key, {**meta, 'num_iterations': i, 'converged': is_converged})
+    # Define last iteration (search may have converged before)
+    last = min(num_iterations, meta['num_iterations'])
+    # Case domain table of last iteration is missing (e.g. fewer iterations than cached ones)
+    if not os.path.isfile(chk_path(last, 'domtbl')):
+        # Case first iteration: re-run jackhmmer, it does not depend on any model
+        if last == 1:
+            out = test_jackhmmer(seq_path, test_path, num_iterations=1, options=options).stdout
+        # Otherwise, search model of last iteration (built from alignment of the previous one)
+        else:
+            out = test_hmmsearch(chk_path(last, 'hmm'), test_path, options=options).stdout
+        # Store domain table
+        with open(chk_path(last, 'domtbl') + '.tmp', 'wb') as domtbl_file:
+            domtbl_file.write(out)
+        os.replace(chk_path(last, 'domtbl') + '.tmp', chk_path(last, 'domtbl'))
+    # Remove least recently used searches
+    cache.evict(cache_dir, max_entries=max_entries)
+    # Return domain table of last iteration
+    with open(chk_path(last, 'domtbl'), 'r') as domtbl_file:
+        return domtbl_file.read()
+
+
+# Split test set into shards (or retrieve them from cache)
+def make_shards(test_path, num_shards, cache_dir=SHARD_CACHE_DIR, max_entries=SHARD_MAX_ENTRIES):
+    """
+    Input:
+        1. test_path:   path to test set (.fasta formatted)
+        2. num_shards:  maximum number of shards (at most one for each sequence)
+        3. cache_dir:   directory where shards are stored
+        4. max_entries: maximum number of sharded test sets kept in cache
+    Output:
+        1. list of paths to shards (.fasta formatted)
+        2. total number of sequences in test set
+    """
+    # Define key of the sharded test set
+    source = os.path.abspath(test_path)
+    key = cache.hash_key(cache.hash_file(test_path), num_shards)
+    # Retrieve sharded test set from cache
+    meta = cache.lookup(cache_dir, key)
+    # Case test set has not been already split: serialize concurrent splits of the same test set
+    if meta is None:
+        with cache.lock(cache_dir, key):
+            # Retrieve sharded test set again, another process may have split it in the meanwhile
+            meta = cache.lookup(cache_dir, key)
+            # Case test set has still to be split
+            if meta is None:
+                # Split test set into shards (there are no more shards than sequences)
+                shards, num_seqs, _ = fasta.split(test_path, num_shards, cache.create(cache_dir, key))
+                # Mark sharded test set as complete
+                meta = cache.commit(cache_dir, key, {'source': source, 'num_seqs': num_seqs, 'shards': shards})
+    # Remove sharded test sets built from previous versions of the same test set
+    cache.evict(cache_dir, max_entries=max_entries,
+                is_stale=lambda other: other['source'] == source and other['key'] != key)
+    # Return paths to shards and number of sequences
+    return meta['shards'], meta['num_seqs']
+
+
+# Merge domain tables retrieved by searching different shards
+def merge(results, dom_z=None):
+    """
+    Sequence and independent domain e-values are already comparable, since each
+    shard has been searched with the whole test set size (-Z). Instead, conditional
+    domain e-values depend on the number of sequences reported as significant
+    (--domZ): if it has not been set, they are rescaled from the number of sequences
+    reported in each shard to the number of sequences reported in all the shards,
+    for each query.
+    Input:
+        1. results: list of domain tables (--domtblout), as strings
+        2. dom_z:   number of significant sequences set through --domZ, if any
+    Output:
+        1. merged domain table (parse() compatible), as string
+    """
+    # Split each result into rows, which are split into 22 fields plus description
+    results = [[row.split(maxsplit=22) for row in result.split('\n') if row.strip() and row[0] != '#']
+               for result in results]
+    # Count sequences reported by each shard, for each query
+    reported = [dict() for _ in results]
+    for i, rows in enumerate(results):
+        for query in set(row[3] for row in rows):
+            reported[i][query] = len(set(row[0] for row in rows if row[3] == query))
+    # Count sequences reported by all shards, for each query
+    total = {query: sum(curr.get(query, 0) for curr in reported) for query in set().union(*reported)}
+    # Loop through each shard
+    merged = list()
+    for i, rows in enumerate(results):
+        # Loop through each row
+        for row in rows:
+            # Rescale conditional domain e-values
+            if dom_z is None:
+                row[11] = '{:g}'.format(float(row[11]) * total[row[3]] / reported[i][row[3]])
+            # Store row
+            merged.append(row)
+    # Sort rows by query (in input order), then by sequence e-value
+    queries = {query: i for i, query in enumerate(dict.fromkeys(row[3] for row in merged))}
+    merged = sorted(merged, key=lambda row: (queries[row[3]], float(row[6])))
+    # Return merged domain table
+    return ''.join(' '.join(row) + '\n' for row in merged)
+
+
+# Evaluate HMM model over a sharded test set, in parallel
+def test_parallel(algorithm=HMMSEARCH, num_shards=None, num_workers=None, cpu=1, dom_z=None,
+                  cache_dir=SHARD_CACHE_DIR, **kwargs):
+    """
+    Test set is split into shards, which are searched by concurrent HMMER processes.
+    Each process is given the whole test set size (-Z), hence e-values are the same
+    as the ones retrieved by a single process search (see merge(...)). JACKHMMER
+    is allowed a single iteration only, since further iterations would build the
+    model of each shard from its own hits only, instead of the hits in the whole
+    test set.
+    Input:
+        1. algorithm:       which algorithm to be used in evaluation
+        2. num_shards:      number of shards (default number of cores)
+        3. num_workers:     number of concurrent processes (default number of shards)
+        4. cpu:             number of worker threads used by each process (--cpu)
+        5. dom_z:           number of significant sequences (--domZ), if set
+        6. cache_dir:       directory where shards are stored
+        7. **kwargs:        other arguments passed to inner functions
+    Output:
+        1. merged domain table (parse() compatible), as string
+    """
+    # Check that JACKHMMER is required a single iteration
+    if algorithm == JACKHMMER and kwargs.get('num_iterations') != 1:
+        raise ValueError('sharded jackhmmer search requires a single iteration, got %s' % kwargs.get('num_iterations'))
+    # Define number of shards and of concurrent processes
+    num_shards = num_shards or os.cpu_count()
+    num_workers = num_workers or num_shards
+    # Split test set into shards (skipped if test set did not change)
+    shards, num_seqs = make_shards(kwargs.pop('test_path'), num_shards, cache_dir=cache_dir)
+    # Define options shared by each process
+    options = ['--cpu', str(cpu), '-Z', str(num_seqs)]
+    options += ['--domZ', str(dom_z)] if dom_z is not None else []
+    # Define function searching a single shard
+    def search(shard):
+        # Case HMMSEARCH algorithm
+        if algorithm == HMMSEARCH:
+            return test_hmmsearch(test_path=shard, options=options, **kwargs)
+        # Case JACKHMMER algorithm
+        elif algorithm == JACKHMMER:
+            return test_jackhmmer(test_path=shard, options=options, **kwargs)
+    # Run processes concurrently, one for each shard
+    with ThreadPoolExecutor(max_workers=num_workers) as pool:
+        results = [out.stdout.decode('utf-8') for out in pool.map(search, shards)]
+    # Merge results
+    return merge(results, dom_z=dom_z)
+
+
+# Evaluate HMM model (hmmsearch), searching only sequences changed since last search
+def test_incremental(model_path, test_path, e_value=10.0, dom_e_value=10.0, options=(),
+                     cache_dir=incremental.CACHE_DIR):
+    """
+    Hits of each sequence are stored for the given model: new or changed sequences
+    are searched with the whole test set size (-Z). Stored sequence and independent
+    domain e-values are rescaled to the current test set size, while conditional
+    domain e-values are rescaled to the number of sequences reported in the current
+    test set (--domZ), for each query. Every domain of reported sequences is stored,
+    domain threshold is applied afterwards. Hence, the merged output is the same as
+    the one of a search over the whole test set.
+    Input:
+        1. model_path:  path to fitted HMM model
+        2. test_path:   path to test set (.fasta formatted)
+        3. e_value:     sequence reporting threshold (-E)
+        4. dom_e_value: domain reporting threshold (--domE, on conditional e-value)
+        5. options:     further hmmsearch options (reporting thresholds excluded)
+        6. cache_dir:   directory where hits of each sequence are stored
+    Output:
+        1. domain table (parse() compatible), as string
+    """
+    # Define test set size (number of sequences)
+    num_seqs = fasta.count(test_path)
+    # Define key of the search: model and options
+    key = cache.hash_key(cache.hash_file(model_path), HMMSEARCH, list(options))
+    # Define function searching a subset of the test set
+    def run(subset_path, threshold):
+        # Search subset, reporting every domain of reported sequences
+        out = test_hmmsearch(model_path, subset_path, options=[*options, '-Z', str(num_seqs), '-E', str(threshold),
+                                                               '--domE', str(sys.float_info.max)])
+        # Split rows into 22 fields plus description
+        rows = [row.split(maxsplit=22) for row in out.stdout.decode('utf-8').split('\n')
+                if row.strip() and row[0] != '#']
+        # Count sequences reported for each query
+        reported = {query: len(set(row[0] for row in rows if row[3] == query)) for query in set(row[3] for row in rows)}
+        # Retrieve hits, e-values are normalized by either test set size or number of reported sequences
+        return [(incremental.accession(row[0]),
+                 [float(row[6]) / num_seqs, float(row[11]) / reported[row[3]], float(row[12]) / num_seqs],
+                 ' '.join(row)) for row in rows]
+    # Retrieve hits of current test set
+    hits = incremental.search(key, test_path, e_value, num_seqs, run, cache_dir=cache_dir)
+    # Rescale sequence e-values, then apply sequence threshold
+    hits = [(row.split(maxsplit=22), values) for _, values, row in hits if values[0] * num_seqs <= e_value]
+    # Count sequences reported for each query
+    reported = {query: len(set(row[0] for row, _ in hits if row[3] == query)) for query in set(row[3] for row, _ in hits)}
+    # Loop through each hit
+    merged = list()
+    for row, (seq_value, cond_value, ind_value) in hits:
+        # Skip domain if it does not pass domain threshold
+        if cond_value * reported[row[3]] > dom_e_value: continue
+        # Rescale e-values
+        row[6] = '{:g}'.format(seq_value * num_seqs)
+        row[11] = '{:g}'.format(cond_value * reported[row[3]])
+        row[12] = '{:g}'.format(ind_value * num_seqs)
+        # Store row
+        merged.append(row)
+    # Sort rows by query (in input order), then by sequence e-value
+    queries = {query: i for i, query in enumerate(dict.fromkeys(row[3] for row in merged))}
+    merged = sorted(merged, key=lambda row: (queries[row[3]], float(row[6])))
+    # Return merged domain table
+    return ''.join(' '.join(row) + '\n' for row in merged)
+
+
+# Evaluate HMM model for each combination of iterations and e-value thresholds
+def test_sweep(algorithm=HMMSEARCH, iterations=(1, ), e_values=(1e-3, ), **kwargs):
+    """
+    Each search is run only once, with default reporting thresholds: stricter
+    e-value thresholds are then applied in memory. HMMSEARCH does not iterate,
+    hence a single search is run and its hits are labelled with one iteration,
+    while JACKHMMER is run once for each number of iterations (its domain table
+    reports hits of the last iteration only).
+    Input:
+        1. algorithm:   which algorithm to be used in evaluation
+        2. iterations:  numbers of iterations (JACKHMMER only, ignored otherwise)
+        3. e_values:    e-value thresholds (on domain independent e-value)
+        4. **kwargs:    other arguments passed to inner functions
+    Output:
+        1. DataFrame of hits, with num_iterations and threshold columns (see sweep.expand(...))
+    """
+    # Case HMMSEARCH algorithm: run search once, as a single iteration
+    if algorithm == HMMSEARCH:
+        hits = {1: parse(test(HMMSEARCH, **kwargs))}
+    # Case JACKHMMER algorithm: run search once for each number of iterations
+    elif algorithm == JACKHMMER:
+        hits = {num_iterations: parse(test(JACKHMMER, num_iterations=num_iterations, **kwargs))
+                for num_iterations in iterations}
+    # Apply e-value thresholds
+    return sweep.expand(hits, e_values)
+
+
 if __name__ == '__main__':
 
     # 1. Define arguments
     parser = argparse.ArgumentParser()
     parser.add_argument('--algorithm',      type=str,   default=HMMSEARCH)
-    parser.add_argument('--fit',            type=str,   default=True)
+    parser.add_argument('--fit',            type=lambda x: x.lower() in ('true', '1', 'yes'), default=True)
     parser.add_argument('--seq_path',       type=str,   default='data/domain.fasta')
     parser.add_argument('--msa_path',       type=str,   default='data/msa.fasta')
     parser.add_argument('--test_path',      type=str,   default='data/human.fasta')
     parser.add_argument('--model_path',     type=str,   default='models/model.hmm')
     parser.add_argument('--out_path',       type=str)
     parser.add_argument('--e_value',        type=float, default=0.001)
+    parser.add_argument('--num_iterations', type=int,   default=5)
+    parser.add_argument('--num_shards',     type=int,   default=1)
+    parser.add_argument('--num_workers',    type=int)
+    parser.add_argument('--cpu',            type=int,   default=1)
+    parser.add_argument('--checkpoint_dir', type=str)
+    parser.add_argument('--reuse_converged', action='store_true')
+    parser.add_argument('--incremental_dir', type=str)
+    parser.add_argument('--store_dir',      type=str)
+    parser.add_argument('--model_name',     type=str)
+    parser.add_argument('--sweep_iterations', type=int,   nargs='+')
+    parser.add_argument('--sweep_e_values',   type=float, nargs='+')
 
     # 2. Define dictionary of args
     args = parser.parse_args()
@@ -134,31 +612,66 @@ if __name__ == '__main__':
     # 3. Run HMM model test
     try:
 
-        # Define output container
-        hmm_out = None
+        # Define search arguments
+        kwargs = None
 
         # Case HMMSEARCH algorithm
         if args.algorithm == HMMSEARCH:
+            # Fit the model if required, retrieving it from models store if alignment did not change
+            if args.fit and args.store_dir:
+                fit_stored(msa_path=args.msa_path, model_path=args.model_path,
+                           name=args.model_name, store_dir=args.store_dir)
             # Fit the model if required
-            if args.fit:
+            elif args.fit:
                 fit(msa_path=args.msa_path, model_path=args.model_path)
-            # Evaluate the model
-            hmm_out = test(algorithm=HMMSEARCH, model_path=args.model_path, test_path=args.test_path)
-
+            # Define model and test set
+            kwargs = dict(model_path=args.model_path, test_path=args.test_path)
 
         # Case JACKHMMER algorithm
         elif args.algorithm == JACKHMMER:
-            hmm_out = test(algorithm=JACKHMMER, seq_path=args.seq_path, test_path=args.test_path)
+            # Define query sequence and test set
+            kwargs = dict(seq_path=args.seq_path, test_path=args.test_path)
+            # Define checkpoints directory, if any
+            if args.checkpoint_dir:
+                kwargs.update(checkpoint_dir=args.checkpoint_dir, reuse_converged=args.reuse_converged)
+            # Define number of iterations, if no sweep is required
+            if not (args.sweep_iterations or args.sweep_e_values):
+                kwargs['num_iterations'] = args.num_iterations
 
         # Error: no algorithm has been chosen
         else:
             sys.exit('Error: no valid algorithm has been chosen')
 
-        # Parse output to pandas DataFrame object
-        hmm_out = parse(hmm_out)
+        # Case sweep: evaluate the model for every combination of iterations and e-value
+        if args.sweep_iterations or args.sweep_e_values:
+            hmm_out = test_sweep(algorithm=args.algorithm,
+                                 iterations=args.sweep_iterations or [args.num_iterations],
+                                 e_values=args.sweep_e_values or [args.e_value],
+                                 **kwargs)
 
-        # Filter on e-value
-        hmm_out = hmm_out[hmm_out.e_value.astype(np.float) < float(args.e_value)]
+        # Otherwise, evaluate the model once
+        else:
+            # Evaluate the model searching only sequences changed since last run (HMMSEARCH only)
+            if args.incremental_dir:
+                # Check that a single (non iterative) search is required
+                if args.algorithm != HMMSEARCH:
+                    sys.exit('Error: incremental search requires HMMSEARCH algorithm')
+                # Retrieve hits of the whole test set
+                hmm_out = test_incremental(cache_dir=args.incremental_dir, **kwargs)
+            # Evaluate the model over sharded test set, in parallel
+            elif args.num_shards > 1:
+                # Check that a single iteration is required (JACKHMMER only)
+                if args.algorithm == JACKHMMER and args.num_iterations != 1:
+                    sys.exit('Error: sharded search requires a single iteration')
+                hmm_out = test_parallel(algorithm=args.algorithm, num_shards=args.num_shards,
+                                        num_workers=args.num_workers, cpu=args.cpu, **kwargs)
+            # Evaluate the model over the whole test set
+            else:
+                hmm_out = test(algorithm=args.algorithm, **kwargs)
+            # Parse output to pandas DataFrame object
+            hmm_out = parse(hmm_out)
+            # Filter on e-value
+            hmm_out = hmm_out[hmm_out.e_value <= float(args.e_value)]
 
         # Case out path has been set: write to file
         if args.out_path:
@@ -0,0 +1,155 @@
+##########################################
+### INCREMENTAL SEARCHES OVER TEST SETS ###
+##########################################
+
+
+# Dependencies
+import os
+import re
+import math
+import tempfile
+# Local dependencies (either run as script or imported as package)
+try:
+    from modules import cache, fasta
+except ImportError:
+    import cache, fasta
+
+
+# Constants
+CACHE_DIR = os.path.join(cache.CACHE_DIR, 'incremental')  # Managed per-sequence hits
+MAX_ENTRIES = 32  # Maximum number of (model, search) pairs kept in cache
+SLACK = 10.0  # Hits are stored at a threshold this many times looser than the required one
+SEQUENCES_FILE = 'sequences.tsv'  # Accession and hash of each searched sequence
+HITS_FILE = 'hits.tsv'  # Accession, normalized e-values and raw row of each hit
+VERSION = re.compile(r'\.\d+$')  # Version suffix of accessions (e.g. P46937.3)
+
+
+# Normalize sequence names to accessions (e.g. sp|P46937|YAP1_HUMAN or P46937.3 to P46937)
+def accession(name):
+    # Split database, accession and name
+    parts = name.split('|')
+    # Take accession, if any, without version
+    return VERSION.sub('', parts[1] if len(parts) > 2 else parts[0])
+
+
+# Compute hash of each sequence in test set
+def hash_sequences(test_path):
+    """
+    Input:
+        1. test_path:   path to test set (.fasta formatted)
+    Output:
+        1. dictionary mapping accessions to sequences hashes
+    """
+    # Open indexed test set
+    with fasta.Fasta(test_path) as records:
+        # Hash residues only (case insensitive), sequences are read from memory map
+        return {accession(record.name): cache.hash_bytes(records.fetch(i).upper())
+                for i, record in enumerate(records.records)}
+
+
+# Write sequences with the given accessions to another FASTA file
+def subset(test_path, accessions, out_path):
+    # Open indexed test set
+    with fasta.Fasta(test_path) as records:
+        # Define positions of required records
+        accessions = set(accessions)
+        positions = [i for i, record in enumerate(records.records) if accession(record.name) in accessions]
+        # Copy records as they are
+        return records.write(positions, out_path)
+
+
+# Load sequences and hits stored by the last search
+def load(cache_dir, key):
+    """
+    Input:
+        1. cache_dir:   directory where searches are stored
+        2. key:         key of the search
+    Output:
+        1. metadata of the last search, None if there is none
+        2. dictionary mapping accessions to sequences hashes
+        3. list of (accession, normalized e-values, raw row) hits
+    """
+    # Retrieve search from cache
+    meta = cache.lookup(cache_dir, key)
+    # Case search has never been run
+    if meta is None:
+        return None, dict(), list()
+    # Define entry directory
+    path = cache.entry_path(cache_dir, key)
+    # Load sequences hashes
+    with open(os.path.join(path, SEQUENCES_FILE), 'r') as file:
+        sequences = dict(row.rstrip('\n').split('\t') for row in file if row.strip())
+    # Load hits: accession, normalized e-values, then raw row (which may contain tabs)
+    with open(os.path.join(path, HITS_FILE), 'r') as file:
+        hits = [row.rstrip('\n').split('\t', meta['num_values'] + 1) for row in file if row.strip()]
+        hits = [(hit[0], [float(value) for value in hit[1:-1]], hit[-1]) for hit in hits]
+    # Return search
+    return meta, sequences, hits
+
+
+# Store sequences and hits of the last search
+def save(cache_dir, key, meta, sequences, hits):
+    # Make (clean) entry directory
+    path = cache.create(cache_dir, key)
+    # Write sequences hashes
+    with open(os.path.join(path, SEQUENCES_FILE), 'w') as file:
+        for name, digest in sequences.items():
+            file.write('{:s}\t{:s}\n'.format(name, digest))
+    # Write hits, e-values are written with full precision
+    with open(os.path.join(path, HITS_FILE), 'w') as file:
+        for name, values, row in hits:
+            file.write('\t'.join([name, *map(repr, values), row]) + '\n')
+    # Mark search as complete
+    return cache.commit(cache_dir, key, meta)
+
+
+# Search only sequences which are new or changed since the last search
+def search(key, test_path, e_value, db_size, run, cache_dir=CACHE_DIR, max_entries=MAX_ENTRIES, slack=SLACK):
+    """
+    E-values grow linearly with database size, hence hits are stored with their
+    e-value divided by the database size they have been retrieved with. Hits are
+    retrieved at a threshold <slack> times looser than the required one, so that
+    stored hits still cover the required threshold if the database shrinks:
+    otherwise, the whole test set is searched again.
+    Input:
+        1. key:         key identifying model and search parameters
+        2. test_path:   path to test set (.fasta formatted)
+        3. e_value:     required e-value threshold
+        4. db_size:     current database size (as used in e-values computation)
+        5. run:         function searching a FASTA file at a given e-value threshold, returns
+                        list of (accession, normalized e-values, raw row) hits
+        6. cache_dir:   directory where searches are stored
+        7. max_entries: maximum number of searches kept in cache
+        8. slack:       ratio between threshold used in searches and required threshold
+    Output:
+        1. list of (accession, normalized e-values, raw row) hits, for current test set
+    """
+    # Hash current sequences
+    sequences = hash_sequences(test_path)
+    # Load last search
+    meta, stored, hits = load(cache_dir, key)
+    # Define normalized threshold covered by stored hits (none if search must be run from scratch)
+    coverage = meta['coverage'] if meta is not None and e_value / db_size <= meta['coverage'] else None
+    # Case stored hits do not cover required threshold: search every sequence again
+    if coverage is None:
+        stored, hits, coverage = dict(), list(), math.inf
+    # Define sequences which must be searched (either new or changed)
+    changed = [name for name, digest in sequences.items() if stored.get(name) != digest]
+    # Keep hits of unchanged sequences only (hits of removed sequences are dropped)
+    hits = [hit for hit in hits if hit[0] in sequences and stored.get(hit[0]) == sequences[hit[0]]]
+    # Case some sequences must be searched
+    if changed:
+        # Write changed sequences to temporary file, then search them
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            subset(test_path, changed, os.path.join(tmp_dir, 'changed.fasta'))
+            hits += run(os.path.join(tmp_dir, 'changed.fasta'), e_value * slack)
+        # Update covered threshold
+        coverage = min(coverage, e_value * slack / db_size)
+    # Store current search
+    save(cache_dir, key, {'source': os.path.abspath(test_path), 'db_size': db_size, 'coverage': coverage,
+                          'num_values': len(hits[0][1]) if hits else 0, 'num_changed': len(changed)},
+         sequences, hits)
+    # Remove least recently used searches
+    cache.evict(cache_dir, max_entries=max_entries)
+    # Return hits of current test set
+    return hits
@@ -106,4 +106,4 @@ GDDGGFDGGFDGGFDGGDF""",
     # Check response status
     assert status, 'Error: cannot retrieve job result'
     # Check correctedness of job result
-    assert sum([1 for c in job_result if c == '>']) == 3, 'Error: retrieverd fasta file is not coherent'
+    assert job_result.count('>') == 3, 'Error: retrieverd fasta file is not coherent'
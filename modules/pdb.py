@@ -7,22 +7,52 @@
 import requests
 import gzip
 import re
+import os
+import time
+import argparse
+import zlib
+import hashlib
+import tempfile
+import shutil
+import numpy as np
+import pandas as pd
 from os.path import isfile
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
+# Local dependencies (either run as script or imported as package)
+try:
+    from modules import cache
+except ImportError:
+    import cache
 
 
 # Constants
 BASE_URL = r'http://files.rcsb.org'  # Path to PDB
+STORE_DIR = os.path.join(cache.CACHE_DIR, 'ca')  # Alpha carbon coordinates store
+INDEX_FILE = 'index.tsv'  # Index of chains in store, written last: marks store as complete
+NUM_WORKERS = 8  # Maximum number of concurrent downloads (and pooled connections)
+NUM_RETRIES = 3  # Number of retries of a failed download
+BACKOFF = 0.5  # Seconds waited before first retry, doubled at each retry
+TIMEOUT = 30  # Seconds waited for server response
+RETRY_STATUS = (429, 500, 502, 503, 504)  # Response status codes worth a retry
+CHUNK_SIZE = 1 << 16  # Number of bytes streamed at once
+CHECKSUM_EXT = '.sha256'  # Extension of checksum sidecar files
+
+# Download outcomes
+DOWNLOADED = 'downloaded'
+SKIPPED = 'skipped'
+FAILED = 'failed'
 # http://files.rcsb.org/download/1eg3.pdb.gz
 
 # Retrieve PDB file, given a pdb_id
-def download(pdb_id, format='pdb', out_dir=None, out_path=None, compressed=True):
+def download(pdb_id, format='pdb', out_dir=None, out_path=None, compressed=True, base_url=BASE_URL):
     # Define path to pdb
     pdb_file = '.'.join([pdb_id, format] + (['gz'] if compressed else []))
     # Redefine output path (if directory, add output file)
     if out_dir is not None:
         out_path = '/'.join([re.sub(r'[/]$', '', out_dir), '.'.join([pdb_id, format])])
     # Make download rquest
-    response = requests.get('/'.join([BASE_URL, 'download', pdb_file]))
+    response = requests.get('/'.join([base_url, 'download', pdb_file]))
     # Check response status
     if response.status_code == 200:
         # Get file content (as bytes)
@@ -37,8 +67,501 @@ def download(pdb_id, format='pdb', out_dir=None, out_path=None, compressed=True)
     return response.status_code == 200, out_path, response
 
 
-# Unit testing
+# Check whether a downloaded file is complete
+def is_complete(out_path, format='pdb'):
+    """
+    A file is complete if it matches its checksum sidecar (written after each
+    download) or, if there is no sidecar, if it is a PDB file ending with END record
+    Input:
+        1. out_path:    path to downloaded file
+        2. format:      format of the file
+    Output:
+        1. whether file exists and is complete
+    """
+    # Case file does not exist
+    if not isfile(out_path):
+        return False
+    # Case checksum sidecar exists: compare checksums
+    if isfile(out_path + CHECKSUM_EXT):
+        with open(out_path + CHECKSUM_EXT, 'r') as checksum_file:
+            return checksum_file.read().strip() == cache.hash_file(out_path)
+    # Case PDB format: check last record (only file tail is read)
+    if format == 'pdb':
+        with open(out_path, 'rb') as out_file:
+            out_file.seek(max(os.path.getsize(out_path) - 1024, 0))
+            lines = out_file.read().split(b'\n')
+        lines = [line for line in lines if line.strip()]
+        return bool(lines) and lines[-1].startswith(b'END')
+    # Otherwise, completeness can not be checked
+    return False
+
+
+# Stream a remote file to disk, decompressing it on the fly
+def _fetch(session, url, out_path, compressed=True, timeout=TIMEOUT):
+    """
+    Content is written to a temporary file in the same directory, which is
+    renamed only once the whole content has been received: output file is
+    never left incomplete. Its checksum is written to a sidecar file.
+    Output:
+        1. response status code
+    """
+    # Make request, without loading whole content in memory
+    with session.get(url, stream=True, timeout=timeout) as response:
+        # Case request failed: return status code
+        if response.status_code != 200:
+            return response.status_code
+        # Define gzip decompressor, if any
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS) if compressed else None
+        # Define checksum of decompressed content
+        digest = hashlib.sha256()
+        # Write to temporary file
+        tmp_file = tempfile.NamedTemporaryFile(dir=os.path.dirname(os.path.abspath(out_path)), delete=False)
+        try:
+            with tmp_file:
+                # Loop through each chunk of content
+                for chunk in response.iter_content(CHUNK_SIZE):
+                    # Decompress chunk, if required
+                    chunk = decompressor.decompress(chunk) if decompressor is not None else chunk
+                    tmp_file.write(chunk)
+                    digest.update(chunk)
+                # Flush decompressor, check that compressed stream is complete
+                if decompressor is not None:
+                    chunk = decompressor.flush()
+                    tmp_file.write(chunk)
+                    digest.update(chunk)
+                    if not decompressor.eof:
+                        raise EOFError('Error: compressed stream of {:s} is truncated'.format(url))
+            # Move complete file to output path, then write its checksum
+            os.replace(tmp_file.name, out_path)
+            with open(out_path + CHECKSUM_EXT, 'w') as checksum_file:
+                checksum_file.write(digest.hexdigest() + '\n')
+        # Remove temporary file, if still there
+        finally:
+            if isfile(tmp_file.name):
+                os.remove(tmp_file.name)
+    # Return status code
+    return 200
+
+
+# Retrieve many PDB files concurrently, skipping the ones already downloaded
+def download_many(pdb_ids, out_dir, format='pdb', compressed=True, base_url=BASE_URL, num_workers=NUM_WORKERS,
+                  num_retries=NUM_RETRIES, backoff=BACKOFF, timeout=TIMEOUT):
+    """
+    Downloads share a single session, whose connection pool is as large as the
+    number of concurrent downloads. Failed downloads (either network errors or
+    server errors) are retried with exponential backoff. Files already
+    downloaded and complete (see is_complete(...)) are skipped, hence an
+    interrupted run can be resumed. PDB identifiers can be retrieved e.g. from
+    pdb_ids column of human proteome dataset (semicolon separated).
+    Input:
+        1. pdb_ids:     list of PDB identifiers
+        2. out_dir:     directory where PDB files are stored, as <pdb_id>.<format>
+        3. format:      format of PDB files (e.g. pdb, cif)
+        4. compressed:  whether to download compressed files (decompressed while streaming)
+        5. base_url:    URL of PDB server
+        6. num_workers: maximum number of concurrent downloads
+        7. num_retries: number of retries of each failed download
+        8. backoff:     seconds waited before first retry, doubled at each retry
+        9. timeout:     seconds waited for server response
+    Output:
+        1. dictionary mapping PDB identifiers to (outcome, output path), where outcome
+           is either DOWNLOADED, SKIPPED or FAILED
+    """
+    # Make output directory
+    os.makedirs(out_dir, exist_ok=True)
+    # Define session, with a connection pool for each worker
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=num_workers, pool_maxsize=num_workers)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+
+    # Define function retrieving a single file
+    def run(pdb_id):
+        # Define output path and remote file URL
+        out_path = os.path.join(out_dir, '.'.join([pdb_id, format]))
+        url = '/'.join([base_url, 'download', '.'.join([pdb_id, format] + (['gz'] if compressed else []))])
+        # Case file has already been downloaded: skip it
+        if is_complete(out_path, format=format):
+            return SKIPPED, out_path
+        # Try downloading file, retry on failure
+        for attempt in range(num_retries + 1):
+            # Wait before retrying (exponential backoff)
+            if attempt > 0:
+                time.sleep(backoff * 2 ** (attempt - 1))
+            # Try downloading file
+            try:
+                status = _fetch(session, url, out_path, compressed=compressed, timeout=timeout)
+            # Case network error or corrupted content: retry
+            except (requests.RequestException, zlib.error, EOFError):
+                continue
+            # Case file has been downloaded
+            if status == 200:
+                return DOWNLOADED, out_path
+            # Case server error is not worth a retry (e.g. file not found)
+            if status not in RETRY_STATUS:
+                break
+        # Return failure
+        return FAILED, out_path
+
+    # Run downloads concurrently
+    try:
+        with ThreadPoolExecutor(max_workers=num_workers) as pool:
+            return dict(zip(pdb_ids, pool.map(run, pdb_ids)))
+    # Close session
+    finally:
+        session.close()
+
+
+# Read alpha carbon (CA) coordinates of every model and chain
+def read_chains(pdb_path):
+    """
+    Alternate locations other than the first one are skipped, as well as
+    hetero atoms. Files without MODEL records are read as a single model.
+    Input:
+        1. pdb_path:    path to PDB file
+    Output:
+        1. generator of (model, chain, residue numbers, coordinates), where residue numbers
+           are int32 and coordinates are float32 with shape (number of residues, 3)
+    """
+    # Define current model and its chains (in order of appearance)
+    model, chains = 1, dict()
+    # Loop through each line in PDB file
+    with open(pdb_path, 'r') as pdb_file:
+        for line in pdb_file:
+            # Case new model: set model number
+            if line.startswith('MODEL'):
+                model = int(line[10:14])
+            # Case model is over: return its chains
+            elif line.startswith('ENDMDL'):
+                for chain, (residues, coords) in chains.items():
+                    yield model, chain, np.array(residues, dtype=np.int32), np.array(coords, dtype=np.float32)
+                chains = dict()
+            # Case CA atom (first alternate location only): store residue number and coordinates
+            elif line.startswith('ATOM') and line[12:16] == ' CA ' and line[16] in ' A':
+                residues, coords = chains.setdefault(line[21], (list(), list()))
+                residues.append(int(line[22:26]))
+                coords.append((float(line[30:38]), float(line[38:46]), float(line[46:54])))
+    # Return chains of last model, if not already returned
+    for chain, (residues, coords) in chains.items():
+        yield model, chain, np.array(residues, dtype=np.int32), np.array(coords, dtype=np.float32)
+
+
+# Read alpha carbon (CA) coordinates of a single chain
+def read_ca(pdb_path, chain=None, model=None):
+    """
+    Only the first model is read (e.g. NMR structures), as TMalign does,
+    unless another model is required
+    Input:
+        1. pdb_path:    path to PDB file
+        2. chain:       chain identifier (default first chain in model)
+        3. model:       model number (default first model in file)
+    Output:
+        1. array of residue numbers, int32
+        2. array of CA coordinates, float32 with shape (number of residues, 3)
+    """
+    # Define required model number
+    first = model
+    # Loop through each chain
+    for curr_model, curr, residues, coords in read_chains(pdb_path):
+        # Case required model is over: stop reading
+        first = curr_model if first is None else first
+        if model is None and curr_model != first:
+            break
+        # Case required chain of required model: return it
+        if curr_model == first and (chain is None or curr == chain):
+            return residues, coords
+    # Return empty chain
+    return np.zeros(0, dtype=np.int32), np.zeros((0, 3), dtype=np.float32)
+
+
+# Read alpha carbon (CA) coordinates of a single chain, in every model
+def read_models(pdb_path, chain=None):
+    """
+    Input:
+        1. pdb_path:    path to PDB file
+        2. chain:       chain identifier (default first chain of first model)
+    Output:
+        1. list of (model, residue numbers, coordinates), as read_ca(...) returns them
+    """
+    # Define models container
+    models = list()
+    # Loop through each chain of each model
+    for model, curr, residues, coords in read_chains(pdb_path):
+        # Case required chain: store it
+        chain = curr if chain is None else chain
+        if curr == chain:
+            models.append((model, residues, coords))
+    # Return chain in every model
+    return models
+
+
+# Write a .npy file, whose content has already been written to a (binary) file
+def _write_npy(npy_path, content_file, dtype, shape):
+    # Read content from its beginning
+    content_file.seek(0)
+    # Write header, then copy content without loading it in memory
+    with open(npy_path, 'wb') as npy_file:
+        np.lib.format.write_array_header_1_0(npy_file, {'descr': np.lib.format.dtype_to_descr(dtype),
+                                                        'fortran_order': False, 'shape': shape})
+        shutil.copyfileobj(content_file, npy_file, CHUNK_SIZE)
+
+
+# Parse PDB files once, store CA coordinates of every model and chain
+def make_store(pdb_paths, store_dir=STORE_DIR):
+    """
+    Coordinates are stored in columnar format, as .npy arrays which can be
+    memory mapped: residue numbers (int32) and coordinates (float32) of every
+    chain are concatenated, while the index (index.tsv) stores PDB identifier
+    (file name), content hash of PDB file, model, chain, offset and number of
+    residues of each chain. Chains are streamed to disk as soon as they are
+    read, hence memory does not grow with the number of PDB files.
+    Input:
+        1. pdb_paths:   paths to PDB files
+        2. store_dir:   directory where the store is written
+    Output:
+        1. path to store directory
+    """
+    # Make store directory, remove previous index (store is incomplete until written)
+    os.makedirs(store_dir, exist_ok=True)
+    if isfile(os.path.join(store_dir, INDEX_FILE)):
+        os.remove(os.path.join(store_dir, INDEX_FILE))
+    # Define index container and offset of current chain
+    index, offset = list(), 0
+    # Stream residue numbers and coordinates to temporary files
+    with tempfile.TemporaryFile(dir=store_dir) as residues_file, tempfile.TemporaryFile(dir=store_dir) as coords_file:
+        # Loop through each PDB file
+        for pdb_path in pdb_paths:
+            # Define PDB identifier (file name without extension) and content hash
+            pdb_id, pdb_hash = os.path.basename(pdb_path).split('.')[0], cache.hash_file(pdb_path)
+            # Loop through each model and chain
+            for model, chain, curr_residues, curr_coords in read_chains(pdb_path):
+                # Store chain in index
+                index.append((pdb_id, pdb_hash, model, chain, offset, len(curr_residues)))
+                offset += len(curr_residues)
+                # Write residue numbers and coordinates
+                residues_file.write(curr_residues.astype('<i4').tobytes())
+                coords_file.write(curr_coords.astype('<f4').tobytes())
+        # Write residue numbers and coordinates as .npy files
+        _write_npy(os.path.join(store_dir, 'residues.npy'), residues_file, np.dtype('<i4'), (offset, ))
+        _write_npy(os.path.join(store_dir, 'coords.npy'), coords_file, np.dtype('<f4'), (offset, 3))
+    # Write index
+    pd.DataFrame(index, columns=['pdb_id', 'hash', 'model', 'chain', 'offset', 'length']).to_csv(
+        os.path.join(store_dir, INDEX_FILE), sep='\t', index=False)
+    # Return path to store
+    return store_dir
+
+
+# Memory mapped alpha carbon (CA) coordinates store
+class Structures(object):
+
+    # Constructor
+    def __init__(self, store_dir=STORE_DIR):
+        """
+        Input:
+            1. store_dir:   directory where the store has been written (see make_store(...))
+        """
+        # Load index (chains are kept as strings, even if blank)
+        self.index = pd.read_csv(os.path.join(store_dir, INDEX_FILE), sep='\t', keep_default_na=False,
+                                 dtype={'pdb_id': str, 'chain': str})
+        # Memory map residue numbers and coordinates
+        self.residues = np.load(os.path.join(store_dir, 'residues.npy'), mmap_mode='r')
+        self.coords = np.load(os.path.join(store_dir, 'coords.npy'), mmap_mode='r')
+        # Map (pdb_id, model, chain) keys to index positions
+        self.positions = {key: i for i, key in enumerate(zip(
+            self.index['pdb_id'], self.index['model'].astype(int), self.index['chain']))}
+        # Map PDB identifiers to their first chain (first model), as TMalign reads them
+        self.first = dict()
+        for i, pdb_id in enumerate(self.index['pdb_id']):
+            self.first.setdefault(pdb_id, i)
+        # Map PDB identifiers to content hash of their PDB file (stores without hashes are never up to date)
+        self.hashes = dict(zip(self.index['pdb_id'], self.index['hash'])) if 'hash' in self.index.columns else {}
+
+    # Define number of chains
+    def __len__(self):
+        return len(self.positions)
+
+    # Check if either a (pdb_id, model, chain) key or a PDB identifier is in store
+    def __contains__(self, key):
+        return key in self.positions or key in self.first
+
+    # Loop through (pdb_id, model, chain) keys
+    def __iter__(self):
+        return iter(self.positions.keys())
+
+    # Retrieve residue numbers and coordinates, either by (pdb_id, model, chain) key or by position
+    def __getitem__(self, key):
+        # Define position in index
+        i = key if isinstance(key, (int, np.integer)) else self.positions[key]
+        # Define offset and length of chain
+        offset, length = int(self.index['offset'].iat[i]), int(self.index['length'].iat[i])
+        # Return memory mapped residue numbers and coordinates
+        return self.residues[offset:offset + length], self.coords[offset:offset + length]
+
+    # Retrieve (pdb_id, model, chain) keys of a PDB entry
+    def chains(self, pdb_id, model=None):
+        return [key for key in self.positions.keys() if key[0] == pdb_id and (model is None or key[1] == model)]
+
+    # Check whether a PDB file is stored and up to date (PDB files no longer available are trusted)
+    def is_current(self, pdb_path):
+        # Define PDB identifier (file name without extension)
+        pdb_id = os.path.basename(pdb_path).split('.')[0]
+        # Compare stored content hash against the one of PDB file
+        return pdb_id in self.hashes and (not isfile(pdb_path) or self.hashes[pdb_id] == cache.hash_file(pdb_path))
+
+    # Retrieve first chain of first model of a PDB entry, as read_ca(...) does
+    def get(self, pdb_id):
+        return self[self.first[pdb_id]]
+
+    # Release memory maps
+    def close(self):
+        self.residues, self.coords = None, None
+
+    # Use store as context manager
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+# Read alpha carbon (CA) coordinates of a PDB file, from store if available
+def load_ca(pdb_path, store=None, chain=None, model=None):
+    """
+    Input:
+        1. pdb_path:    path to PDB file
+        2. store:       Structures store, if any (used only if PDB file did not change since stored)
+        3. chain:       chain identifier (default first chain in model)
+        4. model:       model number (default first model in file)
+    Output:
+        1. array of residue numbers, int32
+        2. array of CA coordinates, float32 with shape (number of residues, 3)
+    """
+    # Define PDB identifier (file name without extension)
+    pdb_id = os.path.basename(pdb_path).split('.')[0]
+    # Case PDB entry is stored and up to date: load coordinates without parsing
+    if store is not None and store.is_current(pdb_path):
+        # Define required model (default first one)
+        model = int(store.index['model'].iat[store.first[pdb_id]]) if model is None else model
+        # Load required chain (default first one) of required model, if any
+        keys = [key for key in store.chains(pdb_id, model=model) if chain is None or key[2] == chain]
+        return store[keys[0]] if keys else (np.zeros(0, dtype=np.int32), np.zeros((0, 3), dtype=np.float32))
+    # Otherwise, parse PDB file
+    return read_ca(pdb_path, chain=chain, model=model)
+
+
+# Read alpha carbon (CA) coordinates of a single chain in every model, from store if available
+def load_models(pdb_path, store=None, chain=None):
+    """
+    Input:
+        1. pdb_path:    path to PDB file
+        2. store:       Structures store, if any (used only if PDB file did not change since stored)
+        3. chain:       chain identifier (default first chain of first model)
+    Output:
+        1. list of (model, residue numbers, coordinates), as read_models(...) returns them
+    """
+    # Define PDB identifier (file name without extension)
+    pdb_id = os.path.basename(pdb_path).split('.')[0]
+    # Case PDB entry is stored and up to date: load coordinates without parsing
+    if store is not None and store.is_current(pdb_path):
+        # Define required chain (default first one)
+        chain = store.index['chain'].iat[store.first[pdb_id]] if chain is None else chain
+        # Load required chain of every model
+        return [(key[1], *store[key]) for key in store.chains(pdb_id) if key[2] == chain]
+    # Otherwise, parse PDB file
+    return read_models(pdb_path, chain=chain)
+
+
+# Store CA coordinates of PDB files, or test downloads against a local HTTP server (no network required)
 if __name__ == '__main__':
 
-    # Retrieve a known file
-    download('1eg3', out_dir='data/pdb/', format='pdb', compressed=True)
+    # 1. Arguments
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pdb_dir', type=str, default='data/pdb')
+    parser.add_argument('--store_dir', type=str, default=STORE_DIR)
+    parser.add_argument('--test', action='store_true')
+    args = parser.parse_args()
+
+    # 2. Case store is required: parse every PDB file in directory once
+    if not args.test:
+        # Define PDB files in directory
+        pdb_paths = sorted(os.path.join(args.pdb_dir, name) for name in os.listdir(args.pdb_dir)
+                           if name.endswith('.pdb'))
+        # Store CA coordinates of every model and chain
+        make_store(pdb_paths, store_dir=args.store_dir)
+        print('Stored CA coordinates of {:d} PDB files in {:s}'.format(len(pdb_paths), args.store_dir))
+
+    # 3. Otherwise, test downloads: PDB files in directory are served by a local HTTP server
+    else:
+
+        # Test dependencies (local HTTP server)
+        import threading
+        from http.server import HTTPServer, BaseHTTPRequestHandler
+        from socketserver import ThreadingMixIn
+
+        # Define local HTTP server, serving fixture files as PDB server would
+        class FixtureServer(ThreadingMixIn, HTTPServer):
+            daemon_threads = True
+
+        # Define fixtures: compressed PDB files, served at /download/<pdb_id>.pdb.gz
+        pdb_ids = sorted(name[:-4] for name in os.listdir(args.pdb_dir) if name.endswith('.pdb'))[:8]
+        fixtures = dict()
+        for pdb_id in pdb_ids:
+            with open(os.path.join(args.pdb_dir, pdb_id + '.pdb'), 'rb') as pdb_file:
+                fixtures['/download/{:s}.pdb.gz'.format(pdb_id)] = gzip.compress(pdb_file.read())
+        # Define requests counter, first request of each file fails (tests retries)
+        requested = dict()
+
+        # Define request handler
+        class Handler(BaseHTTPRequestHandler):
+
+            # Serve fixture files
+            def do_GET(self):
+                # Count requests to current path
+                requested[self.path] = requested.get(self.path, 0) + 1
+                # Case unknown file
+                if self.path not in fixtures:
+                    self.send_response(404)
+                    self.end_headers()
+                # Case first request: temporary failure
+                elif requested[self.path] == 1:
+                    self.send_response(503)
+                    self.end_headers()
+                # Otherwise, serve file
+                else:
+                    self.send_response(200)
+                    self.send_header('Content-Length', str(len(fixtures[self.path])))
+                    self.end_headers()
+                    self.wfile.write(fixtures[self.path])
+
+            # Do not log requests
+            def log_message(self, *args):
+                pass
+
+        # Start server on a free port
+        server = FixtureServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base_url = 'http://127.0.0.1:{:d}'.format(server.server_address[1])
+
+        # Download fixtures to temporary directory
+        with tempfile.TemporaryDirectory() as out_dir:
+            # First run: each file is retried once, missing file fails
+            results = download_many(pdb_ids + ['0000'], out_dir, base_url=base_url, backoff=0.01)
+            assert all(results[pdb_id][0] == DOWNLOADED for pdb_id in pdb_ids)
+            assert results['0000'][0] == FAILED
+            # Check downloaded files against original ones
+            for pdb_id in pdb_ids:
+                with open(results[pdb_id][1], 'rb') as out_file:
+                    assert gzip.decompress(fixtures['/download/{:s}.pdb.gz'.format(pdb_id)]) == out_file.read()
+            # Second run: every file is skipped
+            results = download_many(pdb_ids, out_dir, base_url=base_url, backoff=0.01)
+            assert all(outcome == SKIPPED for outcome, _ in results.values())
+            # Third run: truncated file is downloaded again
+            with open(os.path.join(out_dir, pdb_ids[0] + '.pdb'), 'r+b') as out_file:
+                out_file.truncate(100)
+            results = download_many(pdb_ids, out_dir, base_url=base_url, backoff=0.01)
+            assert results[pdb_ids[0]][0] == DOWNLOADED
+            assert all(results[pdb_id][0] == SKIPPED for pdb_id in pdb_ids[1:])
+
+        # Stop server
+        server.shutdown()
+        print('Downloaded, skipped and resumed {:d} PDB files from local server'.format(len(pdb_ids)))
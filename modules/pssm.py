@@ -4,36 +4,152 @@
 
 
 # Dependencies
+import os
 import sys
+import shutil
 import subprocess
+import heapq
+import tempfile
+import numpy as np
 import pandas as pd
 import argparse
+from concurrent.futures import ThreadPoolExecutor
+# Local dependencies (either run as script or imported as package)
+try:
+    from modules import cache, fasta, incremental, store, sweep
+except ImportError:
+    import cache, fasta, incremental, store, sweep
 
 
-# Parse PSSM string result to Pandas DataFrame
-def parse(result, raw=False):
+# Constants
+DB_CACHE_DIR = os.path.join(cache.CACHE_DIR, 'blastdb')  # Managed BLAST databases
+DB_MAX_ENTRIES = 8  # Maximum number of BLAST databases kept in cache
+SHARD_CACHE_DIR = os.path.join(DB_CACHE_DIR, 'shards')  # Managed sharded BLAST databases
+CONVERGED = 'Search has CONVERGED!'  # Line printed by psiblast when search converged
+MAX_TARGET_SEQS = 500  # Default psiblast number of aligned sequences to keep
+BATCH_SIZE = 10000  # Default number of rows in each parsed batch
+# Columns of tabular output (outfmt=6), along with their types
+COLUMNS = {'query_acc_ver': object, 'subject_acc_ver': object, 'perc_identity': np.float64,
+           'align_length': np.int32, 'mismatches': np.int32, 'gap_opens': np.int32,
+           'q_start': np.int32, 'q_end': np.int32, 's_start': np.int32, 's_end': np.int32,
+           'evalue': np.float64, 'bit_score': np.float64}
+
+
+# Stream psiblast tabular output (outfmt=6) as typed DataFrame batches
+def stream(lines, batch_size=BATCH_SIZE, e_value=None, top_n=None):
     """
+    Lines which are not hits (e.g. empty lines or convergence message) are skipped.
+    Empty lines separate iterations, hence each hit is labelled with its iteration.
+    Hits not passing filters are discarded while reading: only kept hits are stored.
     Input:
-    - PSSM result, formatted as string
+        1. lines:       iterable of lines (either strings or bytes, e.g. a pipe)
+        2. batch_size:  maximum number of rows in each batch
+        3. e_value:     if set, keep only hits whose e-value is below or equal to it
+        4. top_n:       if set, keep only the best <top_n> hits (by e-value, then
+                        bit score) of each iteration, yielded once iteration ends
+    Output:
+        1. generator of DataFrame batches (COLUMNS, plus iteration)
+    """
+    # Initialize kept rows, current iteration and whether last line was a hit
+    rows, iteration, was_hit = list(), 1, False
+    # Loop through each line
+    for i, line in enumerate(lines):
+        # Decode line, if needed
+        line = line.decode('utf-8') if isinstance(line, bytes) else line
+        # Split line in fields
+        fields = line.rstrip('\n').split('\t')
+        # Case line is not a hit: empty line after hits closes iteration
+        if len(fields) != len(COLUMNS):
+            if was_hit and not line.strip():
+                # Yield (best) hits of closed iteration
+                if rows:
+                    yield from _batches(_best(rows) if top_n is not None else rows, iteration, batch_size)
+                    rows = list()
+                iteration, was_hit = iteration + 1, False
+            continue
+        # Case hit does not pass e-value threshold
+        was_hit = True  # Line is a hit, even if it is filtered out
+        if e_value is not None and float(fields[10]) > e_value:
+            continue
+        # Case only best hits must be kept: store them in a bounded heap
+        if top_n is not None:
+            heapq.heappush(rows, (-float(fields[10]), float(fields[11]), -i, fields))
+            if len(rows) > top_n: heapq.heappop(rows)
+        # Otherwise, yield batch as soon as it is full
+        else:
+            rows.append(fields)
+            if len(rows) >= batch_size:
+                yield from _batches(rows, iteration, batch_size)
+                rows = list()
+    # Yield remaining rows
+    if rows:
+        yield from _batches(_best(rows) if top_n is not None else rows, iteration, batch_size)
+
+
+# Sort hits stored in bounded heap: best first, ties in reading order
+def _best(heap):
+    return [fields for *_, fields in sorted(heap, reverse=True)]
+
+
+# Turn list of rows into typed DataFrame batches
+def _batches(rows, iteration, batch_size=BATCH_SIZE):
+    # Loop through each batch
+    for i in range(0, len(rows), batch_size):
+        # Transpose rows into columns
+        columns = list(zip(*rows[i:i+batch_size]))
+        # Cast each column to its own type
+        batch = pd.DataFrame({name: np.array(column, dtype=COLUMNS[name])
+                              for name, column in zip(COLUMNS, columns)})
+        # Set iteration
+        batch['iteration'] = np.int32(iteration)
+        yield batch
+
+
+# Concatenate typed batches into a single DataFrame
+def concat(batches, raw=False):
+    """
+    Input:
+    - batches: iterable of typed DataFrame batches (see stream(...))
+    - raw: whether to return all the columns or only the formatted ones
     Output:
     - PSSM result, formatted as Pandas DataFrame
     """
-    # Create DataFrame
-    result = pd.DataFrame([row.split('\t') for row in result.split('\n') if row != ''][:-1])
-    # Set column names
-    result.columns = ['query_acc_ver', 'subject_acc_ver', 'perc_identity',
-                      'align_length', 'mismatches', 'gap_opens', 'q_start', 'q_end',
-                      's_start', 's_end', 'evalue', 'bit_score']
+    # Create DataFrame from typed batches
+    result = pd.concat([
+        # Add an empty batch, which defines columns even if there is no hit
+        pd.DataFrame({name: np.array([], dtype=dtype) for name, dtype in {**COLUMNS, 'iteration': np.int32}.items()}),
+        *batches
+    ], ignore_index=True)
     # Format output if required
-    if not raw:
-        # Get subset of columns: sequence accession, start, end, evalue
-        result = result[['subject_acc_ver', 's_start', 's_end', 'evalue']]
-        # Map columns
-        result.columns = ['entry_ac', 'seq_start', 'seq_end', 'e_value']
+    return result if raw else _format(result)
+
+
+# Format raw result: return predicted sequence accession, start, end, evalue
+def _format(result):
+    # Get subset of columns: sequence accession, start, end, evalue
+    result = result[['subject_acc_ver', 's_start', 's_end', 'evalue']]
+    # Map columns
+    result.columns = ['entry_ac', 'seq_start', 'seq_end', 'e_value']
     # Return DataFrame object
     return result
 
 
+# Parse PSSM string result to Pandas DataFrame
+def parse(result, raw=False, **kwargs):
+    """
+    Input:
+    - PSSM result, formatted as string (or iterable of lines)
+    - raw: whether to return all the columns or only the formatted ones
+    - **kwargs: filters applied while reading (see stream(...))
+    Output:
+    - PSSM result, formatted as Pandas DataFrame
+    """
+    # Split string result into lines
+    lines = result.split('\n') if isinstance(result, str) else result
+    # Parse lines into typed batches, then concatenate them
+    return concat(stream(lines, **kwargs), raw=raw)
+
+
 # Fit the model (generate pssm)
 def fit(blast_path, msa_path, model_path=None):
     # Run PSSM creration
@@ -43,10 +159,72 @@ def fit(blast_path, msa_path, model_path=None):
     return pssm.stdout.decode('utf-8')
 
 
+# Fit the model (or retrieve it from models store, if alignment did not change)
+def fit_stored(blast_path, msa_path, model_path=None, name=None, store_dir=store.STORE_DIR):
+    """
+    Input:
+        1. blast_path:  path to input blast file (FASTA format)
+        2. msa_path:    path to multiple sequence alignment (FASTA format)
+        3. model_path:  if set, stored model is copied there
+        4. name:        name of the model (e.g. Pfam family), if any
+        5. store_dir:   directory where models are stored
+    Output:
+        1. path to stored model
+    """
+    # Fit the model, if not already stored
+    stored_path = store.fit(lambda path: fit(blast_path, msa_path, path), [msa_path, blast_path],
+                            kind='pssm', name=name, store_dir=store_dir)
+    # Copy stored model, if required
+    if model_path is not None:
+        shutil.copyfile(stored_path, model_path)
+    # Return path to stored model
+    return stored_path
+
+
+# Build BLAST database (or retrieve it from cache)
+def make_db(test_path, cache_dir=DB_CACHE_DIR, max_entries=DB_MAX_ENTRIES, options=('-parse_seqids',)):
+    """
+    Databases are stored in a managed cache, keyed on the hash of test set content
+    and makeblastdb options: an unchanged test set is never indexed twice, even
+    by concurrent processes (builds of the same database are serialized).
+    Databases built from previous versions of the same test set are evicted, along
+    with least recently used ones, exceeding the maximum number of entries.
+    Input:
+        1. test_path:       path to test set (FASTA format)
+        2. cache_dir:       directory where databases are stored
+        3. max_entries:     maximum number of databases kept in cache
+        4. options:         further makeblastdb options
+    Output:
+        1. path to BLAST database (to be used as -db argument)
+    """
+    # Define key of the database
+    source, options = os.path.abspath(test_path), list(options)
+    key = cache.hash_key(cache.hash_file(test_path), options)
+    # Define path to database (without extensions)
+    db_path = os.path.join(cache.entry_path(cache_dir, key), 'db')
+    # Case database has not been already built: serialize concurrent builds of the same database
+    if cache.lookup(cache_dir, key) is None:
+        with cache.lock(cache_dir, key):
+            # Retrieve database again, another process may have built it in the meanwhile
+            if cache.lookup(cache_dir, key) is None:
+                # Create database directory
+                cache.create(cache_dir, key)
+                # Build database
+                subprocess.run(['makeblastdb', '-dbtype', 'prot', '-in', test_path, '-out', db_path, *options],
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
+                # Mark database as complete
+                cache.commit(cache_dir, key, {'source': source, 'options': options})
+    # Remove databases built from previous versions of the same test set
+    cache.evict(cache_dir, max_entries=max_entries,
+                is_stale=lambda meta: meta['source'] == source and meta['key'] != key)
+    # Return path to database
+    return db_path
+
+
 # Evaluate the model against a test set
-def test(model_path, test_path, out_fmt=6, num_iterations=3, e_value=0.05):
+def test(model_path, test_path, out_fmt=6, num_iterations=3, e_value=0.05, cache_dir=DB_CACHE_DIR):
     """
-    Creates a blast db, the runs psi-blast with a given PSSM
+    Creates a blast db (or retrieves it from cache), the runs psi-blast with a given PSSM
     Errors are handled by catching SubprocessError exception
     More info about subprocess module: https://docs.python.org/3/library/subprocess.html
     By default, output is retrieved in tabular format (outfmt=6), which has the following columns:
@@ -58,14 +236,14 @@ def test(model_path, test_path, out_fmt=6, num_iterations=3, e_value=0.05):
         4. out_fmt:         output format (default 6, tabular)
         5. num_iterations:  number of psi-blast iterations
         6. e_value:         e-value threshold
+        7. cache_dir:       directory where BLAST databases are stored
     Output:
         1. text output retrieved from psiblast
     """
-    # Build database
-    subprocess.run(['makeblastdb', '-dbtype', 'prot', '-in', test_path, '-parse_seqids'],
-                    stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
+    # Build database (skipped if test set did not change)
+    db_path = make_db(test_path, cache_dir=cache_dir)
     # Run psi-blast
-    out = subprocess.run(['psiblast', '-in_pssm', model_path, '-db', test_path,
+    out = subprocess.run(['psiblast', '-in_pssm', model_path, '-db', db_path,
                           '-num_iterations', str(num_iterations),
                           '-evalue', str(e_value), '-outfmt', str(out_fmt)],
                           stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
@@ -73,12 +251,278 @@ def test(model_path, test_path, out_fmt=6, num_iterations=3, e_value=0.05):
     return out.stdout.decode('utf-8')
 
 
+# Evaluate the model against a test set, streaming parsed results
+def search(model_path, test_path, num_iterations=3, e_value=0.05, batch_size=BATCH_SIZE,
+           top_n=None, cache_dir=DB_CACHE_DIR):
+    """
+    Same as test(...), but psiblast output is parsed while it is being produced,
+    without waiting for the whole output string: only kept hits are stored in memory
+    Input:
+        1. model_path:      path to PSSM model
+        2. test_path:       path to test set (FASTA format)
+        3. num_iterations:  number of psi-blast iterations
+        4. e_value:         e-value threshold (both for psiblast and while reading)
+        5. batch_size:      maximum number of rows in each batch
+        6. top_n:           if set, keep only best <top_n> hits for each iteration
+        7. cache_dir:       directory where BLAST databases are stored
+    Output:
+        1. generator of typed DataFrame batches (see stream(...))
+    """
+    # Build database (skipped if test set did not change)
+    db_path = make_db(test_path, cache_dir=cache_dir)
+    # Define psi-blast command
+    args = ['psiblast', '-in_pssm', model_path, '-db', db_path,
+            '-num_iterations', str(num_iterations),
+            '-evalue', str(e_value), '-outfmt', '6']
+    # Run psi-blast, redirect errors to temporary file (avoids filling pipes)
+    with tempfile.TemporaryFile() as stderr:
+        with subprocess.Popen(args, stdout=subprocess.PIPE, stderr=stderr) as process:
+            # Parse output straight from pipe
+            yield from stream(process.stdout, batch_size=batch_size, e_value=e_value, top_n=top_n)
+        # Check return code
+        if process.returncode != 0:
+            stderr.seek(0)
+            raise subprocess.CalledProcessError(process.returncode, args, stderr=stderr.read())
+
+
+# Evaluate the model for each combination of iterations and e-value thresholds
+def test_sweep(model_path, test_path, iterations=(1, 2, 3), e_values=(1e-3, ), cache_dir=DB_CACHE_DIR):
+    """
+    A single search is run, with the highest number of iterations and the loosest
+    e-value threshold: psiblast reports hits of every iteration, while stricter
+    thresholds are applied in memory. Note that PSSM is updated with hits passing
+    the inclusion threshold, which does not depend on the reporting e-value.
+    Input:
+        1. model_path:  path to PSSM model
+        2. test_path:   path to test set (FASTA format)
+        3. iterations:  numbers of psi-blast iterations
+        4. e_values:    e-value thresholds
+        5. cache_dir:   directory where BLAST databases are stored
+    Output:
+        1. DataFrame of hits, with num_iterations and threshold columns (see sweep.expand(...))
+    """
+    # Run search once, at loosest threshold
+    hits = concat(search(model_path, test_path, num_iterations=max(iterations),
+                         e_value=max(e_values), cache_dir=cache_dir), raw=True)
+    # Define last iteration (search may have converged earlier)
+    last = hits['iteration'].max() if hits.shape[0] else 1
+    # Retrieve hits for each number of iterations
+    hits = {num_iterations: _format(hits[hits['iteration'] == min(num_iterations, last)])
+            for num_iterations in iterations}
+    # Apply e-value thresholds
+    return sweep.expand(hits, e_values)
+
+
+# Build sharded BLAST database (or retrieve it from cache)
+def make_shards(test_path, num_shards, cache_dir=SHARD_CACHE_DIR, max_entries=DB_MAX_ENTRIES,
+                options=('-parse_seqids',)):
+    """
+    Test set is split in shards having (almost) the same number of residues,
+    then each shard is indexed as a BLAST database on its own
+    Input:
+        1. test_path:       path to test set (FASTA format)
+        2. num_shards:      maximum number of shards (at most one for each sequence)
+        3. cache_dir:       directory where sharded databases are stored
+        4. max_entries:     maximum number of sharded databases kept in cache
+        5. options:         further makeblastdb options
+    Output:
+        1. list of paths to shards BLAST databases
+        2. total number of residues in test set (i.e. full database size)
+    """
+    # Define key of the sharded database
+    source, options = os.path.abspath(test_path), list(options)
+    key = cache.hash_key(cache.hash_file(test_path), options, num_shards)
+    # Retrieve sharded database from cache
+    meta = cache.lookup(cache_dir, key)
+    # Case sharded database has not been already built: serialize concurrent builds of the same database
+    if meta is None:
+        with cache.lock(cache_dir, key):
+            # Retrieve sharded database again, another process may have built it in the meanwhile
+            meta = cache.lookup(cache_dir, key)
+            # Case sharded database has still to be built
+            if meta is None:
+                # Split test set into shards (there are no more shards than sequences)
+                shards, num_seqs, num_residues = fasta.split(test_path, num_shards, cache.create(cache_dir, key))
+                # Build a database for each shard, concurrently
+                with ThreadPoolExecutor(max_workers=len(shards)) as pool:
+                    list(pool.map(lambda shard: subprocess.run(
+                        ['makeblastdb', '-dbtype', 'prot', '-in', shard, '-out', shard[:-len('.fasta')], *options],
+                        stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True
+                    ), shards))
+                # Mark sharded database as complete
+                meta = cache.commit(cache_dir, key, {'source': source, 'options': options,
+                                                     'num_seqs': num_seqs, 'num_residues': num_residues,
+                                                     'shards': [shard[:-len('.fasta')] for shard in shards]})
+    # Remove sharded databases built from previous versions of the same test set
+    cache.evict(cache_dir, max_entries=max_entries,
+                is_stale=lambda other: other['source'] == source and other['key'] != key)
+    # Return paths to shards and full database size
+    return meta['shards'], meta['num_residues']
+
+
+# Merge tabular outputs of psiblast searches run over different shards
+def merge(results, max_target_seqs=MAX_TARGET_SEQS):
+    """
+    Hits are merged iteration by iteration: shards which converged earlier carry
+    their last iteration forward. Each iteration is then sorted by e-value and bit
+    score, keeping only the best <max_target_seqs> subjects, as a single search would.
+    Input:
+        1. results:         list of psiblast tabular outputs (outfmt=6), as strings
+        2. max_target_seqs: maximum number of subjects kept for each iteration
+    Output:
+        1. merged tabular output (parse() compatible), as string
+    """
+    # Check if search converged for each shard
+    converged = all(CONVERGED in result for result in results)
+    # Split each result into iterations (separated by empty lines), keep only hits
+    results = [[[row for row in block.split('\n') if row.count('\t') == 11]
+                for block in result.replace(CONVERGED, '').strip('\n').split('\n\n')]
+               for result in results]
+    # Define number of iterations
+    num_iterations = max(len(result) for result in results)
+    # Loop through each iteration
+    blocks = list()
+    for i in range(num_iterations):
+        # Stack hits of current iteration (or last available one) for each shard
+        hits = [row.split('\t') for result in results for row in result[min(i, len(result) - 1)]]
+        # Sort hits by e-value, then by bit score
+        hits = sorted(hits, key=lambda hit: (float(hit[10]), -float(hit[11])))
+        # Keep only hits of best subjects
+        subjects = set()
+        for hit in hits:
+            if len(subjects) >= max_target_seqs and hit[1] not in subjects: continue
+            subjects.add(hit[1])
+        hits = [hit for hit in hits if hit[1] in subjects]
+        # Store iteration block
+        blocks.append('\n'.join('\t'.join(hit) for hit in hits))
+    # Return merged output (add convergence message as psiblast does)
+    return '\n\n'.join(blocks) + '\n' + ('\n' + CONVERGED + '\n' if converged else '')
+
+
+# Evaluate the model against a sharded test set, in parallel
+def test_parallel(model_path, test_path, num_shards=None, num_threads=1, num_iterations=1, e_value=0.05,
+                  max_target_seqs=MAX_TARGET_SEQS, cache_dir=SHARD_CACHE_DIR):
+    """
+    Test set is split into shards, which are searched by concurrent psiblast processes.
+    E-values are computed with respect to the full test set size (-dbsize), hence they
+    match the ones retrieved by a single process search. Only a single iteration is
+    allowed, since further iterations would update the PSSM of each shard with its own
+    hits only, instead of the hits in the whole test set.
+    Input:
+        1. model_path:      path to PSSM model
+        2. test_path:       path to test set (FASTA format)
+        3. num_shards:      number of shards searched concurrently (default number of cores)
+        4. num_threads:     number of threads used by each psiblast process
+        5. num_iterations:  number of psi-blast iterations (must be 1)
+        6. e_value:         e-value threshold
+        7. max_target_seqs: maximum number of aligned sequences to keep
+        8. cache_dir:       directory where sharded BLAST databases are stored
+    Output:
+        1. text output retrieved from psiblast (tabular format)
+    """
+    # Check that a single iteration is required
+    if num_iterations != 1:
+        raise ValueError('sharded search requires a single iteration, got %d' % num_iterations)
+    # Define number of shards
+    num_shards = num_shards or os.cpu_count()
+    # Build sharded database (skipped if test set did not change)
+    shards, db_size = make_shards(test_path, num_shards, cache_dir=cache_dir)
+    # Define function searching a single shard
+    def search(shard):
+        return subprocess.run(['psiblast', '-in_pssm', model_path, '-db', shard,
+                               '-dbsize', str(db_size), '-num_threads', str(num_threads),
+                               '-num_iterations', str(num_iterations), '-max_target_seqs', str(max_target_seqs),
+                               '-evalue', str(e_value), '-outfmt', '6'],
+                              stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
+    # Run psiblast processes concurrently, one for each shard
+    with ThreadPoolExecutor(max_workers=num_shards) as pool:
+        results = [out.stdout.decode('utf-8') for out in pool.map(search, shards)]
+    # Merge results
+    return merge(results, max_target_seqs=max_target_seqs)
+
+
+# Format e-value as in psiblast tabular output
+def format_evalue(value):
+    # Case e-value is almost zero
+    if value < 1e-180:
+        return '0.0'
+    # Case e-value is small: scientific notation
+    if value < 1e-99:
+        return '{:2.0e}'.format(value)
+    if value < 0.0009:
+        return '{:3.0e}'.format(value)
+    # Otherwise, fixed notation with decreasing precision
+    if value < 0.1:
+        return '{:4.3f}'.format(value)
+    if value < 1.0:
+        return '{:3.2f}'.format(value)
+    if value < 10.0:
+        return '{:2.1f}'.format(value)
+    return '{:5.0f}'.format(value)
+
+
+# Evaluate the model against a test set, searching only sequences changed since last search
+def test_incremental(model_path, test_path, e_value=0.05, max_target_seqs=MAX_TARGET_SEQS,
+                     cache_dir=incremental.CACHE_DIR):
+    """
+    Hits of each sequence are stored for the given model: new or changed sequences
+    are searched with the whole test set size (-dbsize), while stored e-values are
+    rescaled to it. Every hit passing the threshold is stored (subjects are not
+    truncated to <max_target_seqs>), so that sequences left out of the best ones by
+    a former search are still reported once better ones are removed: truncation is
+    applied to the merged output only. E-values are an approximation of the ones
+    of a search over the whole test set, since psiblast computes length adjustment
+    from the number of sequences actually searched, which -dbsize does not change.
+    Note that only a single iteration is allowed, since further iterations would
+    update the PSSM using hits in the whole test set.
+    Input:
+        1. model_path:      path to PSSM model
+        2. test_path:       path to test set (FASTA format)
+        3. e_value:         e-value threshold
+        4. max_target_seqs: maximum number of aligned sequences to keep
+        5. cache_dir:       directory where hits of each sequence are stored
+    Output:
+        1. text output retrieved from psiblast (tabular format)
+    """
+    # Define database size (number of residues), retrieved from index
+    with fasta.Fasta(test_path) as records:
+        db_size = sum(record.length for record in records.records)
+    # Define key of the search: model only, since stored hits are not truncated
+    key = cache.hash_key(cache.hash_file(model_path), 'psiblast', 'untruncated')
+    # Define function searching a subset of the test set
+    def run(subset_path, threshold):
+        # Build database of changed sequences only, in a temporary directory
+        with tempfile.TemporaryDirectory() as db_dir:
+            # Keep every subject passing threshold (at least one, as required by psiblast)
+            num_seqs = max(1, fasta.count(subset_path))
+            out = subprocess.run(['psiblast', '-in_pssm', model_path, '-db', make_db(subset_path, cache_dir=db_dir),
+                                  '-dbsize', str(db_size), '-num_iterations', '1',
+                                  '-max_target_seqs', str(num_seqs),
+                                  '-evalue', str(threshold), '-outfmt', '6'],
+                                 stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
+        # Retrieve hits, e-values are normalized by database size
+        rows = [row.split('\t') for row in out.stdout.decode('utf-8').split('\n') if row.count('\t') == 11]
+        return [(incremental.accession(row[1]), [float(row[10]) / db_size], '\t'.join(row)) for row in rows]
+    # Retrieve hits of current test set
+    hits = incremental.search(key, test_path, e_value, db_size, run, cache_dir=cache_dir)
+    # Rescale e-values to current database size, then apply threshold
+    rows = list()
+    for _, (value, ), row in hits:
+        # Compute e-value with respect to current database size
+        row, value = row.split('\t'), value * db_size
+        # Store hit, if it passes threshold
+        if value <= e_value:
+            rows.append('\t'.join(row[:10] + [format_evalue(value)] + row[11:]))
+    # Sort hits and keep best subjects, as a single search would
+    return merge(['\n'.join(rows)], max_target_seqs=max_target_seqs)
+
+
 ### MAIN
 if __name__ == '__main__':
 
     # 1. Define the arguments
     parser = argparse.ArgumentParser()
-    parser.add_argument('--fit',            type=bool,  default=True)
+    parser.add_argument('--fit',            type=lambda x: x.lower() in ('true', '1', 'yes'), default=True)
     parser.add_argument('--blast_path',     type=str,   default='data/blast.fasta')
     parser.add_argument('--msa_path',       type=str,   default='data/msa.edited.fasta')
     parser.add_argument('--model_path',     type=str,   default='models/model.pssm')
@@ -86,6 +530,14 @@ if __name__ == '__main__':
     parser.add_argument('--out_path',       type=str)
     parser.add_argument('--num_iterations', type=int,   default=3)
     parser.add_argument('--e_value',        type=float, default=0.001)
+    parser.add_argument('--cache_dir',      type=str,   default=DB_CACHE_DIR)
+    parser.add_argument('--num_shards',     type=int,   default=1)
+    parser.add_argument('--num_threads',    type=int,   default=1)
+    parser.add_argument('--incremental_dir', type=str)
+    parser.add_argument('--store_dir',      type=str)
+    parser.add_argument('--model_name',     type=str)
+    parser.add_argument('--sweep_iterations', type=int,   nargs='+')
+    parser.add_argument('--sweep_e_values',   type=float, nargs='+')
 
     # 2. Generate dictionary of args
     args = parser.parse_args()
@@ -93,16 +545,49 @@ if __name__ == '__main__':
     # 3. Run psi-blast
     try:
 
+        # Fit model, if requested, retrieving it from models store if alignment did not change
+        if args.fit and args.store_dir:
+            # Create new pssm using msa as input (if not stored), then copy it to model path
+            fit_stored(args.blast_path, args.msa_path, args.model_path,
+                       name=args.model_name, store_dir=args.store_dir)
         # Fit model, if requested
-        if args.fit:
+        elif args.fit:
             # Create new pssm using msa as input
             fit(args.blast_path, args.msa_path, args.model_path)
 
-        # Run psi-blast with given PSSM
-        psi_blast = test(args.model_path, args.test_path, out_fmt=6,
-                         num_iterations=args.num_iterations, e_value=args.e_value)
-        # Create dataset
-        psi_blast = parse(psi_blast)
+        # Run psi-blast with given PSSM, once for every combination of iterations and e-value
+        if args.sweep_iterations or args.sweep_e_values:
+            psi_blast = test_sweep(args.model_path, args.test_path,
+                                   iterations=args.sweep_iterations or [args.num_iterations],
+                                   e_values=args.sweep_e_values or [args.e_value],
+                                   cache_dir=args.cache_dir)
+        # Run psi-blast with given PSSM, searching only sequences changed since last run
+        elif args.incremental_dir:
+            # Check that a single iteration is required
+            if args.num_iterations != 1:
+                sys.exit('Error: incremental search requires a single iteration')
+            # Retrieve hits of the whole test set
+            psi_blast = test_incremental(args.model_path, args.test_path, e_value=args.e_value,
+                                         cache_dir=args.incremental_dir)
+            # Create dataset
+            psi_blast = parse(psi_blast)
+        # Run psi-blast with given PSSM, over sharded test set
+        elif args.num_shards > 1:
+            # Check that a single iteration is required
+            if args.num_iterations != 1:
+                sys.exit('Error: sharded search requires a single iteration')
+            # Retrieve hits of the whole test set, sharded databases are stored within cache directory
+            psi_blast = test_parallel(args.model_path, args.test_path,
+                                      num_shards=args.num_shards, num_threads=args.num_threads,
+                                      num_iterations=args.num_iterations, e_value=args.e_value,
+                                      cache_dir=os.path.join(args.cache_dir, 'shards'))
+            # Create dataset
+            psi_blast = parse(psi_blast)
+        # Run psi-blast with given PSSM, over the whole test set, parse output while reading it
+        else:
+            psi_blast = concat(search(args.model_path, args.test_path,
+                                      num_iterations=args.num_iterations, e_value=args.e_value,
+                                      cache_dir=args.cache_dir))
 
         # Case out path has been set: write to file
         if args.out_path:
@@ -0,0 +1,83 @@
+######################################
+### CONTENT ADDRESSED MODELS STORE ###
+######################################
+
+
+# Dependencies
+import os
+# Local dependencies (either run as script or imported as package)
+try:
+    from modules import cache
+except ImportError:
+    import cache
+
+
+# Constants
+STORE_DIR = os.path.join(cache.CACHE_DIR, 'models')  # Managed fitted models
+
+
+# Fit a model (or retrieve it from store)
+def fit(build, inputs, kind, options=(), name=None, store_dir=STORE_DIR):
+    """
+    Models are keyed on the content of their inputs (e.g. multiple sequence
+    alignment), on their kind and on builder options: an unchanged alignment is
+    never fitted twice. Models are never evicted, each one lives in its own
+    entry along with its metadata (kind, names, inputs and options). Concurrent
+    processes fitting (or naming) the same model wait for each other.
+    Input:
+        1. build:       function fitting the model, given the path where it must be stored
+        2. inputs:      paths to files the model is built from
+        3. kind:        kind of model (e.g. pssm, hmm), used as model file extension
+        4. options:     builder options
+        5. name:        name of the model (e.g. Pfam family), if any
+        6. store_dir:   directory where models are stored
+    Output:
+        1. path to fitted model
+    """
+    # Define key of the model
+    options = list(options)
+    key = cache.hash_key(kind, [cache.hash_file(path) for path in inputs], options)
+    # Define path to model file
+    model_path = os.path.join(cache.entry_path(store_dir, key), 'model.' + kind)
+    # Retrieve model from store
+    meta = cache.lookup(store_dir, key)
+    # Case model must be either fitted or renamed: serialize concurrent builds of the same model
+    if meta is None or (name is not None and name not in meta['names']):
+        with cache.lock(store_dir, key):
+            # Retrieve model again, another process may have fitted it in the meanwhile
+            meta = cache.lookup(store_dir, key)
+            # Case model has not been fitted yet
+            if meta is None:
+                # Make entry directory, then fit the model into it
+                build(os.path.join(cache.create(store_dir, key), 'model.' + kind))
+                # Mark model as complete
+                meta = cache.commit(store_dir, key, {'kind': kind, 'names': [], 'options': options,
+                                                     'inputs': [os.path.abspath(path) for path in inputs]})
+            # Case model has been given a new name: add it to metadata
+            if name is not None and name not in meta['names']:
+                cache.commit(store_dir, key, {**meta, 'names': [*meta['names'], name]})
+    # Return path to fitted model
+    return model_path
+
+
+# List stored models
+def models(kind=None, name=None, store_dir=STORE_DIR):
+    """
+    Input:
+        1. kind:        if set, list only models of the given kind
+        2. name:        if set, list only models having the given name
+        3. store_dir:   directory where models are stored
+    Output:
+        1. list of models metadata, along with path to model file, most recently used first
+    """
+    # Define output container
+    found = list()
+    # Loop through each stored model
+    for key, meta, _ in cache.entries(store_dir):
+        # Skip models of other kinds, or having other names
+        if kind is not None and meta['kind'] != kind: continue
+        if name is not None and name not in meta['names']: continue
+        # Store model metadata, along with its path
+        found.append({**meta, 'path': os.path.join(cache.entry_path(store_dir, key), 'model.' + meta['kind'])})
+    # Return models
+    return found
@@ -0,0 +1,138 @@
+################################
+### STRUCTURAL SUPERPOSITION ###
+################################
+
+
+# Dependencies
+import numpy as np
+
+
+# Constants
+D0_MIN = 0.5  # Minimum TM-score distance scale (Angstrom), as in TMalign
+
+
+# Define TM-score distance scale, given normalization length(s)
+def d0(length):
+    # Compute distance scale, short chains are bounded by minimum scale
+    return np.maximum(1.24 * np.cbrt(np.maximum(np.asarray(length, dtype=np.float64) - 15, 0)) - 1.8, D0_MIN)
+
+
+# Retrieve positions of residues shared by two structures (same residue number)
+def by_number(residues1, residues2):
+    """
+    Input:
+        1. residues1:   array of residue numbers of first structure
+        2. residues2:   array of residue numbers of second structure
+    Output:
+        1. positions of shared residues in first structure
+        2. positions of shared residues in second structure
+    """
+    # Retrieve shared residue numbers, along with their positions
+    _, index1, index2 = np.intersect1d(residues1, residues2, return_indices=True)
+    # Return positions, sorted by first structure
+    order = np.argsort(index1)
+    return index1[order], index2[order]
+
+
+# Stack coordinates of different lengths into a single padded array
+def pad(coords):
+    """
+    Input:
+        1. coords:  list of coordinates arrays, with shape (number of residues, 3)
+    Output:
+        1. padded coordinates, with shape (number of arrays, maximum number of residues, 3)
+        2. boolean mask, true for actual residues
+    """
+    # Define number of residues of each array
+    lengths = np.array([len(curr) for curr in coords], dtype=np.int64)
+    # Define mask of actual residues
+    mask = np.arange(lengths.max(initial=0)) < lengths[:, None]
+    # Fill padded array
+    padded = np.zeros(mask.shape + (3, ), dtype=np.float64)
+    padded[mask] = np.concatenate(coords).reshape(-1, 3) if len(coords) else np.zeros((0, 3))
+    # Return padded coordinates and mask
+    return padded, mask
+
+
+# Compute optimal superposition of many pairs of structures at once (Kabsch algorithm)
+def kabsch(coords1, coords2, mask=None):
+    """
+    Each pair is made of residues already put in correspondence, the first
+    structure is superposed onto the second one: coords1 @ rotation + translation
+    Input:
+        1. coords1:     first structures coordinates, with shape (number of pairs, number of residues, 3)
+        2. coords2:     second structures coordinates, with the same shape as coords1
+        3. mask:        boolean mask of actual residues, with shape (number of pairs, number of residues)
+    Output:
+        1. rotation matrices, with shape (number of pairs, 3, 3)
+        2. translation vectors, with shape (number of pairs, 3)
+    """
+    # Define weights of residues (padding residues do not count)
+    weights = np.ones(coords1.shape[:2]) if mask is None else mask.astype(np.float64)
+    count = np.maximum(weights.sum(axis=1), 1)[:, None]
+    # Compute centroids
+    center1 = np.einsum('bn,bni->bi', weights, coords1) / count
+    center2 = np.einsum('bn,bni->bi', weights, coords2) / count
+    # Compute covariance matrices of centered coordinates
+    covariance = np.einsum('bn,bni,bnj->bij', weights, coords1 - center1[:, None], coords2 - center2[:, None])
+    # Decompose covariance matrices
+    u, _, vt = np.linalg.svd(covariance)
+    # Correct reflections, so that rotations are proper
+    sign = np.sign(np.linalg.det(u @ vt))
+    u[:, :, 2] *= np.where(sign == 0, 1, sign)[:, None]
+    # Define rotations (row vectors) and translations
+    rotation = u @ vt
+    translation = center2 - np.einsum('bi,bij->bj', center1, rotation)
+    # Return rotations and translations
+    return rotation, translation
+
+
+# Compute RMSD and TM-score of many pairs of structures at once, after optimal superposition
+def scores(coords1, coords2, mask=None, lengths=None):
+    """
+    Structures are superposed minimizing RMSD (see kabsch(...)): TM-score is
+    computed on the same superposition, hence it is a lower bound of the one
+    TMalign would find by maximizing TM-score itself.
+    Input:
+        1. coords1:     first structures coordinates, with shape (number of pairs, number of residues, 3)
+        2. coords2:     second structures coordinates, with the same shape as coords1
+        3. mask:        boolean mask of actual residues, with shape (number of pairs, number of residues)
+        4. lengths:     TM-score normalization lengths, one for each pair (default number of residues)
+    Output:
+        1. array of RMSD, one for each pair
+        2. array of TM-scores, one for each pair
+    """
+    # Define mask of actual residues
+    mask = np.ones(coords1.shape[:2], dtype=bool) if mask is None else mask
+    # Define normalization lengths
+    count = mask.sum(axis=1)
+    lengths = count if lengths is None else np.asarray(lengths, dtype=np.float64)
+    # Superpose first structures onto second ones
+    rotation, translation = kabsch(coords1, coords2, mask)
+    # Compute distances between corresponding residues
+    distances = np.linalg.norm(coords1 @ rotation + translation[:, None] - coords2, axis=2)
+    # Compute RMSD
+    rmsd = np.sqrt(np.sum(np.where(mask, distances ** 2, 0), axis=1) / np.maximum(count, 1))
+    # Compute TM-score
+    tm_score = np.sum(np.where(mask, 1 / (1 + (distances / d0(lengths)[:, None]) ** 2), 0), axis=1)
+    tm_score = tm_score / np.maximum(lengths, 1)
+    # Return scores
+    return rmsd, tm_score
+
+
+# Compute RMSD and TM-score of many pairs of matched coordinates, with different lengths
+def superpose(coords1, coords2, lengths=None):
+    """
+    Input:
+        1. coords1:     list of first structures coordinates, with shape (number of residues, 3)
+        2. coords2:     list of second structures coordinates, matching coords1 residue by residue
+        3. lengths:     TM-score normalization lengths, one for each pair (default number of residues)
+    Output:
+        1. array of RMSD, one for each pair
+        2. array of TM-scores, one for each pair
+    """
+    # Stack coordinates into padded arrays
+    coords1, mask = pad(coords1)
+    coords2, _ = pad(coords2)
+    # Compute scores
+    return scores(coords1, coords2, mask, lengths)
@@ -0,0 +1,58 @@
+##############################################
+### E-VALUE AND ITERATIONS THRESHOLDS SWEEP ###
+##############################################
+
+
+# Dependencies
+import numpy as np
+import pandas as pd
+
+
+# Derive hits for each (iterations, e-value) combination
+def expand(hits, e_values):
+    """
+    Hits must have been retrieved at the loosest e-value threshold: stricter
+    thresholds are then applied in memory, without running any other search.
+    Hits whose e-value equals the threshold are kept, as both psiblast (-evalue)
+    and HMMER (-E) do when reporting.
+    Input:
+        1. hits:        dictionary mapping number of iterations to DataFrame of hits
+                        (entry_ac, seq_start, seq_end, e_value)
+        2. e_values:    e-value thresholds
+    Output:
+        1. DataFrame of hits, with num_iterations and threshold columns
+    """
+    # Define output container
+    swept = list()
+    # Loop through each number of iterations
+    for num_iterations, curr in hits.items():
+        # Get e-values as float
+        e_value = curr['e_value'].astype(np.float64)
+        # Loop through each e-value threshold
+        for threshold in sorted(e_values):
+            # Keep hits passing threshold
+            kept = curr[e_value <= threshold]
+            # Store current combination
+            swept.append(kept.assign(num_iterations=num_iterations, threshold=threshold))
+    # Stack hits for each combination
+    swept = pd.concat(swept, ignore_index=True)
+    # Keep track of all combinations, even the ones without any hit
+    swept['num_iterations'] = pd.Categorical(swept['num_iterations'], categories=sorted(hits.keys()))
+    swept['threshold'] = pd.Categorical(swept['threshold'], categories=sorted(e_values))
+    # Return hits for each combination
+    return swept
+
+
+# Summarize swept hits
+def summary(swept):
+    """
+    Input:
+        1. swept:   DataFrame of hits, as returned by expand(...)
+    Output:
+        1. DataFrame with number of hits and number of distinct proteins
+           for each (num_iterations, threshold) combination
+    """
+    return swept.groupby(by=['num_iterations', 'threshold'], observed=False).agg(
+        num_hits=('entry_ac', 'size'),
+        num_proteins=('entry_ac', 'nunique')
+    ).reset_index()
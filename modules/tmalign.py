@@ -7,65 +7,86 @@
 import numpy as np
 import pandas as pd
 import re
+import os
 import subprocess
 import argparse
+import warnings
 import sys
+import sqlite3
+import tempfile
+import itertools
+import functools
+from tqdm import tqdm
+from scipy.spatial.distance import cdist, pdist
+from concurrent.futures import ThreadPoolExecutor
+# Local dependencies (either run as script or imported as package)
+try:
+    from modules import cache, pdb, superpose
+except ImportError:
+    import cache, pdb, superpose
 
 
 # Constants
 SCRIPT_PATH = r'./resources/TMalign'  # Defualt path to script
+CACHE_PATH = os.path.join(cache.CACHE_DIR, 'tmalign.sqlite')  # Pairwise alignments cache, if enabled without a path
+COMMIT_EVERY = 100  # Number of alignments stored in cache before committing
+CHUNK_SIZE = 100  # Number of pairs aligned by a single TMalign process, if list mode is supported
+BATCH_SIZE = 10000  # Number of pairs dispatched to workers at once
+TOP_K = 10  # Number of candidate neighbours aligned for each structure
+MIN_LENGTH_RATIO = 1 / 3  # Below this length ratio, TM-score (average length normalized) is less than 0.5
+HIST_BINS = np.append(np.arange(0, 42, 2), np.inf)  # CA distance histogram bins (Angstrom)
+BLOCK_SIZE = 1000  # Number of structures whose candidates are ranked at once
+
+# Summary of a single pairwise alignment in TMalign output (chains, lengths, scores)
+ALIGN_RE = re.compile(
+    r'Name of Chain_1:(.+?)\n'
+    r'Name of Chain_2:(.+?)\n'
+    r'Length of Chain_1: (\d+).*\n'
+    r'Length of Chain_2: (\d+).*\n\s*'
+    r'Aligned length=[ ]+(\d+), RMSD=[ ]+([\d.]+), Seq_ID=n_identical/n_aligned=[ ]+([\d.]+).*\n'
+    r'TM-score= ([\d.]+).*\n'
+    r'TM-score= ([\d.]+).*\n'
+    r'TM-score= ([\d.]+)'
+)
+
+
+# Turn a single alignment summary into parsed results
+def _unpack(match):
+    # Retrieve matched groups
+    name1, name2, len1, len2, align_len, rmsd, seq_id, tm_score1, tm_score2, tm_score = match.groups()
+    # Define chains data
+    chains = {0: {'name': name1, 'len': int(len1), 'tm_score': float(tm_score1)},
+              1: {'name': name2, 'len': int(len2), 'tm_score': float(tm_score2)}}
+    # Return retrieved data
+    return chains, int(align_len), float(rmsd), float(tm_score), float(seq_id)
 
 
 # Parse result
 def parse(out):
+    """
+    Input:
+        1. out:     TMalign output (run with -a T), as string
+    Output:
+        1. chains:      dictionary mapping 0 and 1 to chains name, length and TM-score
+        2. align_len:   number of aligned residues
+        3. rmsd:        root mean squared deviation of aligned residues
+        4. tm_score:    TM-score normalized by average length of chains
+        5. seq_id:      number of identical residues over aligned ones
+    """
+    # Match first alignment summary (raises AttributeError if there is none)
+    return _unpack(ALIGN_RE.search(out))
 
-    # Define chains container
-    chains = dict()
-    # Get chains data
-    for i in range(2):
-        # Define current chain container
-        chains.setdefault(i, dict())
-        # Get chain name
-        chains[i]['name'] = str(re.search(
-            r'Name of Chain_{:d}:(.+?)\n'.format(i+1), out
-        ).group(1))
-        # Get chain length
-        chains[i]['len'] = int(re.search(
-            r'Length of Chain_{:d}: (\d+)?'.format(i+1), out
-        ).group(1))
-
-    # Get TM score for each chain
-    tm_score = re.findall(
-        r'TM-score= ([\d.]+)?', out
-    )
-    # Store TM scores separately
-    chains[0]['tm_score'] = float(tm_score[0])
-    chains[1]['tm_score'] = float(tm_score[1])
-
-    # Get normalized TM score
-    tm_score = float(tm_score[2])
-
-    # Get aligned residues length
-    align_len = int(re.search(
-        r'Aligned length=[ ]+(\d+)?', out
-    ).group(1))
-    # Get root mean squared deviation (RMSD)
-    rmsd = float(
-        re.search(r'RMSD=[ ]+([\d.]+)?', out
-    ).group(1))
-    # Get n. identical / n. aligned
-    seq_id = float(re.search(
-        r'Seq_ID=n_identical/n_aligned=[ ]+([\d.]+)?', out
-    ).group(1))
 
-    # Return retrieved data
-    return chains, align_len, rmsd, tm_score, seq_id
+# Parse output of multiple alignments, in a single pass
+def parse_all(out):
+    # Return parsed results of each alignment, in output order
+    return [_unpack(match) for match in ALIGN_RE.finditer(out)]
 
 
 # Execute alignment
-def align(pdb1_path, pdb2_path,script_path=SCRIPT_PATH):
+def align(pdb1_path, pdb2_path,script_path=SCRIPT_PATH, options=()):
     # Run script, store result
-    out = subprocess.run([script_path, '-a', 'T', pdb1_path, pdb2_path],
+    out = subprocess.run([script_path, '-a', 'T', *options, pdb1_path, pdb2_path],
                          stdout=subprocess.PIPE,
                          stderr=subprocess.PIPE,
                          check=True)
@@ -73,34 +94,581 @@ def align(pdb1_path, pdb2_path,script_path=SCRIPT_PATH):
     return out.stdout.decode('utf-8')
 
 
+# Execute alignment of a structure against many others, in a single process
+def align_many(pdb1_path, pdb2_paths, script_path=SCRIPT_PATH, options=()):
+    """
+    TMalign list mode (-dir2) aligns a structure against each structure in a
+    list, hence process start-up is paid once. Listed structures must be in the
+    same directory: if they are not, they are linked into a temporary one.
+    Input:
+        1. pdb1_path:   path to first PDB file (Chain_1)
+        2. pdb2_paths:  paths to other PDB files (Chain_2 of each alignment)
+        3. script_path: path to TMalign executable
+        4. options:     further TMalign options
+    Output:
+        1. concatenated output of each alignment, in the same order as pdb2_paths
+    """
+    # Make temporary directory, storing list of structures
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # Define directory of listed structures
+        pdb2_dirs = {os.path.dirname(os.path.abspath(pdb2_path)) for pdb2_path in pdb2_paths}
+        # Case structures are all in the same directory: list their file names
+        if len(pdb2_dirs) == 1:
+            pdb2_dir, pdb2_names = pdb2_dirs.pop(), [os.path.basename(pdb2_path) for pdb2_path in pdb2_paths]
+        # Otherwise, link structures into temporary directory (names are made unique)
+        else:
+            pdb2_dir, pdb2_names = tmp_dir, ['{:d}_{:s}'.format(k, os.path.basename(pdb2_path))
+                                             for k, pdb2_path in enumerate(pdb2_paths)]
+            for pdb2_path, pdb2_name in zip(pdb2_paths, pdb2_names):
+                os.symlink(os.path.abspath(pdb2_path), os.path.join(tmp_dir, pdb2_name))
+        # Write list of structures
+        with open(os.path.join(tmp_dir, 'list.txt'), 'w') as list_file:
+            list_file.write(''.join(pdb2_name + '\n' for pdb2_name in pdb2_names))
+        # Run script, store result
+        out = subprocess.run([script_path, pdb1_path, '-dir2', pdb2_dir + os.sep, os.path.join(tmp_dir, 'list.txt'),
+                              '-a', 'T', *options],
+                             stdout=subprocess.PIPE,
+                             stderr=subprocess.PIPE,
+                             check=True)
+    # Return alignment results
+    return out.stdout.decode('utf-8')
+
+
+# Check whether TMalign supports list mode (-dir2), probing each executable once
+@functools.lru_cache(maxsize=None)
+def supports_list(script_path=SCRIPT_PATH):
+    # Retrieve TMalign extended help, which documents every option
+    try:
+        out = subprocess.run([script_path, '-h'], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    # Case executable can not be run: list mode is not available
+    except OSError:
+        return False
+    # Check whether list mode option is documented
+    return b'-dir2' in out.stdout + out.stderr
+
+
+# Open pairwise alignments cache
+def connect(cache_path=CACHE_PATH):
+    """
+    Alignments are keyed on the content of both PDB files and on TMalign
+    executable and options, hence renamed or moved files are never aligned twice
+    Input:
+        1. cache_path:  path to SQLite database storing alignments
+    Output:
+        1. connection to SQLite database
+    """
+    # Make cache directory, if any
+    if os.path.dirname(cache_path):
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    # Open database, make alignments table
+    db = sqlite3.connect(cache_path)
+    db.execute('CREATE TABLE IF NOT EXISTS alignments ('
+               'pdb1 TEXT, pdb2 TEXT, options TEXT, align_len INTEGER, rmsd REAL, tm_score REAL, seq_id REAL, '
+               'PRIMARY KEY (pdb1, pdb2, options))')
+    # Return connection
+    return db
+
+
+# Align a single pair of PDB files, return NaN scores on failure
+def _align_pair(pdb1_path, pdb2_path, script_path=SCRIPT_PATH, options=()):
+    # Try executing and parsing pairwise alignment
+    try:
+        # Execute pairwise alignment
+        align_out = align(pdb1_path, pdb2_path, script_path=script_path, options=options)
+        # Parse alignment results
+        _, align_len, rmsd, tm_score, seq_id = parse(align_out)
+        # Return scores
+        return align_len, rmsd, tm_score, seq_id
+    # Case alignment failed: warn user, scores are not available
+    except subprocess.CalledProcessError as e:
+        warnings.warn('Alignment of {:s} against {:s} failed: {:s}'.format(
+            pdb1_path, pdb2_path, e.stderr.decode('utf-8').strip()))
+    # Case alignment output can not be parsed: warn user, scores are not available
+    except (AttributeError, IndexError, ValueError):
+        warnings.warn('Alignment of {:s} against {:s} could not be parsed'.format(pdb1_path, pdb2_path))
+    # Return missing scores
+    return None
+
+
+# Align a structure against many others in a single process, fall back to single pairs on failure
+def _align_many(pdb1_path, pdb2_paths, script_path=SCRIPT_PATH, options=()):
+    # Case single pair: no batch is required
+    if len(pdb2_paths) == 1:
+        return [_align_pair(pdb1_path, pdb2_paths[0], script_path=script_path, options=options)]
+    # Try executing and parsing alignments in a single process
+    try:
+        results = parse_all(align_many(pdb1_path, pdb2_paths, script_path=script_path, options=options))
+        # Case each alignment has been retrieved: return scores
+        if len(results) == len(pdb2_paths):
+            return [(align_len, rmsd, tm_score, seq_id) for _, align_len, rmsd, tm_score, seq_id in results]
+    # Case batch failed: alignments are run one by one
+    except subprocess.CalledProcessError:
+        pass
+    # Align each pair by itself, so that failures are isolated
+    return [_align_pair(pdb1_path, pdb2_path, script_path=script_path, options=options) for pdb2_path in pdb2_paths]
+
+
+# Define names of PDB files (file name without extension)
+def names(pdb_paths):
+    return [re.search(r'/(\w+)?[.\w]+$', pdb_path).group(1) for pdb_path in pdb_paths]
+
+
+# Align pairs of PDB files, yield scores as soon as they are available
+def align_pairs(pdb_paths, pairs, script_path=SCRIPT_PATH, num_workers=None, verbose=False,
+                options=(), cache_path=None, known=None, total=None, chunk_size=None):
+    """
+    Pairwise alignments are independent from each other: TMalign processes are
+    run concurrently, dispatched by a pool of threads, in batches of pairs (hence
+    pairs may be lazily generated). A failed alignment does not stop the other
+    ones: its scores are set to NaN and a warning is issued. Only pairs which
+    are neither known nor in cache are aligned. If <chunk_size> is greater than
+    one, pairs sharing their first structure are aligned by a single process,
+    in chunks (TMalign list mode, see align_many(...)). By default, list mode
+    is used whenever TMalign supports it (see supports_list(...)).
+    Input:
+        1. pdb_paths:   paths to PDB files
+        2. pairs:       iterable of (i, j) pairs of indices of PDB files to align
+        3. script_path: path to TMalign executable
+        4. num_workers: number of concurrent TMalign processes (default number of cores)
+        5. verbose:     whether to show a progress bar
+        6. options:     further TMalign options
+        7. cache_path:  path to SQLite database storing alignments (default None, no cache)
+        8. known:       function returning (RMSD, TM-score) of an already aligned pair, None otherwise
+        9. total:       number of pairs (used by progress bar only)
+        10. chunk_size: maximum number of pairs aligned by a single TMalign process
+                        (default CHUNK_SIZE if list mode is supported, 1 otherwise)
+    Output:
+        1. generator of (i, j, RMSD, TM-score), in the same order as pairs
+    """
+    # Define chunk size: use list mode whenever it is supported
+    if chunk_size is None:
+        chunk_size = CHUNK_SIZE if supports_list(script_path) else 1
+    # Open cache, if required
+    db = connect(cache_path) if cache_path else None
+    try:
+
+        # Define keys: content of each PDB file, TMalign executable and options
+        if db is not None:
+            hashes = [cache.hash_file(pdb_path) for pdb_path in pdb_paths]
+            key = cache.hash_key(cache.hash_file(script_path), ['-a', 'T', *options])
+        # Define function aligning a chunk of pairs sharing their first structure
+        def run(chunk):
+            return _align_many(pdb_paths[chunk[0][0]], [pdb_paths[j] for _, j in chunk],
+                               script_path=script_path, options=options)
+
+        # Define number of alignments stored in cache, since last commit
+        stored = 0
+        # Run alignments concurrently
+        with ThreadPoolExecutor(max_workers=num_workers or os.cpu_count()) as pool, \
+                tqdm(total=total, disable=not verbose) as progress:
+            # Loop through each batch of pairs
+            pairs = iter(pairs)
+            for batch in iter(lambda: list(itertools.islice(pairs, BATCH_SIZE)), []):
+                # Define scores (RMSD, TM-score) of already aligned pairs
+                scores = [known(i, j) if known is not None else None for i, j in batch]
+                # Retrieve cached pairs
+                for k, (i, j) in enumerate(batch):
+                    if db is not None and scores[k] is None:
+                        scores[k] = db.execute('SELECT rmsd, tm_score FROM alignments '
+                                               'WHERE pdb1 = ? AND pdb2 = ? AND options = ?',
+                                               (hashes[i], hashes[j], key)).fetchone()
+                # Group missing pairs by first structure
+                missing = dict()
+                for k in range(len(batch)):
+                    if scores[k] is None:
+                        missing.setdefault(batch[k][0], list()).append(k)
+                # Split groups into chunks
+                chunks = [group[c:c + chunk_size] for group in missing.values()
+                          for c in range(0, len(group), chunk_size)]
+                # Align missing pairs (results are in the same order as chunks)
+                results = pool.map(run, [[batch[k] for k in chunk] for chunk in chunks])
+                results = ((k, result) for chunk, chunk_results in zip(chunks, results)
+                           for k, result in zip(chunk, chunk_results))
+                # Loop through each alignment, as soon as it is done
+                for k, result in results:
+                    # Case alignment failed: scores are not available
+                    if result is None:
+                        scores[k] = np.nan, np.nan
+                        continue
+                    # Otherwise, store scores
+                    align_len, rmsd, tm_score, seq_id = result
+                    scores[k] = rmsd, tm_score
+                    # Store alignment in cache, if any
+                    if db is not None:
+                        i, j = batch[k]
+                        db.execute('INSERT OR REPLACE INTO alignments VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                   (hashes[i], hashes[j], key, align_len, rmsd, tm_score, seq_id))
+                        # Commit stored alignments once in a while
+                        stored += 1
+                        if stored % COMMIT_EVERY == 0:
+                            db.commit()
+                # Commit batch, then yield its scores
+                if db is not None:
+                    db.commit()
+                for (i, j), (rmsd, tm_score) in zip(batch, scores):
+                    yield i, j, rmsd, tm_score
+                # Update progress
+                progress.update(len(batch))
+
+    # Store alignments done so far, even if interrupted
+    finally:
+        if db is not None:
+            db.commit()
+            db.close()
+
+
+# Check whether two structures have been declared related, either by accession or by pair
+def _is_related(related, name1, name2):
+    # Case accessions are given: structures with the same accession are related
+    if isinstance(related, dict):
+        return name1 in related and name2 in related and related[name1] == related[name2]
+    # Otherwise, related pairs are listed (either direction)
+    return (name1, name2) in related or (name2, name1) in related
+
+
+# Superpose pairs of structures whose residue correspondence is known, all at once
+def _superpose_pairs(pdb_paths, pairs, mappings, store=None, related=None):
+    # Define index (get only file name)
+    index = names(pdb_paths)
+    # Define related structures, whose residues are matched by number
+    related = related if isinstance(related, dict) else {tuple(pair) for pair in (related or ())}
+    # Keep only pairs whose residue correspondence is known
+    if mappings == 'number':
+        pairs = [(i, j) for i, j in pairs if _is_related(related, index[i], index[j])]
+    else:
+        pairs = [(i, j) for i, j in pairs if (index[i], index[j]) in mappings or (index[j], index[i]) in mappings]
+    # Read CA residues and coordinates of involved structures only
+    structures = {k: pdb.load_ca(pdb_paths[k], store) for k in sorted({k for pair in pairs for k in pair})}
+    # Define matched coordinates of each pair having a mapping
+    matched, coords1, coords2, lengths = list(), list(), list(), list()
+    for i, j in pairs:
+        # Retrieve residues and coordinates of both structures
+        (residues1, xyz1), (residues2, xyz2) = structures[i], structures[j]
+        # Case residues are matched by number
+        if mappings == 'number':
+            index1, index2 = superpose.by_number(residues1, residues2)
+        # Otherwise, mapping is given for either pair direction
+        else:
+            mapped1, mapped2 = mappings[(index[i], index[j])] if (index[i], index[j]) in mappings \
+                else mappings[(index[j], index[i])][::-1]
+            # Keep mapped residues which are actually in both structures
+            positions1 = {number: k for k, number in enumerate(residues1)}
+            positions2 = {number: k for k, number in enumerate(residues2)}
+            mapped = [(positions1[a], positions2[b]) for a, b in zip(mapped1, mapped2)
+                      if a in positions1 and b in positions2]
+            index1, index2 = (np.array(curr, dtype=np.int64) for curr in zip(*mapped)) if mapped else ([], [])
+        # Skip pairs with too few corresponding residues for a superposition
+        if len(index1) < 3:
+            continue
+        # Store matched coordinates, normalize by average length
+        matched.append((i, j))
+        coords1.append(xyz1[index1])
+        coords2.append(xyz2[index2])
+        lengths.append((len(residues1) + len(residues2)) / 2)
+    # Compute scores of every matched pair at once
+    rmsd, tm_score = superpose.superpose(coords1, coords2, lengths)
+    # Return scores for each matched pair
+    return {pair: (float(rmsd[k]), float(tm_score[k])) for k, pair in enumerate(matched)}
+
+
 # Execute multiple pairwise alignment
-def multi_align(pdb_paths, triangular=True, script_path=SCRIPT_PATH):
+def multi_align(pdb_paths, triangular=True, script_path=SCRIPT_PATH, num_workers=None, verbose=False,
+                options=(), cache_path=None, previous=None, chunk_size=None, mappings=None, store=None,
+                related=None):
+    """
+    Only pairs which are neither in previous matrices nor in cache are aligned,
+    hence adding k PDB files to n already aligned ones requires about n * k
+    alignments only (see align_pairs(...)). Pairs whose residue correspondence
+    is already known (e.g. NMR models of the same protein, or SIFTS mapped
+    chains) are not aligned: their CA coordinates are superposed all at once
+    instead (see superpose.scores(...)), and TM-score is normalized by the
+    average length of both chains, as TMalign -a T does. Since superposition
+    does not search for the best alignment, its scores are not the ones TMalign
+    would find (its TM-score is a lower bound): superposition scores are returned
+    in their own matrices, while TMalign matrices are NaN for superposed pairs,
+    so that the two are never mixed unknowingly (e.g. tm_mat.fillna(sup_tm_mat)
+    combines them explicitly).
+    Input:
+        1. pdb_paths:   paths to PDB files
+        2. triangular:  whether to align each pair once (matrices are symmetric)
+        3. script_path: path to TMalign executable
+        4. num_workers: number of concurrent TMalign processes (default number of cores)
+        5. verbose:     whether to show a progress bar
+        6. options:     further TMalign options
+        7. cache_path:  path to SQLite database storing alignments (default None, no cache)
+        8. previous:    (RMSD, 1 - TM-score) TMalign matrices previously returned by this function,
+                        whose pairs are reused (PDB files are identified by file name, NaN pairs are
+                        either aligned or superposed again),
+                        allowed for triangular alignments only
+        9. chunk_size:  maximum number of pairs aligned by a single TMalign process (see align_pairs(...))
+        10. mappings:   dictionary mapping (name1, name2) pairs of PDB file names to (residues1, residues2)
+                        arrays of corresponding residue numbers (first chain of first model),
+                        or 'number' to match residues with the same number in related pairs only
+        11. store:      pdb.Structures store, where CA coordinates are loaded from (if stored)
+        12. related:    structures whose residues can be matched by number (required by 'number' mappings),
+                        either as dictionary mapping PDB file names to accessions (structures with the
+                        same accession are related) or as iterable of (name1, name2) pairs
+    Output:
+        1. RMSD matrix, as dataframe indexed by PDB file names
+        2. 1 - TM-score matrix, as dataframe indexed by PDB file names
+        3. RMSD matrix of superposed pairs, NaN for other pairs (returned only if mappings are set)
+        4. 1 - TM-score matrix of superposed pairs, NaN for other pairs (returned only if mappings are set)
+    """
+    # Check that residues are matched by number only within related structures
+    if isinstance(mappings, str) and related is None:
+        raise ValueError("'number' mappings require related structures to be declared")
     # Define index (get only file name)
-    index = [re.search(r'/(\w+)?[.\w]+$', pdb_path).group(1) for pdb_path in pdb_paths]
+    index = names(pdb_paths)
     # Define number of PDBs
     n = len(pdb_paths)
     # Define a squared matrix containing scores for each PDB pair
-    rmsd_mat = np.zeros(shape=(n, n), dtype=np.float)  # RMSD
+    rmsd_mat = np.zeros(shape=(n, n), dtype=np.float64)  # RMSD
     tm_mat =  rmsd_mat.copy()  # TM score
 
+    # Define pairs (rows, columns) to align
+    pairs = [(i, j) for i in range(n) for j in range(n) if not (triangular and j <= i)]
+
+    # Check that previous matrices can be reused (a single direction of each pair is stored)
+    if previous is not None and not triangular:
+        raise ValueError('previous matrices can be reused by triangular alignments only')
+    # Retrieve pairs from previous matrices (failed alignments, as well as superposed pairs, are run again)
+    known = dict()
+    if previous is not None:
+        # Map previous PDB names to previous matrix positions
+        prev_rmsd, prev_tm = previous[0].values, previous[1].values
+        prev_index = {name: k for k, name in enumerate(previous[0].index)}
+        # Loop through each pair whose PDB files were both in previous matrices
+        for i, j in pairs:
+            k, l = prev_index.get(index[i]), prev_index.get(index[j])
+            if k is not None and l is not None and not np.isnan(prev_rmsd[k, l]) and not np.isnan(prev_tm[k, l]):
+                known[(i, j)] = prev_rmsd[k, l], 1 - prev_tm[k, l]
+
+    # Superpose pairs whose residue correspondence is known (they are not aligned by TMalign)
+    superposed = dict()
+    if mappings is not None:
+        superposed = _superpose_pairs(pdb_paths, [pair for pair in pairs if pair not in known], mappings, store,
+                                      related)
+        pairs = [pair for pair in pairs if pair not in superposed]
+
     # Fill matrix
-    for i in range(n):  # Rows
-        for j in range(n):  # Columns
-            # Check in triangular
-            if triangular and j <= i: continue
-            # Execute pairwise alignment
-            align_out = align(pdb_paths[i], pdb_paths[j], script_path=script_path)
-            # Parse alignment results
-            chains, _, rmsd, tm_score, _ = parse(align_out)
-            # Store scores
-            tm_mat[i, j] = tm_mat[j, i] = 1 - tm_score
-            rmsd_mat[i, j] = rmsd_mat[j, i] = rmsd
-
-    # Return filled matrices
+    for i, j, rmsd, tm_score in align_pairs(pdb_paths, pairs, script_path=script_path, num_workers=num_workers,
+                                            verbose=verbose, options=options, cache_path=cache_path,
+                                            known=lambda i, j: known.get((i, j)), total=len(pairs),
+                                            chunk_size=chunk_size):
+        # Store scores
+        tm_mat[i, j] = tm_mat[j, i] = 1 - tm_score
+        rmsd_mat[i, j] = rmsd_mat[j, i] = rmsd
+
+    # Define matrices
+    rmsd_mat = pd.DataFrame(data=rmsd_mat, index=index, columns=index)
+    tm_mat = pd.DataFrame(data=tm_mat, index=index, columns=index)
+    # Case no mapping has been given: return TMalign matrices only
+    if mappings is None:
+        return rmsd_mat, tm_mat
+    # Otherwise, move superposition scores to their own matrices
+    sup_rmsd_mat, sup_tm_mat = np.full((n, n), np.nan), np.full((n, n), np.nan)
+    for (i, j), (rmsd, tm_score) in superposed.items():
+        rmsd_mat.iat[i, j] = rmsd_mat.iat[j, i] = tm_mat.iat[i, j] = tm_mat.iat[j, i] = np.nan
+        sup_rmsd_mat[i, j] = sup_rmsd_mat[j, i] = rmsd
+        sup_tm_mat[i, j] = sup_tm_mat[j, i] = 1 - tm_score
+    # Return TMalign matrices, then superposition ones
+    return (rmsd_mat, tm_mat,
+            pd.DataFrame(data=sup_rmsd_mat, index=index, columns=index),
+            pd.DataFrame(data=sup_tm_mat, index=index, columns=index))
+
+
+# Superpose every pair of models of a structure (e.g. NMR models), all at once
+def multi_model(pdb_path, chain=None, store=None):
+    """
+    Models of the same structure share residue numbering: residues are matched
+    by number, then CA coordinates are superposed (see superpose.scores(...))
+    without running TMalign, which reads the first model only. TM-score is
+    normalized by the average length of both models.
+    Input:
+        1. pdb_path:    path to PDB file
+        2. chain:       chain identifier (default first chain of first model)
+        3. store:       pdb.Structures store, where CA coordinates are loaded from (if stored)
+    Output:
+        1. RMSD matrix, as dataframe indexed by model number
+        2. 1 - TM-score matrix, as dataframe indexed by model number
+    """
+    # Read chain in every model
+    models = pdb.load_models(pdb_path, store, chain=chain)
+    index = [model for model, _, _ in models]
+    # Define pairs of models, along with matched coordinates
+    pairs = [(i, j) for i in range(len(models)) for j in range(i + 1, len(models))]
+    matched = [superpose.by_number(models[i][1], models[j][1]) for i, j in pairs]
+    # Compute scores of every pair at once
+    rmsd, tm_score = superpose.superpose([models[i][2][index1] for (i, _), (index1, _) in zip(pairs, matched)],
+                                         [models[j][2][index2] for (_, j), (_, index2) in zip(pairs, matched)],
+                                         [(len(models[i][1]) + len(models[j][1])) / 2 for i, j in pairs])
+    # Fill symmetric matrices
+    rmsd_mat, tm_mat = np.zeros((len(models), len(models))), np.zeros((len(models), len(models)))
+    for k, (i, j) in enumerate(pairs):
+        rmsd_mat[i, j] = rmsd_mat[j, i] = rmsd[k]
+        tm_mat[i, j] = tm_mat[j, i] = 1 - tm_score[k]
+    # Return matrices
     return (pd.DataFrame(data=rmsd_mat, index=index, columns=index),
             pd.DataFrame(data=tm_mat, index=index, columns=index))
 
 
+# Execute multiple pairwise alignment, return condensed distance matrices
+def condensed_align(pdb_paths, out_dir=None, script_path=SCRIPT_PATH, num_workers=None, verbose=False,
+                    options=(), cache_path=None, chunk_size=None):
+    """
+    Each pair is aligned once: RMSD and 1 - TM-score are stored as float32
+    condensed upper triangular vectors, ordered as scipy.spatial.distance.pdist
+    output, hence they can be passed straight to scipy.cluster.hierarchy.linkage.
+    If an output directory is set, vectors are memory mapped .npy files
+    (rmsd.npy, tmscore.npy, along with PDB names in index.txt), otherwise
+    they are kept in memory. Since linkage does not accept NaN, failed
+    alignments are set to the maximum distance instead: 1 for 1 - TM-score,
+    the largest RMSD of successful alignments for RMSD (0 if there is none).
+    Input:
+        1. pdb_paths:   paths to PDB files
+        2. out_dir:     directory where condensed matrices are stored (memory mapped), if any
+        3. script_path: path to TMalign executable
+        4. num_workers: number of concurrent TMalign processes (default number of cores)
+        5. verbose:     whether to show a progress bar
+        6. options:     further TMalign options
+        7. cache_path:  path to SQLite database storing alignments (default None, no cache)
+        8. chunk_size:  maximum number of pairs aligned by a single TMalign process (see align_pairs(...))
+    Output:
+        1. list of PDB file names
+        2. condensed RMSD matrix, as float32 vector of n * (n - 1) / 2 entries
+        3. condensed 1 - TM-score matrix, as float32 vector of n * (n - 1) / 2 entries
+    """
+    # Define index (get only file name)
+    index = names(pdb_paths)
+    # Define number of PDBs and of pairs
+    n = len(pdb_paths)
+    m = n * (n - 1) // 2
+    # Case output directory is set: make memory mapped vectors
+    if out_dir is not None:
+        os.makedirs(out_dir, exist_ok=True)
+        rmsd_vec = np.lib.format.open_memmap(os.path.join(out_dir, 'rmsd.npy'), mode='w+',
+                                             dtype=np.float32, shape=(m, ))
+        tm_vec = np.lib.format.open_memmap(os.path.join(out_dir, 'tmscore.npy'), mode='w+',
+                                           dtype=np.float32, shape=(m, ))
+        # Store PDB names
+        with open(os.path.join(out_dir, 'index.txt'), 'w') as index_file:
+            index_file.write(''.join(name + '\n' for name in index))
+    # Otherwise, keep vectors in memory
+    else:
+        rmsd_vec = np.empty(shape=(m, ), dtype=np.float32)
+        tm_vec = np.empty(shape=(m, ), dtype=np.float32)
+
+    # Define pairs in condensed order (upper triangular, row by row), lazily
+    pairs = ((i, j) for i in range(n) for j in range(i + 1, n))
+    # Fill vectors (k-th pair is k-th condensed entry)
+    for k, (_, _, rmsd, tm_score) in enumerate(align_pairs(pdb_paths, pairs, script_path=script_path,
+                                                           num_workers=num_workers, verbose=verbose,
+                                                           options=options, cache_path=cache_path, total=m,
+                                                           chunk_size=chunk_size)):
+        rmsd_vec[k], tm_vec[k] = rmsd, 1 - tm_score
+
+    # Set failed alignments (NaN scores) to the maximum distance, so that vectors can be clustered
+    failed = np.isnan(rmsd_vec) | np.isnan(tm_vec)
+    if failed.any():
+        warnings.warn('{:d} alignments failed, set to maximum distance'.format(int(failed.sum())))
+        rmsd_vec[failed] = rmsd_vec[~failed].max() if not failed.all() else 0
+        tm_vec[failed] = 1
+    # Flush memory mapped vectors
+    if out_dir is not None:
+        rmsd_vec.flush()
+        tm_vec.flush()
+    # Return names and condensed matrices
+    return index, rmsd_vec, tm_vec
+
+
+# Compute fingerprint of a structure, as the normalized histogram of CA pairwise distances
+def fingerprint(coords, bins=HIST_BINS):
+    # Compute histogram of pairwise distances
+    hist, _ = np.histogram(pdist(coords), bins=bins)
+    # Normalize histogram (structures with less than two residues have an empty histogram)
+    return hist / max(hist.sum(), 1)
+
+
+# Define candidate pairs of similar structures, cheaply
+def candidates(lengths, fingerprints, k=TOP_K, min_length_ratio=MIN_LENGTH_RATIO, block_size=BLOCK_SIZE):
+    """
+    Structures whose length ratio is too low can not reach a useful TM-score,
+    hence they are discarded. Remaining ones are ranked by the L1 distance
+    between their CA distance histograms: the <k> closest to each structure
+    are kept as candidates.
+    Input:
+        1. lengths:             array of number of residues, one for each structure
+        2. fingerprints:        matrix of fingerprints, one row for each structure
+        3. k:                   number of candidates for each structure
+        4. min_length_ratio:    minimum ratio between shorter and longer structure lengths
+        5. block_size:          number of structures ranked at once (bounds memory)
+    Output:
+        1. array of (i, j) candidate pairs, with i < j, sorted and without duplicates
+    """
+    # Define number of structures
+    n = lengths.shape[0]
+    # Define pairs container
+    pairs = [np.zeros((0, 2), dtype=np.int64)]
+    # Loop through each block of structures
+    for start in range(0, n, block_size):
+        # Define rows in current block
+        rows = np.arange(start, min(start + block_size, n))
+        # Compute fingerprint distances against every structure
+        dist = cdist(fingerprints[rows], fingerprints, metric='cityblock')
+        # Discard structures with too different lengths, and structures themselves
+        ratio = np.minimum(lengths[rows, None], lengths) / np.maximum(np.maximum(lengths[rows, None], lengths), 1)
+        dist[ratio < min_length_ratio] = np.inf
+        dist[np.arange(rows.shape[0]), rows] = np.inf
+        # Keep <k> closest structures (if any is left)
+        cols = np.argsort(dist, axis=1, kind='mergesort')[:, :min(k, n)]
+        keep = np.isfinite(np.take_along_axis(dist, cols, axis=1))
+        # Store pairs, smaller index first
+        i, j = np.repeat(rows, cols.shape[1])[keep.ravel()], cols[keep]
+        pairs.append(np.stack([np.minimum(i, j), np.maximum(i, j)], axis=1))
+    # Return unique pairs
+    return np.unique(np.concatenate(pairs), axis=0)
+
+
+# Align each structure against its most similar ones only, return sparse neighbours graph
+def neighbours(pdb_paths, k=TOP_K, min_length_ratio=MIN_LENGTH_RATIO, script_path=SCRIPT_PATH,
+               num_workers=None, verbose=False, options=(), cache_path=None, chunk_size=None, store=None):
+    """
+    Candidate pairs are chosen cheaply (see candidates(...)), using fingerprints
+    computed once for each structure, then only candidates are aligned: about
+    n * k alignments are run instead of n * (n - 1) / 2
+    Input:
+        1. pdb_paths:           paths to PDB files
+        2. k:                   number of candidates for each structure
+        3. min_length_ratio:    minimum ratio between shorter and longer structure lengths
+        4. script_path:         path to TMalign executable
+        5. num_workers:         number of concurrent TMalign processes (default number of cores)
+        6. verbose:             whether to show a progress bar
+        7. options:             further TMalign options
+        8. cache_path:          path to SQLite database storing alignments (default None, no cache)
+        9. chunk_size:          maximum number of pairs aligned by a single TMalign process (see align_pairs(...))
+        10. store:              pdb.Structures store, where CA coordinates are loaded from (if stored)
+    Output:
+        1. dataframe of edges (pdb1, pdb2, rmsd, tm_score), where tm_score is 1 - TM-score
+    """
+    # Define index (get only file name)
+    index = names(pdb_paths)
+    # Read CA coordinates of each structure (first chain, as TMalign does)
+    coords = [pdb.load_ca(pdb_path, store)[1] for pdb_path in pdb_paths]
+    # Compute lengths and fingerprints
+    lengths = np.array([len(curr) for curr in coords], dtype=np.int64)
+    fingerprints = np.array([fingerprint(curr) for curr in coords]).reshape(len(coords), HIST_BINS.shape[0] - 1)
+    # Define candidate pairs
+    pairs = candidates(lengths, fingerprints, k=k, min_length_ratio=min_length_ratio)
+    # Align candidate pairs
+    edges = [(index[i], index[j], rmsd, 1 - tm_score)
+             for i, j, rmsd, tm_score in align_pairs(pdb_paths, pairs.tolist(), script_path=script_path,
+                                                     num_workers=num_workers, verbose=verbose, options=options,
+                                                     cache_path=cache_path, total=pairs.shape[0],
+                                                     chunk_size=chunk_size)]
+    # Return neighbours graph
+    return pd.DataFrame(edges, columns=['pdb1', 'pdb2', 'rmsd', 'tm_score'])
+
+
 # Execute (multiple) pairwise structural alignment
 if __name__ == '__main__':
 
@@ -110,22 +678,48 @@ if __name__ == '__main__':
     parser.add_argument('--script_path', type=str, default=SCRIPT_PATH)
     parser.add_argument('--out_type', type=str, default='rmsd')
     parser.add_argument('--out_path', type=str)
+    parser.add_argument('--num_workers', type=int)
+    parser.add_argument('--verbose', action='store_true')
+    parser.add_argument('--cache_path', type=str, nargs='?', const=CACHE_PATH)
+    parser.add_argument('--condensed_dir', type=str)
+    parser.add_argument('--top_k', type=int)
+    parser.add_argument('--chunk_size', type=int)
     args = parser.parse_args()
 
     # 2. Run alignment
     try:
 
-        # Get rmsd and tm score
-        rmsd, tm_score = multi_align(args.pdb_paths)
-        # Get output scores
-        score = tm_score if args.out_type == 'tmscore' else rmsd
+        # Case condensed output is required: store both matrices as memory mapped vectors
+        if args.condensed_dir:
+            condensed_align(args.pdb_paths, out_dir=args.condensed_dir, script_path=args.script_path,
+                            num_workers=args.num_workers, verbose=args.verbose,
+                            cache_path=args.cache_path or None, chunk_size=args.chunk_size)
+
+        # Case approximate neighbours are required: store sparse neighbours graph (edges list)
+        elif args.top_k:
+            edges = neighbours(args.pdb_paths, k=args.top_k, script_path=args.script_path,
+                               num_workers=args.num_workers, verbose=args.verbose,
+                               cache_path=args.cache_path or None, chunk_size=args.chunk_size)
+            # If output path is defined, write output to file
+            if args.out_path:
+                edges.to_csv(args.out_path, sep='\t', index=False)
+            # Output path not defined: print out results
+            else:
+                print(edges.to_string())
 
-        # If output path is defined, write output to file
-        if args.out_path:
-            score.to_csv(args.out_path, sep='\t')
-        # Output path not defined: print out results
+        # Otherwise, get rmsd and tm score matrices
         else:
-            print(score.to_string())
+            rmsd, tm_score = multi_align(args.pdb_paths, script_path=args.script_path,
+                                         num_workers=args.num_workers, verbose=args.verbose,
+                                         cache_path=args.cache_path or None, chunk_size=args.chunk_size)
+            # Get output scores
+            score = tm_score if args.out_type == 'tmscore' else rmsd
+            # If output path is defined, write output to file
+            if args.out_path:
+                score.to_csv(args.out_path, sep='\t')
+            # Output path not defined: print out results
+            else:
+                print(score.to_string())
 
     # 3. Catch eventual errors
     except subprocess.CalledProcessError as e:
@@ -109,7 +109,7 @@ if __name__ == '__main__':
     # Check status
     assert status, 'Error while retrieving fasta result'
     # Check fasta format
-    assert sum([1 for c in result if c == '>']) == 3, 'Error: format is not fasta'
+    assert result.count('>') == 3, 'Error: format is not fasta'
 
     # Test query results
     status, result, response = make_query(query='insulin', params={
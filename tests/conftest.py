@@ -0,0 +1,42 @@
+##########################
+### SHARED TEST SET UP ###
+##########################
+
+
+# Dependencies
+import os
+import sys
+import stat
+import pytest
+
+
+# Constants
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))  # Repository root
+PDB_DIR = os.path.join(ROOT_DIR, 'data', 'pdb')  # PDB files shipped with the repository
+
+# Make modules importable as package (e.g. from modules import hmm)
+sys.path.insert(0, ROOT_DIR)
+
+
+# Write fake executables into a directory put in front of PATH
+@pytest.fixture
+def fake_bin(tmp_path, monkeypatch):
+    """
+    Output:
+        1. function writing an executable, given its name and its Python source
+           (run by the same interpreter running tests)
+    """
+    # Define directory of fake executables
+    bin_dir = tmp_path / 'bin'
+    bin_dir.mkdir()
+    monkeypatch.setenv('PATH', str(bin_dir) + os.pathsep + os.environ.get('PATH', ''))
+
+    # Define function writing a single executable
+    def write(name, source):
+        path = bin_dir / name
+        path.write_text('#!{:s}\n{:s}'.format(sys.executable, source))
+        path.chmod(path.stat().st_mode | stat.S_IXUSR)
+        return str(path)
+
+    # Return writer
+    return write
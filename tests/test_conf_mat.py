@@ -0,0 +1,34 @@
+##################################
+### RESULTS EVALUATION LIBRARY ###
+##################################
+
+
+# Dependencies
+import pandas as pd
+from modules import conf_mat
+
+
+def test_matches_single_residue_covers_that_residue():
+    protein_matching = pd.DataFrame({'entry_ac': ['A', 'B', 'C'], 'matches': ['3..6,12', '4', None]})
+    intervals = conf_mat.matches(protein_matching)
+    assert intervals.values.tolist() == [['A', 3, 6], ['A', 12, 13], ['B', 4, 5]]
+    # Single residues are covered, hence their proteins are matched
+    proteins = pd.DataFrame({'entry_ac': ['A', 'B', 'C'], 'len': [20, 10, 10]})
+    covered, offsets, matched = conf_mat.coverage(proteins, intervals)
+    assert covered[offsets[0]:offsets[1]].nonzero()[0].tolist() == [2, 3, 4, 11]
+    assert covered[offsets[1]:offsets[2]].nonzero()[0].tolist() == [3]
+    assert matched.tolist() == [True, True, False]
+
+
+def test_empty_intervals_do_not_match():
+    # As sets of positions built from ranges, 5..5 covers no residue
+    proteins = pd.DataFrame({'entry_ac': ['A', 'B'], 'len': [10, 10]})
+    intervals = conf_mat.matches(pd.DataFrame({'entry_ac': ['A', 'B'], 'matches': ['5..5', '2..4']}))
+    covered, _, matched = conf_mat.coverage(proteins, intervals)
+    assert int(covered.sum()) == 2
+    assert matched.tolist() == [False, True]
+
+
+def test_matches_without_ranges():
+    intervals = conf_mat.matches(pd.DataFrame({'entry_ac': [], 'matches': []}))
+    assert intervals.empty and list(intervals.columns) == ['entry_ac', 'seq_start', 'seq_end']
@@ -0,0 +1,64 @@
+####################################
+### ENSEMBLE AND MAJORITY VOTING ###
+####################################
+
+
+# Dependencies
+import numpy as np
+import pandas as pd
+import pytest
+from modules import ensemble
+
+
+def test_intervals_split_positions_into_runs():
+    model_out = pd.DataFrame({'entry_ac': ['A', 'A', 'B', 'C'],
+                              'positive': [{1, 2, 3, 7, 8}, {5}, set(), {10, 11}]})
+    # Each run of consecutive positions is an interval on its own, empty sets are dropped
+    out = ensemble.intervals(model_out)
+    assert out.values.tolist() == [['A', 1, 4], ['A', 7, 9], ['A', 5, 6], ['C', 10, 12]]
+
+
+def test_intervals_keep_boundaries():
+    model_out = pd.DataFrame({'entry_ac': ['A', 'B'], 'seq_start': [3, 10], 'seq_end': [9, 20]})
+    assert ensemble.intervals(model_out).values.tolist() == [['A', 3, 9], ['B', 10, 20]]
+
+
+def test_intervals_without_positions():
+    out = ensemble.intervals(pd.DataFrame({'entry_ac': [], 'positive': []}))
+    assert out.empty and list(out.columns) == ['entry_ac', 'seq_start', 'seq_end']
+
+
+def test_positives_restore_legacy_schema():
+    models_out = [pd.DataFrame({'entry_ac': ['A', 'A'], 'positive': [{1, 2, 3}, {20, 21}]}),
+                  pd.DataFrame({'entry_ac': ['A'], 'positive': [{1, 2, 3, 4}]})]
+    out = ensemble.positives(ensemble.majority_voting(models_out))
+    assert list(out.columns) == ['entry_ac', 'positive']
+    assert sorted(map(sorted, out['positive'])) == [[1, 2, 3, 4], [20, 21]]
+
+
+def test_clusters_link_rows_of_distance_matrix():
+    # Intervals 0 and 1 are close (1 - Jaccard index is 2/7), interval 2 is far from both
+    accessions = np.array(['A', 'A', 'A'], dtype=object)
+    starts, ends = np.array([5, 0, 85]), np.array([35, 30, 105])
+    # Rows of the distance matrix are further than eps: former DBSCAN call did not link them
+    assert ensemble.clusters(accessions, starts, ends).tolist() == [0, 1, 2]
+    # Direct clustering links intervals on their own distance
+    assert ensemble.clusters(accessions, starts, ends, direct=True).tolist() == [0, 0, 1]
+
+
+def test_clusters_match_former_dbscan():
+    cluster = pytest.importorskip('sklearn.cluster')
+    # Define random intervals, for many accessions (sorted)
+    rng = np.random.default_rng(0)
+    sizes = rng.integers(1, 12, 300)
+    accessions = np.array(['P{:04d}'.format(k) for k in np.repeat(np.arange(sizes.shape[0]), sizes)], dtype=object)
+    starts = rng.integers(0, 100, sizes.sum())
+    ends = starts + rng.integers(1, 60, sizes.sum())
+    # Cluster all accessions at once, with default settings
+    labels = ensemble.clusters(accessions, starts, ends)
+    # Compare against the former DBSCAN call on sets of positions, one accession at a time
+    for first, size in zip(np.cumsum(sizes) - sizes, sizes):
+        positive = [set(range(start, end)) for start, end in zip(starts[first:first + size], ends[first:first + size])]
+        matrix = np.array([[1 - len(curr & other) / len(curr | other) for other in positive] for curr in positive])
+        expected = cluster.DBSCAN(eps=0.4, min_samples=1).fit_predict(matrix) if size > 1 else [0]
+        assert labels[first:first + size].tolist() == list(expected)
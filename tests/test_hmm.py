@@ -0,0 +1,171 @@
+##################
+### HMM MODELS ###
+##################
+
+
+# Dependencies
+import io
+import os
+import numpy as np
+import pandas as pd
+import pytest
+from modules import hmm
+from benchmarks import hmm_parse
+
+
+# Fake jackhmmer: writes a checkpoint model and alignment for each iteration
+JACKHMMER = r'''
+import os, sys
+args = sys.argv[1:]
+value = lambda flag: args[args.index(flag) + 1]
+num_iterations = int(value('-N'))
+with open(os.environ['CALLS_PATH'], 'a') as calls:
+    calls.write('jackhmmer -N {:d}\n'.format(num_iterations))
+for i in range(1, num_iterations + 1):
+    with open('{:s}-{:d}.hmm'.format(value('--chkhmm'), i), 'w') as model_file:
+        model_file.write('jackhmmer model {:d}\n'.format(i))
+    with open('{:s}-{:d}.sto'.format(value('--chkali'), i), 'w') as ali_file:
+        ali_file.write('# STOCKHOLM 1.0\nq1/1-4 ACDE\njack{:d}/1-4 ACDE\n//\n'.format(i))
+with open(value('--domtblout'), 'w') as domtbl_file:
+    domtbl_file.write('T1 - 100 q1 - 30 1e-05 50.0 0.1 1 1 1e-06 1e-05 40.0 0.1 1 30 5 35 4 36 0.9 '
+                      'jackhmmer iter-{:d}\n'.format(num_iterations))
+'''
+
+# Fake hmmbuild: records which alignment each model is built from
+HMMBUILD = r'''
+import os, sys
+model_path, msa_path = sys.argv[-2:]
+with open(os.environ['CALLS_PATH'], 'a') as calls:
+    calls.write('hmmbuild {:s} {:s}\n'.format(os.path.basename(model_path), os.path.basename(msa_path)))
+with open(model_path, 'w') as model_file:
+    model_file.write('built from {:s}\n'.format(os.path.basename(msa_path)))
+'''
+
+# Fake hmmsearch: includes a hit named after the searched model (never converges)
+HMMSEARCH = r'''
+import os, sys
+args = sys.argv[1:]
+value = lambda flag: args[args.index(flag) + 1] if flag in args else None
+model = os.path.basename(args[-2]).split('.')[0]
+with open(os.environ['CALLS_PATH'], 'a') as calls:
+    calls.write('hmmsearch {:s}\n'.format(os.path.basename(args[-2])))
+if value('-A'):
+    with open(value('-A'), 'w') as ali_file:
+        ali_file.write('# STOCKHOLM 1.0\nhit_{:s}/1-4 ACDE\n//\n'.format(model))
+out = 'T2 - 100 q1 - 30 1e-05 50.0 0.1 1 1 1e-06 1e-05 40.0 0.1 1 30 5 35 4 36 0.9 hmmsearch {:s}\n'.format(model)
+if value('--domtblout'):
+    with open(value('--domtblout'), 'w') as domtbl_file:
+        domtbl_file.write(out)
+else:
+    sys.stdout.write(out)
+'''
+
+
+# Build a domain table row, with the given target, query and e-values
+def row(target, query, e_value, c_e_value, i_e_value):
+    return ' '.join([target, '-', '100', query, '-', '30', e_value, '50.0', '0.1', '1', '1',
+                     c_e_value, i_e_value, '40.0', '0.1', '1', '30', '5', '35', '4', '36', '0.9', 'some protein'])
+
+
+@pytest.fixture
+def hmmer(tmp_path, fake_bin, monkeypatch):
+    # Write fake HMMER executables, logging their calls
+    calls_path = tmp_path / 'calls.txt'
+    calls_path.write_text('')
+    monkeypatch.setenv('CALLS_PATH', str(calls_path))
+    fake_bin('jackhmmer', JACKHMMER)
+    fake_bin('hmmbuild', HMMBUILD)
+    fake_bin('hmmsearch', HMMSEARCH)
+    # Write query and test set
+    (tmp_path / 'query.fasta').write_text('>q1 query\nACDE\n')
+    (tmp_path / 'test.fasta').write_text('>t1\nACDE\n>t2\nACDF\n')
+
+    # Define function retrieving (and resetting) calls issued so far
+    def calls():
+        issued = calls_path.read_text().splitlines()
+        calls_path.write_text('')
+        return issued
+
+    # Return paths and calls retriever
+    return str(tmp_path / 'query.fasta'), str(tmp_path / 'test.fasta'), str(tmp_path / 'cache'), calls
+
+
+def test_checkpoint_resumes_from_last_alignment(hmmer):
+    seq_path, test_path, cache_dir, calls = hmmer
+    # First search runs jackhmmer for the required iterations
+    out = hmm.test_checkpoint(seq_path, test_path, num_iterations=2, cache_dir=cache_dir)
+    assert 'jackhmmer iter-2' in out
+    assert calls() == ['jackhmmer -N 2']
+    # Further iterations build iter-i.hmm from iter-(i-1).sto, then search it
+    out = hmm.test_checkpoint(seq_path, test_path, num_iterations=4, cache_dir=cache_dir)
+    assert 'hmmsearch iter-4' in out
+    assert calls() == ['hmmbuild iter-3.hmm iter-2.sto', 'hmmsearch iter-3.hmm',
+                       'hmmbuild iter-4.hmm iter-3.sto', 'hmmsearch iter-4.hmm']
+    # Cached iterations are not run again
+    out = hmm.test_checkpoint(seq_path, test_path, num_iterations=3, cache_dir=cache_dir)
+    assert 'hmmsearch iter-3' in out
+    assert calls() == []
+
+
+def test_checkpoint_fewer_iterations_search_their_own_model(hmmer):
+    seq_path, test_path, cache_dir, calls = hmmer
+    # Only the domain table of the last iteration is written by jackhmmer
+    hmm.test_checkpoint(seq_path, test_path, num_iterations=4, cache_dir=cache_dir)
+    calls()
+    # Domain table of an earlier iteration comes from the model of that iteration
+    out = hmm.test_checkpoint(seq_path, test_path, num_iterations=2, cache_dir=cache_dir)
+    assert 'hmmsearch iter-2' in out
+    assert calls() == ['hmmsearch iter-2.hmm']
+
+
+def test_merge_rescales_conditional_e_values_only():
+    # Two shards: the first one reports two sequences, the second one reports one
+    shards = [row('A', 'Q', '1e-05', '2e-05', '3e-05') + '\n' + row('B', 'Q', '0.001', '0.002', '0.003') + '\n',
+              '# comment\n' + row('C', 'Q', '0.0001', '0.0002', '0.0003') + '\n']
+    merged = [line.split() for line in hmm.merge(shards).splitlines()]
+    # Rows are sorted by sequence e-value
+    assert [fields[0] for fields in merged] == ['A', 'C', 'B']
+    # Conditional e-values are rescaled to the number of sequences reported by all shards
+    assert [float(fields[11]) for fields in merged] == pytest.approx([2e-05 * 3 / 2, 2e-04 * 3, 2e-03 * 3 / 2])
+    # Sequence and independent e-values are already comparable: they are kept as they are
+    assert [float(fields[6]) for fields in merged] == pytest.approx([1e-05, 1e-04, 1e-03])
+    assert [float(fields[12]) for fields in merged] == pytest.approx([3e-05, 3e-04, 3e-03])
+
+
+def test_merge_keeps_conditional_e_values_with_dom_z():
+    shards = [row('A', 'Q', '1e-05', '2e-05', '3e-05') + '\n', row('C', 'Q', '0.0001', '0.0002', '0.0003') + '\n']
+    merged = [line.split() for line in hmm.merge(shards, dom_z=10).splitlines()]
+    assert [float(fields[11]) for fields in merged] == pytest.approx([2e-05, 2e-04])
+
+
+def test_parallel_jackhmmer_requires_a_single_iteration(tmp_path):
+    # Each shard would otherwise build its model from its own hits only
+    for num_iterations in (None, 2):
+        with pytest.raises(ValueError):
+            hmm.test_parallel(algorithm=hmm.JACKHMMER, num_shards=2, cache_dir=str(tmp_path), seq_path='query.fasta',
+                              test_path='test.fasta', num_iterations=num_iterations)
+
+
+@pytest.mark.parametrize('num_rows', [0, 1, 50])
+def test_parse_matches_former_row_parser(num_rows):
+    # Synthetic domain table, with UniProt names and descriptions containing spaces
+    result = hmm_parse.table(num_rows)
+    # Formatted output: same values, typed
+    before, after = hmm_parse.parse_rows(result), hmm.parse(result)
+    assert list(after.columns) == list(before.columns)
+    assert list(after.dtypes) == [object, np.int32, np.int32, np.float64]
+    pd.testing.assert_frame_equal(after, before.astype(dict(zip(after.columns, after.dtypes))))
+    # Raw output: same values, each column typed as stated in COLUMNS, descriptions kept whole
+    before, after = hmm_parse.parse_rows(result, raw=True), hmm.parse(result, raw=True)
+    assert list(after.columns) == list(hmm.COLUMNS) and dict(after.dtypes) == hmm.COLUMNS
+    pd.testing.assert_frame_equal(after, before.astype(hmm.COLUMNS))
+    assert all(after.description.str.startswith('Transcriptional coactivator G'))
+
+
+def test_parse_reads_any_source(tmp_path):
+    result = hmm_parse.table(3)
+    expected = hmm.parse(result, raw=True)
+    # Bytes, path to file and file-like object give the same table
+    (tmp_path / 'out.tsv').write_text(result)
+    for source in (result.encode('utf-8'), str(tmp_path / 'out.tsv'), io.StringIO(result)):
+        pd.testing.assert_frame_equal(hmm.parse(source, raw=True), expected)
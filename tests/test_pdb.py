@@ -0,0 +1,81 @@
+###########################
+### PDB FILES RETRIEVAL ###
+###########################
+
+
+# Dependencies
+import os
+import shutil
+import numpy as np
+import pandas as pd
+import pytest
+from modules import pdb
+from conftest import PDB_DIR
+
+
+# PDB files used as fixtures: an X-ray structure and an NMR ensemble
+PDB_IDS = ['1eg3', '1i6c']
+
+
+@pytest.fixture
+def pdb_paths(tmp_path):
+    # Copy fixtures, so that they can be modified
+    paths = list()
+    for pdb_id in PDB_IDS:
+        paths.append(str(tmp_path / (pdb_id + '.pdb')))
+        shutil.copyfile(os.path.join(PDB_DIR, pdb_id + '.pdb'), paths[-1])
+    return paths
+
+
+def test_store_round_trip(tmp_path, pdb_paths):
+    store_dir = pdb.make_store(pdb_paths, store_dir=str(tmp_path / 'store'))
+    with pdb.Structures(store_dir) as store:
+        # Every model and chain is stored, as it is parsed
+        keys = list()
+        for pdb_path in pdb_paths:
+            for model, chain, residues, coords in pdb.read_chains(pdb_path):
+                keys.append((os.path.basename(pdb_path).split('.')[0], model, chain))
+                assert np.array_equal(store[keys[-1]][0], residues)
+                assert np.array_equal(store[keys[-1]][1], coords)
+        assert list(store) == keys
+        # Loaded coordinates are the same as parsed ones, for any model
+        for pdb_path in pdb_paths:
+            assert store.is_current(pdb_path)
+            for model in (None, 2):
+                expected, found = pdb.read_ca(pdb_path, model=model), pdb.load_ca(pdb_path, store, model=model)
+                assert np.array_equal(expected[0], found[0]) and np.array_equal(expected[1], found[1])
+            expected, found = pdb.read_models(pdb_path), pdb.load_models(pdb_path, store)
+            assert [model for model, _, _ in expected] == [model for model, _, _ in found]
+            assert all(np.array_equal(curr[2], other[2]) for curr, other in zip(expected, found))
+
+
+def test_changed_file_is_parsed_again(tmp_path, pdb_paths):
+    store_dir = pdb.make_store(pdb_paths, store_dir=str(tmp_path / 'store'))
+    # Move first CA atom of the first PDB file after it has been stored
+    with open(pdb_paths[0], 'r') as pdb_file:
+        lines = pdb_file.readlines()
+    k = next(k for k, line in enumerate(lines) if line.startswith('ATOM') and line[12:16] == ' CA ')
+    lines[k] = lines[k][:30] + '{:8.3f}'.format(999.0) + lines[k][38:]
+    with open(pdb_paths[0], 'w') as pdb_file:
+        pdb_file.writelines(lines)
+    # Stored coordinates are stale: the file is parsed again
+    with pdb.Structures(store_dir) as store:
+        assert not store.is_current(pdb_paths[0])
+        assert pdb.load_ca(pdb_paths[0], store)[1][0, 0] == pytest.approx(999.0)
+        assert store.is_current(pdb_paths[1])
+
+
+def test_store_without_hashes_is_not_trusted(tmp_path, pdb_paths):
+    store_dir = pdb.make_store(pdb_paths, store_dir=str(tmp_path / 'store'))
+    # Drop hashes, as in stores written before they were introduced
+    index_path = os.path.join(store_dir, pdb.INDEX_FILE)
+    pd.read_csv(index_path, sep='\t', dtype=str).drop(columns='hash').to_csv(index_path, sep='\t', index=False)
+    with pdb.Structures(store_dir) as store:
+        assert not any(store.is_current(pdb_path) for pdb_path in pdb_paths)
+
+
+def test_empty_store(tmp_path):
+    store_dir = pdb.make_store([], store_dir=str(tmp_path / 'store'))
+    with pdb.Structures(store_dir) as store:
+        assert len(store) == 0
+        assert store.coords.shape == (0, 3)
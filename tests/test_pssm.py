@@ -0,0 +1,129 @@
+############
+### PSSM ###
+############
+
+
+# Dependencies
+import os
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+from modules import pssm
+
+
+# Fake makeblastdb: copies test set next to database path (after an optional delay), fails on empty ones
+MAKEBLASTDB = r'''
+import os, sys, time, shutil
+args = sys.argv[1:]
+value = lambda flag: args[args.index(flag) + 1]
+with open(os.environ['CALLS_PATH'], 'a') as calls:
+    calls.write('makeblastdb\n')
+if not os.path.getsize(value('-in')):
+    sys.exit('BLAST Database creation error: empty input')
+time.sleep(float(os.environ.get('BUILD_DELAY', 0)))
+shutil.copyfile(value('-in'), value('-out') + '.seq')
+'''
+
+# Fake psiblast: e-value of each subject is its score (in header) times database size
+PSIBLAST = r'''
+import sys
+args = sys.argv[1:]
+value = lambda flag, default=None: args[args.index(flag) + 1] if flag in args else default
+with open(value('-db') + '.seq', 'r') as db_file:
+    records = [record.split('\n', 1) for record in db_file.read().split('>') if record.strip()]
+db_size = float(value('-dbsize', sum(len(sequence.replace('\n', '')) for _, sequence in records)))
+hits = sorted((float(header.split()[1]) * db_size, header.split()[0]) for header, _ in records)
+hits = [(e_value, name) for e_value, name in hits if e_value <= float(value('-evalue'))]
+for e_value, name in hits[:int(value('-max_target_seqs', 500))]:
+    sys.stdout.write('Q\t{:s}\t100.0\t4\t0\t0\t1\t4\t1\t4\t{:s}\t10.0\n'.format(name, repr(e_value)))
+'''
+
+
+@pytest.fixture
+def blast(tmp_path, fake_bin, monkeypatch):
+    # Write fake BLAST executables, logging database builds
+    calls_path = tmp_path / 'calls.txt'
+    calls_path.write_text('')
+    monkeypatch.setenv('CALLS_PATH', str(calls_path))
+    fake_bin('makeblastdb', MAKEBLASTDB)
+    fake_bin('psiblast', PSIBLAST)
+    # Write an empty model
+    (tmp_path / 'model.pssm').write_text('model\n')
+
+    # Define function retrieving (and resetting) number of database builds so far
+    def builds():
+        issued = calls_path.read_text().splitlines()
+        calls_path.write_text('')
+        return len(issued)
+
+    # Return model path and builds counter
+    return str(tmp_path / 'model.pssm'), builds
+
+
+# Write test set, given (name, score) pairs, each sequence 10 residues long
+def write_test(path, scores):
+    path.write_text(''.join('>{:s} {:g}\nACDEFGHIKL\n'.format(name, score) for name, score in scores))
+    return str(path)
+
+
+def test_incremental_reports_subjects_freed_by_removals(tmp_path, blast):
+    model_path, _ = blast
+    scores = [('P{:d}'.format(k), 1e-3 * (k + 1)) for k in range(6)]
+    # First search keeps the best subjects only
+    test_path = write_test(tmp_path / 'test.fasta', scores)
+    out = pssm.test_incremental(model_path, test_path, e_value=10, max_target_seqs=3,
+                                cache_dir=str(tmp_path / 'incremental'))
+    assert [row.split('\t')[1] for row in out.strip().split('\n')] == ['P0', 'P1', 'P2']
+    # Best subjects are removed: unchanged ones, formerly left out, are reported
+    test_path = write_test(tmp_path / 'test.fasta', scores[2:])
+    out = pssm.test_incremental(model_path, test_path, e_value=10, max_target_seqs=3,
+                                cache_dir=str(tmp_path / 'incremental'))
+    assert [row.split('\t')[1] for row in out.strip().split('\n')] == ['P2', 'P3', 'P4']
+    # Output is the same as the one of a search from scratch
+    assert out == pssm.test_incremental(model_path, test_path, e_value=10, max_target_seqs=3,
+                                        cache_dir=str(tmp_path / 'scratch'))
+
+
+def test_database_is_built_once(tmp_path, blast):
+    _, builds = blast
+    test_path = write_test(tmp_path / 'test.fasta', [('P0', 1e-3)])
+    cache_dir = str(tmp_path / 'blastdb')
+    # Same test set: database is retrieved from cache
+    db_path = pssm.make_db(test_path, cache_dir=cache_dir)
+    assert pssm.make_db(test_path, cache_dir=cache_dir) == db_path
+    assert builds() == 1
+    # Different options: a new database is built
+    pssm.make_db(test_path, cache_dir=cache_dir, options=())
+    assert builds() == 1
+
+
+def test_changed_test_set_evicts_stale_database(tmp_path, blast):
+    _, builds = blast
+    cache_dir = str(tmp_path / 'blastdb')
+    db_path = pssm.make_db(write_test(tmp_path / 'test.fasta', [('P0', 1e-3)]), cache_dir=cache_dir)
+    # Content changed: database is built again, the one of the former content is removed
+    new_path = pssm.make_db(write_test(tmp_path / 'test.fasta', [('P1', 1e-3)]), cache_dir=cache_dir)
+    assert builds() == 2 and new_path != db_path
+    assert [key for key, _, _ in pssm.cache.entries(cache_dir)] == [os.path.basename(os.path.dirname(new_path))]
+    assert not os.path.exists(os.path.dirname(db_path))
+
+
+def test_concurrent_builds_share_database(tmp_path, blast, monkeypatch):
+    _, builds = blast
+    monkeypatch.setenv('BUILD_DELAY', '0.2')
+    test_path = write_test(tmp_path / 'test.fasta', [('P{:d}'.format(k), 1e-3) for k in range(100)])
+    # Build the same database concurrently
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        paths = list(pool.map(lambda _: pssm.make_db(test_path, cache_dir=str(tmp_path / 'blastdb')), range(4)))
+    # Database has been built once, and it is complete
+    assert len(set(paths)) == 1 and builds() == 1
+    assert open(paths[0] + '.seq').read() == open(test_path).read()
+
+
+def test_parallel_search_skips_empty_shards(tmp_path, blast):
+    model_path, builds = blast
+    test_path = write_test(tmp_path / 'test.fasta', [('P0', 1e-3), ('P1', 2e-3)])
+    # There are more shards than sequences: only one shard for each sequence is built
+    out = pssm.test_parallel(model_path, test_path, num_shards=8, e_value=10, cache_dir=str(tmp_path / 'shards'))
+    assert builds() == 2
+    # Hits are the same as the ones of a single search
+    assert [row.split('\t')[1] for row in out.strip().split('\n')] == ['P0', 'P1']
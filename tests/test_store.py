@@ -0,0 +1,58 @@
+######################################
+### CONTENT ADDRESSED MODELS STORE ###
+######################################
+
+
+# Dependencies
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from modules import store
+
+
+# Define a model builder, counting how many times it has been run
+def counted(delay=0.0):
+    # Define builds counter
+    builds = list()
+    lock = threading.Lock()
+
+    # Define builder, writing a placeholder model file
+    def build(model_path):
+        time.sleep(delay)
+        with lock:
+            builds.append(model_path)
+        with open(model_path, 'w') as model_file:
+            model_file.write('model\n')
+
+    # Return builder and counter
+    return build, builds
+
+
+def test_model_is_fitted_once(tmp_path):
+    msa_path = tmp_path / 'family.sto'
+    msa_path.write_text('# STOCKHOLM 1.0\n//\n')
+    build, builds = counted()
+    # Same alignment, kind and options: model is retrieved from store
+    path1 = store.fit(build, [str(msa_path)], 'hmm', name='PF1', store_dir=str(tmp_path / 'store'))
+    path2 = store.fit(build, [str(msa_path)], 'hmm', name='PF2', store_dir=str(tmp_path / 'store'))
+    assert path1 == path2 and len(builds) == 1
+    # Different options: a new model is fitted
+    store.fit(build, [str(msa_path)], 'hmm', options=['--fast'], store_dir=str(tmp_path / 'store'))
+    assert len(builds) == 2
+    # Stored models keep every name they have been given
+    found = store.models(name='PF2', store_dir=str(tmp_path / 'store'))
+    assert [model['path'] for model in found] == [path1]
+    assert found[0]['names'] == ['PF1', 'PF2']
+
+
+def test_concurrent_fits_build_once(tmp_path):
+    msa_path = tmp_path / 'family.sto'
+    msa_path.write_text('# STOCKHOLM 1.0\n//\n')
+    build, builds = counted(delay=0.1)
+    # Fit the same model concurrently, each time with a different name
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        paths = list(pool.map(lambda k: store.fit(build, [str(msa_path)], 'hmm', name='N{:d}'.format(k),
+                                                  store_dir=str(tmp_path / 'store')), range(4)))
+    # Model has been built once, and it kept every name
+    assert len(set(paths)) == 1 and len(builds) == 1
+    assert sorted(store.models(store_dir=str(tmp_path / 'store'))[0]['names']) == ['N0', 'N1', 'N2', 'N3']
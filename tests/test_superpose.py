@@ -0,0 +1,71 @@
+################################
+### STRUCTURAL SUPERPOSITION ###
+################################
+
+
+# Dependencies
+import numpy as np
+import pytest
+from scipy.spatial.transform import Rotation
+from modules import superpose
+
+
+# Define random coordinates, as a chain of residues 3.8 Angstrom apart
+def chain(rng, length):
+    steps = rng.normal(size=(length, 3))
+    return np.cumsum(3.8 * steps / np.linalg.norm(steps, axis=1, keepdims=True), axis=0)
+
+
+def test_rigid_motion_is_recovered():
+    rng = np.random.default_rng(0)
+    coords1 = chain(rng, 50)
+    rotation = Rotation.random(random_state=1).as_matrix()
+    coords2 = coords1 @ rotation + np.array([10.0, -5.0, 3.0])
+    # Rotation and translation superpose first structure onto second one exactly
+    found, translation = superpose.kabsch(coords1[None], coords2[None])
+    assert np.allclose(coords1 @ found[0] + translation[0], coords2, atol=1e-8)
+    # Identical structures (up to rigid motion) have null RMSD and unitary TM-score
+    rmsd, tm_score = superpose.superpose([coords1], [coords2])
+    assert rmsd[0] == pytest.approx(0, abs=1e-8)
+    assert tm_score[0] == pytest.approx(1)
+
+
+def test_mirror_image_is_not_superposed():
+    rng = np.random.default_rng(2)
+    coords = chain(rng, 40)
+    # Rotations are proper: a mirrored structure can not be superposed onto the original one
+    rotation, _ = superpose.kabsch(coords[None], (coords * np.array([-1, 1, 1]))[None])
+    assert np.linalg.det(rotation[0]) == pytest.approx(1)
+    rmsd, _ = superpose.superpose([coords], [coords * np.array([-1, 1, 1])])
+    assert rmsd[0] > 1
+
+
+def test_scores_match_definition():
+    rng = np.random.default_rng(3)
+    coords1 = chain(rng, 30)
+    coords2 = coords1 + rng.normal(scale=1.0, size=coords1.shape)
+    rmsd, tm_score = superpose.superpose([coords1], [coords2], lengths=[40])
+    # Compute scores from optimal superposition
+    rotation, translation = superpose.kabsch(coords1[None], coords2[None])
+    distances = np.linalg.norm(coords1 @ rotation[0] + translation[0] - coords2, axis=1)
+    d0 = 1.24 * np.cbrt(40 - 15) - 1.8
+    assert rmsd[0] == pytest.approx(np.sqrt(np.mean(distances ** 2)))
+    assert tm_score[0] == pytest.approx(np.sum(1 / (1 + (distances / d0) ** 2)) / 40)
+
+
+def test_padded_pairs_are_scored_independently():
+    rng = np.random.default_rng(4)
+    coords1 = [chain(rng, length) for length in (10, 35, 20)]
+    coords2 = [curr + rng.normal(scale=0.5, size=curr.shape) for curr in coords1]
+    # Scoring pairs of different lengths at once gives the same scores as one pair at a time
+    rmsd, tm_score = superpose.superpose(coords1, coords2)
+    for k in range(3):
+        expected_rmsd, expected_tm_score = superpose.superpose([coords1[k]], [coords2[k]])
+        assert rmsd[k] == pytest.approx(expected_rmsd[0])
+        assert tm_score[k] == pytest.approx(expected_tm_score[0])
+
+
+def test_residues_are_matched_by_number():
+    index1, index2 = superpose.by_number(np.array([5, 6, 7, 9]), np.array([1, 6, 7, 8, 9]))
+    assert index1.tolist() == [1, 2, 3]
+    assert index2.tolist() == [1, 2, 4]
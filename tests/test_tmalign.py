@@ -0,0 +1,70 @@
+##########################
+### TMALIGN ALIGNMENTS ###
+##########################
+
+
+# Dependencies
+import os
+import shutil
+import numpy as np
+import pytest
+from modules import tmalign
+from conftest import PDB_DIR
+
+
+# Fake TMalign: reports the same scores for any pair, logging aligned pairs (list mode is not supported)
+TMALIGN = r'''
+import os, sys
+if sys.argv[1:] == ['-h']:
+    sys.exit(0)
+name1, name2 = (os.path.basename(path).split('.')[0] for path in sys.argv[-2:])
+with open(os.environ['CALLS_PATH'], 'a') as calls:
+    calls.write('{:s} {:s}\n'.format(name1, name2))
+sys.stdout.write('Name of Chain_1: {:s}\nName of Chain_2: {:s}\n'
+                 'Length of Chain_1: 50 residues\nLength of Chain_2: 50 residues\n\n'
+                 'Aligned length=   40, RMSD=   2.50, Seq_ID=n_identical/n_aligned= 0.300\n'
+                 'TM-score= 0.60000 (normalized by length of Chain_1)\n'
+                 'TM-score= 0.60000 (normalized by length of Chain_2)\n'
+                 'TM-score= 0.60000 (normalized by average length of chains)\n'.format(name1, name2))
+'''
+
+
+@pytest.fixture
+def pdb_paths(tmp_path, fake_bin, monkeypatch):
+    # Write fake TMalign, logging aligned pairs
+    calls_path = tmp_path / 'calls.txt'
+    calls_path.write_text('')
+    monkeypatch.setenv('CALLS_PATH', str(calls_path))
+    script_path = fake_bin('TMalign', TMALIGN)
+    # Copy the same NMR structure twice (related), then another structure
+    paths = [str(tmp_path / (name + '.pdb')) for name in ('a1', 'a2', 'b1')]
+    for path, pdb_id in zip(paths, ['1i6c', '1i6c', '1eg3']):
+        shutil.copyfile(os.path.join(PDB_DIR, pdb_id + '.pdb'), path)
+    return paths, script_path, calls_path
+
+
+def test_superposed_scores_are_kept_apart(pdb_paths):
+    paths, script_path, calls_path = pdb_paths
+    rmsd, tm, sup_rmsd, sup_tm = tmalign.multi_align(paths, script_path=script_path, num_workers=1,
+                                                     mappings='number', related={'a1': 'P1', 'a2': 'P1'})
+    # Related pair is superposed, not aligned by TMalign
+    assert sorted(calls_path.read_text().splitlines()) == ['a1 b1', 'a2 b1']
+    # TMalign matrices hold TMalign scores only
+    assert np.isnan(rmsd.loc['a1', 'a2']) and np.isnan(tm.loc['a2', 'a1'])
+    assert rmsd.loc['a1', 'b1'] == pytest.approx(2.5) and tm.loc['b1', 'a2'] == pytest.approx(0.4)
+    # Superposition matrices hold superposition scores only (identical structures)
+    assert sup_rmsd.loc['a1', 'a2'] == pytest.approx(0, abs=1e-6) and sup_tm.loc['a2', 'a1'] == pytest.approx(0)
+    assert np.isnan(sup_rmsd.loc['a1', 'b1']) and np.isnan(sup_tm.loc['b1', 'a2'])
+
+
+def test_without_mappings_every_pair_is_aligned(pdb_paths):
+    paths, script_path, calls_path = pdb_paths
+    rmsd, tm = tmalign.multi_align(paths, script_path=script_path, num_workers=1)
+    assert len(calls_path.read_text().splitlines()) == 3
+    assert not rmsd.isna().values.any() and tm.loc['a1', 'a2'] == pytest.approx(0.4)
+
+
+def test_number_mappings_require_related_structures(pdb_paths):
+    paths, script_path, _ = pdb_paths
+    with pytest.raises(ValueError):
+        tmalign.multi_align(paths, script_path=script_path, mappings='number')